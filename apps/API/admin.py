@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from apps.API.models import RequestLog
+
+
+class RequestLogAdmin(admin.ModelAdmin):
+	date_hierarchy = "requested_at"
+	list_display = ("id", "requested_at", "response_ms", "db_ms", "db_queries", "status_code", "path", "query_params")
+	list_filter = ("view", "status_code")
+	ordering = ("-requested_at",)
+	raw_id_fields = ("user",)
+
+
+admin.site.register(RequestLog, RequestLogAdmin)
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from common.utils.cache import get_cache_stats, get_result_cache, is_shared_cache, local_flight, single_flight
+
+DURATION_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200]
+METRICS_KEY = "request_metrics"
+
+HISTOGRAMS = [
+	("api_request_duration_seconds", "Time to answer a request.", DURATION_BUCKETS),
+	("api_request_db_duration_seconds", "Time spent in the database while answering a request.", DURATION_BUCKETS),
+	("api_request_queries", "SQL statements run to answer a request.", QUERY_BUCKETS),
+]
+
+
+class RequestMetrics:
+	"""
+	Histograms of the timing and query counts of the requests, by URL name. Each worker accumulates its requests
+	in memory and adds them every `flush_interval` seconds to the totals kept in the result cache, so the counters
+	of every worker are summed and keep growing whichever worker answers `/api/metrics`.
+	"""
+
+	def __init__(self, flush_interval):
+		self.flush_interval = flush_interval
+		# (metric, view, bucket) -> value since the last flush, the bucket is None for the sum and "+Inf" for the count
+		self.pending = Counter()
+		self.flushed_at = time.monotonic()
+		self.lock = threading.Lock()
+
+	def add(self, view, seconds, db_seconds, queries):
+		with self.lock:
+			for (name, _, buckets), value in zip(HISTOGRAMS, [seconds, db_seconds, queries]):
+				for bucket in buckets:
+					if value <= bucket:
+						self.pending[name, view, bucket] += 1
+				self.pending[name, view, "+Inf"] += 1
+				self.pending[name, view, None] += value
+
+		if time.monotonic() - self.flushed_at >= self.flush_interval:
+			self.flush()
+
+	def flush(self):
+		"""
+		Add the requests of this worker since the last flush to the shared totals.
+
+		:return: The shared totals
+		"""
+		with self.lock:
+			pending, self.pending = self.pending, Counter()
+			self.flushed_at = time.monotonic()
+
+		result_cache = get_result_cache()
+		# Read, add and write back while holding the lock, so concurrent flushes of other workers are not lost
+		with single_flight(METRICS_KEY) if is_shared_cache(result_cache) else local_flight(METRICS_KEY):
+			totals = result_cache.get(METRICS_KEY, Counter())
+			if pending:
+				totals.update(pending)
+				result_cache.set(METRICS_KEY, totals, None)
+
+		return totals
+
+	def to_prometheus(self):
+		"""
+		Metrics of all the workers in the Prometheus text exposition format.
+		"""
+		totals = self.flush()
+		views = sorted({view for _, view, _ in totals})
+		lines = []
+
+		for name, help_text, buckets in HISTOGRAMS:
+			lines.append(f"# HELP {name} {help_text}")
+			lines.append(f"# TYPE {name} histogram")
+			for view in views:
+				for bucket in [*buckets, "+Inf"]:
+					lines.append(f'{name}_bucket{{view="{view}",le="{bucket}"}} {totals[name, view, bucket]}')
+				lines.append(f'{name}_sum{{view="{view}"}} {totals[name, view, None]:.6f}')
+				lines.append(f'{name}_count{{view="{view}"}} {totals[name, view, "+Inf"]}')
+
+		lines.append("# HELP api_result_cache_events_total Lookups of the batch result cache, shared by all workers.")
+		lines.append("# TYPE api_result_cache_events_total counter")
+		for name, events in get_cache_stats().items():
+			for event, count in events.items():
+				lines.append(f'api_result_cache_events_total{{name="{name}",event="{event}"}} {count}')
+
+		return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics(settings.API_METRICS_FLUSH_INTERVAL)
@@ -1,4 +1,118 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, urlencode
+
+from apps.API.metrics import request_metrics
+from common.utils.cache import get_batch_version
+from common.utils.utils import QueryTimer
+
+
+class RequestMetricsMiddleware:
+	"""
+	Counts the SQL statements and times the database, rendering and whole handling of every request.
+	Results are sent in a `Server-Timing` header and kept by URL name for `/api/metrics`.
+	"""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def process_template_response(self, request, response):
+		# Views have returned, what follows until the response is complete is rendering
+		request.metrics_view_end = time.perf_counter()
+		return response
+
+	def __call__(self, request):
+		timer = QueryTimer()
+		start = time.perf_counter()
+		with connection.execute_wrapper(timer):
+			response = self.get_response(request)
+		end = time.perf_counter()
+
+		view_end = getattr(request, "metrics_view_end", end)
+		response["Server-Timing"] = (
+			f'db;dur={timer.seconds * 1000:.1f};desc="{timer.queries} queries", '
+			f"render;dur={(end - view_end) * 1000:.1f}, "
+			f"total;dur={(end - start) * 1000:.1f}"
+		)
+
+		match = request.resolver_match
+		view = match.view_name if match else "unmatched"
+		request_metrics.add(view, end - start, timer.seconds, timer.queries)
+
+		return response
+
+
+class BatchCacheMiddleware:
+	"""
+	HTTP caching of the API GET responses. Data only changes when a batch is loaded or a maintenance command
+	bumps the data version, so a response is identified by its path, normalized query string and the data
+	version. That identifier is sent as
+	`ETag`: a matching `If-None-Match` is answered with 304 without running the view, and full responses
+	are stored in the `API_CACHE_ALIAS` cache.
+	"""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.cache = caches[settings.API_CACHE_ALIAS]
+
+	def is_cacheable(self, request):
+		return (
+			request.method in ("GET", "HEAD")
+			and request.path.startswith(settings.API_CACHE_PREFIX)
+			and not any(request.path.startswith(path) for path in settings.API_CACHE_EXCLUDE)
+		)
+
+	def get_etag(self, request):
+		query = urlencode(sorted(request.GET.lists()), doseq=True)
+		accept = request.META.get("HTTP_ACCEPT", "")
+		digest = hashlib.md5(f"{get_batch_version()}:{request.path}?{query}:{accept}".encode()).hexdigest()
+
+		return f'W/"{digest}"'
+
+	def set_cache_headers(self, response, etag):
+		response["ETag"] = etag
+		patch_cache_control(response, public=True, max_age=settings.API_CACHE_MAX_AGE, must_revalidate=True)
+
+		return response
+
+	def __call__(self, request):
+		if not self.is_cacheable(request):
+			return self.get_response(request)
+
+		etag = self.get_etag(request)
+		# Weak comparison, as for If-None-Match
+		etags = [tag.removeprefix("W/") for tag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))]
+		if "*" in etags or etag.removeprefix("W/") in etags:
+			return self.set_cache_headers(HttpResponseNotModified(), etag)
+
+		key = f"response:{etag}"
+		cached = self.cache.get(key) if request.method == "GET" else None
+		if cached is not None:
+			content, status, headers = cached
+			return self.set_cache_headers(HttpResponse(content, status=status, headers=headers), etag)
+
+		response = self.get_response(request)
+		if response.status_code != 200 or response.streaming or response.cookies:
+			return response
+
+		if request.method == "GET":
+			self.cache.set(key, (response.content, response.status_code, dict(response.items())))
+
+		return self.set_cache_headers(response, etag)
+
+
 class DynamicSerializeMiddleware:
+	"""
+	Applies `choice` and `exclude` to JSON responses. Views serializing through `get_serialized_data` already
+	leave those fields out of the serializers and queries; this pass covers the rest, e.g. dicts built by views.
+	"""
+
 	def __init__(self, get_response):
 		self.get_response = get_response
 
@@ -0,0 +1,129 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from rest_framework_tracking.base_mixins import BaseLoggingMixin
+
+from apps.API.models import RequestLog
+from common.utils.utils import QueryTimer
+
+logger = logging.getLogger(__name__)
+
+
+class RequestLogBuffer:
+	"""
+	In-memory queue of request logs, written with `bulk_create` by a background thread every `batch_size`
+	records or `flush_interval` seconds. When the queue is full new records are dropped and counted,
+	so a slow database never blocks the requests.
+	"""
+
+	def __init__(self, batch_size, flush_interval, max_size):
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue = queue.Queue(maxsize=max_size)
+		self.dropped = 0
+		self.thread = None
+		self.lock = threading.Lock()
+		atexit.register(self.flush_pending)
+
+	def start(self):
+		with self.lock:
+			if self.thread is None or not self.thread.is_alive():
+				self.thread = threading.Thread(target=self.run, name="request-log-buffer", daemon=True)
+				self.thread.start()
+
+	def put(self, record):
+		if self.thread is None:
+			self.start()
+
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+			if self.dropped == 1 or self.dropped % 1000 == 0:
+				logger.warning(f"Request log queue full, {self.dropped} records dropped")
+
+	def get_batch(self):
+		batch = []
+		deadline = time.monotonic() + self.flush_interval
+		while len(batch) < self.batch_size:
+			timeout = deadline - time.monotonic()
+			if timeout <= 0:
+				break
+			try:
+				batch.append(self.queue.get(timeout=timeout))
+			except queue.Empty:
+				break
+
+		return batch
+
+	def flush(self, batch):
+		try:
+			RequestLog.objects.bulk_create([RequestLog(**record) for record in batch])
+		except Exception:
+			logger.exception(f"Writing {len(batch)} request logs failed")
+		finally:
+			# Flushes are rare, the thread does not keep a connection open in between
+			connection.close()
+
+	def flush_pending(self):
+		batch = []
+		while True:
+			try:
+				batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+
+		if batch:
+			self.flush(batch)
+
+	def run(self):
+		while True:
+			batch = self.get_batch()
+			if batch:
+				self.flush(batch)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_log_buffer():
+	global _buffer
+
+	if _buffer is None:
+		with _buffer_lock:
+			if _buffer is None:
+				_buffer = RequestLogBuffer(
+					settings.API_LOG_BATCH_SIZE, settings.API_LOG_FLUSH_INTERVAL, settings.API_LOG_MAX_QUEUE
+				)
+
+	return _buffer
+
+
+class BufferedLoggingMixin(BaseLoggingMixin):
+	"""
+	Drop-in replacement of drf-api-tracking's LoggingMixin that does not write to the database in the request.
+	Logs are queued and written in bulk by RequestLogBuffer, with the total view time (`response_ms`) and the
+	time spent in the database (`db_ms`, `db_queries`). Successful requests are sampled with
+	`API_LOG_SAMPLE_RATE`, errors are always logged.
+	"""
+
+	def dispatch(self, request, *args, **kwargs):
+		self.query_timer = QueryTimer()
+		with connection.execute_wrapper(self.query_timer):
+			return super().dispatch(request, *args, **kwargs)
+
+	def should_log(self, request, response):
+		if not super().should_log(request, response):
+			return False
+
+		return response.status_code >= 400 or random.random() < settings.API_LOG_SAMPLE_RATE
+
+	def handle_log(self):
+		get_log_buffer().put({**self.log, "db_ms": self.query_timer.ms, "db_queries": self.query_timer.queries})
@@ -0,0 +1,11 @@
+from django.db import models
+from rest_framework_tracking.base_models import BaseAPIRequestLog
+
+
+class RequestLog(BaseAPIRequestLog):
+	"""
+	API request written in bulk by BufferedLoggingMixin, with the time spent in the database.
+	"""
+
+	db_ms = models.PositiveIntegerField(default=0)
+	db_queries = models.PositiveIntegerField(default=0)
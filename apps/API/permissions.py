@@ -0,0 +1,19 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class HasMetricsAccess(BasePermission):
+	"""
+	Staff users, or requests with the `API_METRICS_TOKEN` bearer token such as the Prometheus scraper.
+	"""
+
+	def has_permission(self, request, view):
+		if request.user and request.user.is_staff:
+			return True
+
+		token = settings.API_METRICS_TOKEN
+		authorization = request.META.get("HTTP_AUTHORIZATION", "")
+
+		return bool(token) and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
@@ -1,3 +1,118 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from apps.API.metrics import RequestMetrics
+from apps.API.mixins import RequestLogBuffer
+from apps.API.models import RequestLog
+from common.utils.tests import TestResultHandler
+
+LOCAL_RESULT_CACHE = {
+	**settings.CACHES,
+	"results": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "api_tests"},
+}
+
+
+class APITest(TestResultHandler):
+	def get_request_logs(self, *urls, max_size=10):
+		"""
+		Request the urls through a buffer without its background thread, then write what it queued.
+		"""
+		log_buffer = RequestLogBuffer(batch_size=100, flush_interval=5, max_size=max_size)
+		with (
+			mock.patch("apps.API.mixins.get_log_buffer", return_value=log_buffer),
+			mock.patch.object(RequestLogBuffer, "start"),
+		):
+			for url in urls:
+				self.client.get(url)
+
+		# Closing the connection would break the test transaction
+		with mock.patch("apps.API.mixins.connection.close"):
+			log_buffer.flush_pending()
+
+		return log_buffer, list(RequestLog.objects.order_by("id").values_list("path", "status_code", "db_queries"))
+
+	def test_request_log(self):
+		url = self._generate_url("taxonomy:taxon_children_count", id=1)
+		_, logs = self.get_request_logs(url)
+		self.assert_and_log(self.assertEqual, len(logs), 1)
+		path, status_code, db_queries = logs[0]
+		self.assert_and_log(
+			self.assertEqual, (path, status_code), ("/api/v1/taxonomy/taxon/children/count", status.HTTP_200_OK)
+		)
+		self.assert_and_log(self.assertGreater, db_queries, 0)
+
+	@override_settings(API_LOG_SAMPLE_RATE=0)
+	def test_request_log_sampled(self):
+		_, logs = self.get_request_logs(self._generate_url("taxonomy:taxon_children_count", id=1))
+		self.assert_and_log(self.assertEqual, logs, [])
+
+	@override_settings(API_LOG_SAMPLE_RATE=0)
+	def test_request_log_errors_unsampled(self):
+		_, logs = self.get_request_logs(
+			self._generate_url("taxonomy:taxon_children_count"),
+			self._generate_url("taxonomy:taxon_children_count", id=99999),
+		)
+		self.assert_and_log(
+			self.assertEqual,
+			[status_code for _, status_code, _ in logs],
+			[status.HTTP_400_BAD_REQUEST, status.HTTP_404_NOT_FOUND],
+		)
+
+	def test_request_log_dropped(self):
+		url = self._generate_url("taxonomy:taxon_children_count", id=1)
+		log_buffer, logs = self.get_request_logs(url, url, max_size=1)
+		self.assert_and_log(self.assertEqual, (len(logs), log_buffer.dropped), (1, 1))
+
+	@override_settings(API_METRICS_TOKEN="test", CACHES=LOCAL_RESULT_CACHE)
+	def test_metrics(self):
+		response = self.client.get(self._generate_url("taxonomy:taxon_crud", id=14))
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assert_and_log(self.assertIn, "db;dur=", response["Server-Timing"])
+
+		response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer test")
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assert_and_log(
+			self.assertIn, 'api_request_queries_count{view="taxonomy:taxon_crud"}', response.content.decode()
+		)
+
+	@override_settings(API_METRICS_TOKEN="test", CACHES=LOCAL_RESULT_CACHE)
+	def test_metrics_unauthorized(self):
+		response = self.client.get(reverse("metrics"))
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+		response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+		# Without a configured token no bearer token is accepted
+		with override_settings(API_METRICS_TOKEN=None):
+			response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer ")
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+	@override_settings(API_METRICS_TOKEN=None, CACHES=LOCAL_RESULT_CACHE)
+	def test_metrics_staff(self):
+		user = User.objects.create_user("metrics", password="metrics")
+		self.client.force_login(user)
+		response = self.client.get(reverse("metrics"))
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_403_FORBIDDEN)
+
+		user.is_staff = True
+		user.save()
+		response = self.client.get(reverse("metrics"))
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_200_OK)
+
+	@override_settings(CACHES=LOCAL_RESULT_CACHE)
+	def test_metrics_summed_over_workers(self):
+		workers = [RequestMetrics(flush_interval=60) for _ in range(2)]
+		for worker in workers:
+			worker.add("test_view", 0.2, 0.05, 3)
+		workers[0].flush()
+
+		metrics = workers[1].to_prometheus()
+		self.assert_and_log(self.assertIn, 'api_request_queries_count{view="test_view"} 2', metrics)
+		self.assert_and_log(self.assertIn, 'api_request_duration_seconds_bucket{view="test_view",le="0.1"} 0', metrics)
+		self.assert_and_log(self.assertIn, 'api_request_duration_seconds_bucket{view="test_view",le="0.25"} 2', metrics)
@@ -1,4 +1,4 @@
-from apps.API.views import APIStatus
+from apps.API.views import APIMetrics, APIStatus
 from django.conf import settings
 from django.urls import path, include, re_path
 from drf_yasg import openapi
@@ -37,4 +37,5 @@ urlpatterns = [
 	re_path("/docs/?$", schema_view.with_ui("swagger", cache_timeout=0), name="schema-swagger-ui"),
 	path("/v1", include("apps.API.v1.urls")),
 	path("/status", APIStatus.as_view()),
+	path("/metrics", APIMetrics.as_view(), name="metrics"),
 ]
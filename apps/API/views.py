@@ -1,6 +1,9 @@
+from django.http import HttpResponse
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from apps.API.metrics import request_metrics
+from apps.API.permissions import HasMetricsAccess
 from common.utils.custom_swag_schema import custom_swag_schema
 
 
@@ -18,3 +21,20 @@ class APIStatus(APIView):
 				"email": "centre.biodiversitat@uib.cat",
 			}
 		)
+
+
+class APIMetrics(APIView):
+	permission_classes = [HasMetricsAccess]
+
+	@custom_swag_schema(
+		tags="Status",
+		operation_id="Get API metrics",
+		operation_description=(
+			"Histograms of the request duration, database time and query count by URL name, summed over all the "
+			"workers, in the Prometheus text format. Restricted to staff users and the `API_METRICS_TOKEN` "
+			"bearer token."
+		),
+		responses={200: "Success", 401: "Unauthorized", 403: "Forbidden"},
+	)
+	def get(self, request):
+		return HttpResponse(request_metrics.to_prometheus(), content_type="text/plain; version=0.0.4")
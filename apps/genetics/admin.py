@@ -6,7 +6,7 @@ from common.utils.admin import ReadOnlyBatch
 
 class MarkerAdmin(ReadOnlyBatch):
 	search_fields = ["unidecode_name"]
-	readonly_fields = ["sources"]
+	readonly_fields = ["sources", "accepted_marker"]
 	autocomplete_fields = ["synonyms"]
 
 
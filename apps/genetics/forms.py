@@ -1,6 +1,7 @@
 from django import forms
 
-from common.utils.forms import CamelCaseForm, IdFieldForm, InGeographyScopeForm
+from apps.taxonomy.models import TaxonomicLevel
+from common.utils.forms import CamelCaseForm, IdFieldForm, InGeographyScopeForm, TranslateForm
 
 
 class MarkerForm(IdFieldForm, InGeographyScopeForm):
@@ -33,3 +34,15 @@ class SequenceForm(IdFieldForm, CamelCaseForm):
 class SequenceListForm(InGeographyScopeForm):
 	taxonomy = forms.IntegerField(required=False)
 	marker = forms.IntegerField(required=False)
+
+
+class MarkerCoverageForm(TranslateForm, InGeographyScopeForm):
+	taxonomy = forms.IntegerField(required=False)
+	rank = forms.IntegerField(required=False, initial=TaxonomicLevel.SPECIES)
+
+	CHOICES_FIELD = {"rank": TaxonomicLevel.TRANSLATE_RANK}
+
+	def clean_rank(self):
+		value = self.cleaned_data.get("rank")
+
+		return self.fields["rank"].initial if value is None else value
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.genetics.models import Marker
+from common.utils.cache import bump_data_version
+
+
+class Command(BaseCommand):
+	help = "Recomputes the accepted marker of every marker"
+
+	@transaction.atomic
+	def handle(self, *args, **options):
+		Marker.update_accepted_markers()
+		bump_data_version("update_accepted_markers")
+		self.stdout.write(self.style.SUCCESS("Accepted markers updated"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.genetics.models import Sequence
+from common.utils.cache import bump_data_version
+
+
+class Command(BaseCommand):
+	help = "Recomputes the taxon interval and geography scope copied from the occurrence of every sequence"
+
+	@transaction.atomic
+	def handle(self, *args, **options):
+		total = Sequence.update_taxonomy_intervals()
+		bump_data_version("update_sequence_taxonomy")
+		self.stdout.write(self.style.SUCCESS(f"Taxonomy of {total} sequences updated"))
@@ -1,7 +1,10 @@
-from django.db import models
-from django.db.models import F
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from mptt.signals import node_moved
 
 from apps.occurrences.models import Occurrence
+from apps.taxonomy.models import TaxonomicLevel
 from common.utils.models import ReferencedModel, SynonymModel
 
 
@@ -9,6 +12,42 @@ class Marker(ReferencedModel, SynonymModel):
 	name = models.CharField(max_length=512, null=True, blank=True, default=None, db_index=True)
 	product = models.CharField(max_length=512, null=True, blank=True, default=None)
 	is_relevant = models.BooleanField(default=True, db_index=True)
+	accepted_marker = models.ForeignKey(
+		"self",
+		on_delete=models.SET_NULL,
+		null=True,
+		blank=True,
+		default=None,
+		related_name="mapped_markers",
+		help_text="Accepted marker of a synonym, or the marker itself when accepted",
+	)
+
+	def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+		super().save(force_insert, force_update, using, update_fields)
+
+		if self.accepted != (self.accepted_marker_id == self.id):
+			Marker.update_accepted_markers([self.id, *self.synonyms.values_list("id", flat=True)])
+			self.refresh_from_db(fields=["accepted_marker"])
+
+	@staticmethod
+	def update_accepted_markers(ids=None):
+		"""
+		Recompute the accepted marker of the given markers, or of all of them, with two UPDATE statements.
+		"""
+		markers = Marker.objects.all() if ids is None else Marker.objects.filter(id__in=ids)
+		accepted_synonym = Marker.synonyms.through.objects.filter(
+			from_marker_id=OuterRef("id"), to_marker__accepted=True
+		).values("to_marker_id")[:1]
+
+		markers.filter(accepted=True).update(accepted_marker=F("id"))
+		markers.filter(accepted=False).update(accepted_marker=Subquery(accepted_synonym))
+
+	@staticmethod
+	def update_accepted_synonyms(**kwargs):
+		if kwargs and kwargs["action"] in ["post_add", "post_remove", "post_clear"]:
+			marker = kwargs["instance"]
+			mapped_markers = Marker.objects.filter(accepted_marker=marker.id).values_list("id", flat=True)
+			Marker.update_accepted_markers([marker.id, *(kwargs["pk_set"] or []), *mapped_markers])
 
 
 class Sequence(ReferencedModel):
@@ -17,6 +56,65 @@ class Sequence(ReferencedModel):
 	definition = models.TextField(null=True, blank=True)
 	published_date = models.DateField(blank=True, null=True)
 	markers = models.ManyToManyField(Marker)
+	# Copied from the occurrence and its taxon so subtree filters are a range scan on the sequence table
+	taxonomy_tree_id = models.PositiveIntegerField(null=True, blank=True, default=None, editable=False)
+	taxonomy_lft = models.PositiveIntegerField(null=True, blank=True, default=None, editable=False)
+	in_geography_scope = models.BooleanField(null=True, blank=True, default=None, editable=False)
+
+	def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+		if self.occurrence_id and self.taxonomy_lft is None:
+			self.set_taxonomy_interval(self.occurrence)
+
+		super().save(force_insert, force_update, using, update_fields)
+
+	def set_taxonomy_interval(self, occurrence):
+		"""
+		Copy the taxon interval and geography scope of the occurrence, for instances saved with `bulk_create`.
+		"""
+		self.taxonomy_tree_id = occurrence.taxonomy.tree_id
+		self.taxonomy_lft = occurrence.taxonomy.lft
+		self.in_geography_scope = occurrence.in_geography_scope
+
+	@staticmethod
+	def update_taxonomy_intervals(occurrence_ids=None, tree_id=None):
+		"""
+		Recompute the denormalized taxon interval and geography scope of the sequences of the given occurrences,
+		of a taxonomy tree, or of all of them, with a single UPDATE statement. Needed after the taxonomy tree is
+		rebuilt.
+		"""
+		sequences = Sequence.objects.all()
+		if occurrence_ids is not None:
+			sequences = sequences.filter(occurrence_id__in=occurrence_ids)
+		if tree_id is not None:
+			# Sequences whose taxon was moved in from another tree still carry the old tree id
+			sequences = sequences.filter(Q(taxonomy_tree_id=tree_id) | Q(occurrence__taxonomy__tree_id=tree_id))
+		occurrence = Occurrence.objects.filter(id=OuterRef("occurrence_id"))
+
+		return sequences.update(
+			taxonomy_tree_id=Subquery(occurrence.values("taxonomy__tree_id")[:1]),
+			taxonomy_lft=Subquery(occurrence.values("taxonomy__lft")[:1]),
+			in_geography_scope=Subquery(occurrence.values("in_geography_scope")[:1]),
+		)
+
+	@staticmethod
+	def update_occurrence_sequences(**kwargs):
+		if kwargs and not kwargs["created"] and not kwargs.get("raw"):
+			Sequence.update_taxonomy_intervals([kwargs["instance"].id])
+
+	@staticmethod
+	def update_taxonomy_tree(**kwargs):
+		"""
+		Inserting, moving or deleting a taxon shifts the intervals of the rest of its tree, so the intervals of the
+		sequences of the tree are recomputed once the transaction commits, once per tree. Loaders that delay the
+		MPTT updates recompute them at the end instead.
+		"""
+		if kwargs.get("raw") or kwargs.get("created") is False or not TaxonomicLevel._mptt_updates_enabled:
+			return
+
+		using = kwargs.get("using") or DEFAULT_DB_ALIAS
+		refresh = TaxonomyTreeRefresh(kwargs["instance"].tree_id)
+		if all(func != refresh for _, func, *_ in connections[using].run_on_commit):
+			transaction.on_commit(refresh, using=using)
 
 	def __str__(self):
 		if self.definition:
@@ -28,5 +126,31 @@ class Sequence(ReferencedModel):
 		indexes = [
 			models.Index(fields=["occurrence"]),
 			models.Index(fields=["published_date"]),
+			models.Index(fields=["taxonomy_tree_id", "taxonomy_lft", "in_geography_scope"]),
 		]
 		ordering = [F("published_date").desc(nulls_last=True), "id"]
+
+
+class TaxonomyTreeRefresh:
+	"""
+	Recompute the intervals of the sequences of a taxonomy tree, registered once per transaction and tree.
+	"""
+
+	def __init__(self, tree_id):
+		self.tree_id = tree_id
+
+	def __call__(self):
+		Sequence.update_taxonomy_intervals(tree_id=self.tree_id)
+
+	def __eq__(self, other):
+		return isinstance(other, TaxonomyTreeRefresh) and other.tree_id == self.tree_id
+
+	def __hash__(self):
+		return hash(self.tree_id)
+
+
+m2m_changed.connect(Marker.update_accepted_synonyms, sender=Marker.synonyms.through)
+post_save.connect(Sequence.update_occurrence_sequences, sender=Occurrence)
+post_save.connect(Sequence.update_taxonomy_tree, sender=TaxonomicLevel)
+post_delete.connect(Sequence.update_taxonomy_tree, sender=TaxonomicLevel)
+node_moved.connect(Sequence.update_taxonomy_tree, sender=TaxonomicLevel)
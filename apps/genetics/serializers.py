@@ -71,6 +71,7 @@ class SequenceCSVSerializer(CaseModelSerializer):
 	class Meta:
 		model = Sequence
 		exclude = ("batch", "occurrence", "sources", "isolate")
+		related_lookups = ["occurrence__taxonomy__parent__parent", "sources__source__basis"]
 
 
 class SequenceAggregationSerializer(CaseModelSerializer):
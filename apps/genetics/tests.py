@@ -1,5 +1,7 @@
 from rest_framework import status
 
+from apps.genetics.models import Sequence
+from apps.taxonomy.models import TaxonomicLevel
 from common.utils.tests import TestResultHandler
 
 EXPECTED_MARKER = {
@@ -85,6 +87,29 @@ class GeneticsTest(TestResultHandler):
 		response = self.client.get(url)
 		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_400_BAD_REQUEST)
 
+	def test_sequence_count_approx_empty_200(self):
+		url = self._generate_url("genetics:sequence_list_count", approx="true")
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		expected_data = {"count": 0, "approximate": False, "method": "exact", "error": 0, "confidence": 1}
+		self.assert_and_log(self.assertJSONEqual, response.content, expected_data)
+
+	def test_sequence_taxonomy_interval_after_tree_edit(self):
+		sequence = Sequence.objects.lean().select_related("occurrence__taxonomy").get(id=14)
+		taxon = sequence.occurrence.taxonomy
+
+		# A sibling sorted first shifts the interval of the taxon of the sequence
+		with self.captureOnCommitCallbacks(execute=True):
+			TaxonomicLevel(
+				name="Aaaa", rank=taxon.rank, accepted=True, parent=taxon.parent, batch_id=taxon.batch_id
+			).save()
+
+		sequence.refresh_from_db()
+		taxon.refresh_from_db()
+		self.assert_and_log(
+			self.assertEqual, (sequence.taxonomy_tree_id, sequence.taxonomy_lft), (taxon.tree_id, taxon.lft)
+		)
+
 	def test_marker_crud_200(self):
 		marker_id = 1
 		url = self._generate_url("genetics:marker_crud", id=marker_id)
@@ -153,3 +178,43 @@ class GeneticsTest(TestResultHandler):
 		url = self._generate_url("genetics:marker_list_count", taxonomy=invalid_taxonomy_id)
 		response = self.client.get(url)
 		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_sequence_source_download_csv_200(self):
+		taxon_id = 14
+		url = self._generate_url("genetics:sequence_occur_tax", taxonomy=taxon_id)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		self.assert_and_log(self.assertEqual, response["Content-Type"], "text/csv")
+		rows = b"".join(response.streaming_content).decode().splitlines()
+		self.assert_and_log(self.assertEqual, rows[0].split(",")[:3], ["id", "taxon", "taxonRank"])
+
+	def test_sequence_source_download_csv_404(self):
+		invalid_taxonomy_id = 99999
+		url = self._generate_url("genetics:sequence_occur_tax", taxonomy=invalid_taxonomy_id)
+		response = self.client.get(url)
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_marker_coverage_200(self):
+		taxon_id = 14
+		url = self._generate_url("genetics:marker_coverage", taxonomy=taxon_id)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+		self.assert_and_log(self.assertEqual, response.data["rank"], "species")
+		self.assert_and_log(self.assertEqual, [taxon["id"] for taxon in response.data["taxa"]], [taxon_id])
+		self.assert_and_log(self.assertEqual, len(response.data["rows"]), len(response.data["counts"]))
+		self.assert_and_log(self.assertEqual, len(response.data["columns"]), len(response.data["counts"]))
+
+	def test_marker_coverage_400(self):
+		url = self._generate_url("genetics:marker_coverage")
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		expected_data = {"detail": "Missing taxon id parameter"}
+		self.assert_and_log(self.assertJSONEqual, response.content, expected_data)
+
+	def test_marker_coverage_404(self):
+		invalid_taxonomy_id = 99999
+		url = self._generate_url("genetics:marker_coverage", taxonomy=invalid_taxonomy_id)
+		response = self.client.get(url)
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_404_NOT_FOUND)
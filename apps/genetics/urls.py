@@ -6,6 +6,7 @@ from .views import (
 	MarkerListView,
 	# MarkerTaxonCountListView,
 	MarkerCountView,
+	MarkerCoverageView,
 	SequenceCRUDView,
 	SequenceCountView,
 	SequenceListView,
@@ -21,6 +22,7 @@ urlpatterns = [
 	path("/marker/search", MarkerSearchView.as_view(), name="marker_search"),
 	path("/marker/list", MarkerListView.as_view(), name="marker_list"),
 	path("/marker/list/count", MarkerCountView.as_view(), name="marker_list_count"),
+	path("/coverage", MarkerCoverageView.as_view(), name="marker_coverage"),
 	# path("/marker/taxon/list", MarkerTaxonCountListView.as_view(), name="marker_occur_list"),
 	path("/sequence", SequenceCRUDView.as_view(), name="sequence_crud"),
 	# path("/sequence/search", SequenceSearchView.as_view(), name="sequence_search"),
@@ -1,15 +1,22 @@
-from django.db.models import Count, Q, OuterRef, Case, When, Value, IntegerField
+import csv
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import Count, DecimalField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce
+from django.http import StreamingHttpResponse
 from drf_yasg import openapi
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.taxonomy.models import TaxonomicLevel
+from apps.taxonomy.serializers import MinimalTaxonomicLevelSerializer
 from apps.API.exceptions import CBBAPIException
 from apps.versioning.models import Basis
 
-from .forms import MarkerForm, SequenceForm, SequenceListForm
+from .forms import MarkerCoverageForm, MarkerForm, SequenceForm, SequenceListForm
 from .models import Marker, Sequence
 from .serializers import (
+	BaseMarkerSerializer,
 	MarkerCountSerializer,
 	MarkerSerializer,
 	# SequenceSerializer,
@@ -18,12 +25,18 @@ from .serializers import (
 	SequenceMinimalSerializer,
 )
 from common.utils.views import CSVDownloadMixin
-from common.utils.serializers import get_paginated_response
-from common.utils.utils import generate_csv, flatten_row, flatten_columns, remove_from_keys
+from common.utils.serializers import get_field_selection, get_paginated_response, get_serialized_data, plan_queryset
+from common.utils.cache import batch_cached
+from common.utils.counts import APPROX_PARAMETER, get_count
+from common.utils.models import coordinate
+from common.utils.utils import EchoWriter
 
 from common.utils.custom_swag_schema import custom_swag_schema
 
 
+# Separator of the aggregated values in the CSV cells
+SEPARATOR = ";"
+
 MANUAL_PARAMETERS = [
 	openapi.Parameter("id", openapi.IN_QUERY, description="Marker ID", type=openapi.TYPE_INTEGER, required=True)
 ]
@@ -146,42 +159,25 @@ class MarkerFilter(APIView):
 		if not taxon_id:
 			raise CBBAPIException("Missing taxon id parameter", 400)
 
-		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
-		except TaxonomicLevel.DoesNotExist:
+		taxon = TaxonomicLevel.objects.filter(id=taxon_id).values("tree_id", "lft", "rght").first()
+		if not taxon:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
-		# Filter all markers by taxon
-		seq_queryset = Sequence.objects.filter(
-			occurrence__taxonomy__in=taxon.get_descendants(include_self=True)
-		).distinct()
+		# Sequences of the taxon and its descendants, reached through the markers mapped to each accepted marker
+		filters = {
+			"mapped_markers__sequence__taxonomy_tree_id": taxon["tree_id"],
+			"mapped_markers__sequence__taxonomy_lft__gte": taxon["lft"],
+			"mapped_markers__sequence__taxonomy_lft__lte": taxon["rght"],
+		}
 
 		in_geography_scope = marker_form.cleaned_data.get("in_geography_scope", None)
 		if in_geography_scope is not None:
-			seq_queryset = seq_queryset.filter(occurrence__in_geography_scope=in_geography_scope)
-
-		# queryset = Marker.objects.filter(sequence__in=seq_queryset)
-		# queryset = queryset.annotate(total=Count("id")).order_by("-total")
+			filters["mapped_markers__sequence__in_geography_scope"] = in_geography_scope
 
-		accepted_marker = Marker.objects.filter(
-			Q(accepted=True, id=OuterRef("id")) | Q(synonyms=OuterRef("id"), accepted=True)
-		).filter(is_relevant=True)
-
-		queryset = Marker.objects.filter(sequence__in=seq_queryset)
-		queryset = queryset.annotate(accepted_id=accepted_marker.values("id")[:1]).annotate(total=Count("id"))
-
-		acc_count = {}
-		for marker in queryset:
-			if marker.accepted_id not in acc_count:
-				acc_count[marker.accepted_id] = 0
-			acc_count[marker.accepted_id] += marker.total
-
-		total_case = Case(
-			*[When(id=key, then=Value(value)) for key, value in acc_count.items()],
-			default=Value(0),  # Default value if not in the map
-			output_field=IntegerField(),
+		# A single GROUP BY over the sequence-marker pairs of the synonyms of every relevant accepted marker
+		queryset = (
+			Marker.objects.lean().filter(is_relevant=True, **filters).annotate(total=Count("mapped_markers__sequence"))
 		)
-		queryset = Marker.objects.filter(id__in=acc_count.keys()).annotate(total=total_case)
 
 		return queryset.order_by("-total")
 
@@ -202,7 +198,13 @@ class MarkerListView(MarkerFilter):
 		],
 	)
 	def get(self, request):
-		return Response(MarkerCountSerializer(super().get(request), many=True).data)
+		queryset = super().get(request)
+
+		return Response(
+			batch_cached(
+				"marker_list", request.GET.dict(), lambda: list(MarkerCountSerializer(queryset, many=True).data)
+			)
+		)
 
 
 class MarkerCountView(MarkerFilter):
@@ -217,11 +219,12 @@ class MarkerCountView(MarkerFilter):
 				description="Taxon ID",
 				type=openapi.TYPE_INTEGER,
 				required=True,
-			)
+			),
+			APPROX_PARAMETER,
 		],
 	)
 	def get(self, request):
-		return Response(super().get(request).count())
+		return Response(get_count(request, super().get(request), MarkerForm))
 
 
 # class MarkerTaxonCountListView(APIView):
@@ -299,6 +302,111 @@ class MarkerCountView(MarkerFilter):
 # 		return Response(serializer.data)
 
 
+class MarkerCoverageView(APIView):
+	@custom_swag_schema(
+		tags="Genetic",
+		operation_id="Marker coverage of a taxon",
+		operation_description=(
+			"Sparse matrix of the number of sequences of every taxon of a rank (species by default) in the subtree "
+			"of a taxon and every accepted marker. `taxa` lists all the taxa of the rank in the subtree, with or "
+			"without sequences, and `markers` the accepted markers found. The non-zero cells are given by the "
+			"`rows` (taxon ids), `columns` (marker ids) and `counts` lists. Sequences of lower ranks are counted "
+			"for their ancestor of the rank."
+		),
+		manual_parameters=[
+			openapi.Parameter(
+				"taxonomy",
+				openapi.IN_QUERY,
+				description="Taxon ID",
+				type=openapi.TYPE_INTEGER,
+				required=True,
+			),
+			openapi.Parameter(
+				"rank",
+				openapi.IN_QUERY,
+				description="Rank of the taxa of the rows",
+				type=openapi.TYPE_STRING,
+				required=False,
+				default="species",
+			),
+			openapi.Parameter(
+				"inGeographyScope",
+				openapi.IN_QUERY,
+				description="Only count sequences of occurrences in or out of the geography scope",
+				type=openapi.TYPE_BOOLEAN,
+				required=False,
+			),
+		],
+	)
+	def get(self, request):
+		coverage_form = MarkerCoverageForm(data=request.GET)
+
+		if not coverage_form.is_valid():
+			raise CBBAPIException(coverage_form.errors, 400)
+
+		taxon_id = coverage_form.cleaned_data.get("taxonomy")
+		if not taxon_id:
+			raise CBBAPIException("Missing taxon id parameter", 400)
+
+		try:
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
+		except TaxonomicLevel.DoesNotExist:
+			raise CBBAPIException("Taxonomic level does not exist", 404)
+
+		rank = coverage_form.cleaned_data.get("rank")
+		in_geography_scope = coverage_form.cleaned_data.get("in_geography_scope")
+
+		return Response(
+			batch_cached(
+				"marker_coverage",
+				{"taxonomy": taxon.id, "rank": rank, "in_geography_scope": in_geography_scope},
+				lambda: self.get_coverage(taxon, rank, in_geography_scope),
+			)
+		)
+
+	@staticmethod
+	def get_coverage(taxon, rank, in_geography_scope):
+		# Ancestor of the rank of the taxon of each sequence occurrence, found with the nested set interval
+		ancestor = TaxonomicLevel.objects.filter(
+			tree_id=OuterRef("sequence__taxonomy_tree_id"),
+			lft__lte=OuterRef("sequence__taxonomy_lft"),
+			rght__gte=OuterRef("sequence__taxonomy_lft"),
+			rank=rank,
+		).values("id")[:1]
+
+		filters = Q(
+			sequence__taxonomy_tree_id=taxon.tree_id,
+			sequence__taxonomy_lft__gte=taxon.lft,
+			sequence__taxonomy_lft__lte=taxon.rght,
+			marker__accepted_marker__is_relevant=True,
+		)
+		if in_geography_scope is not None:
+			filters &= Q(sequence__in_geography_scope=in_geography_scope)
+
+		cells = list(
+			Sequence.markers.through.objects.filter(filters)
+			.annotate(row=Subquery(ancestor))
+			.filter(row__isnull=False)
+			.values("row", "marker__accepted_marker")
+			.annotate(count=Count("sequence_id", distinct=True))
+			.order_by("row", "marker__accepted_marker")
+			.values_list("row", "marker__accepted_marker", "count")
+		)
+		rows, columns, counts = (list(values) for values in zip(*cells)) if cells else ([], [], [])
+
+		taxa = taxon.get_descendants(include_self=True).filter(rank=rank)
+		markers = Marker.objects.lean().filter(id__in=set(columns)).order_by("name")
+
+		return {
+			"rank": TaxonomicLevel.TRANSLATE_RANK[rank],
+			"taxa": MinimalTaxonomicLevelSerializer(taxa, many=True).data,
+			"markers": BaseMarkerSerializer(markers, many=True).data,
+			"rows": rows,
+			"columns": columns,
+			"counts": counts,
+		}
+
+
 class SequenceCRUDView(APIView):
 	@custom_swag_schema(
 		tags="Genetic",
@@ -324,13 +432,14 @@ class SequenceCRUDView(APIView):
 		if not seq_id:
 			raise CBBAPIException("Missing sequence ID", 400)
 
+		selection = get_field_selection(request)
 		try:
-			gfs = Sequence.objects.get(id=seq_id)
+			gfs = plan_queryset(Sequence.objects.all(), SequenceMinimalSerializer, **selection).get(id=seq_id)
 		except Sequence.DoesNotExist:
 			raise CBBAPIException("Sequence does not exist", 404)
 
 		# return Response(SequenceSerializer(gfs).data)
-		return Response(SequenceMinimalSerializer(gfs).data)
+		return Response(SequenceMinimalSerializer(gfs, context=selection).data)
 
 
 # class SequenceSearchView(APIView):
@@ -370,10 +479,9 @@ class SequenceFilter(APIView):
 		taxon = seq_form.cleaned_data.get("taxonomy")
 		if taxon:
 			try:
-				taxon = TaxonomicLevel.objects.get(id=taxon)
-				filters |= Q(occurrence__taxonomy=taxon) | Q(
-					occurrence__taxonomy__lft__gte=taxon.lft, occurrence__taxonomy__rght__lte=taxon.rght
-				)
+				taxon = TaxonomicLevel.objects.lean().get(id=taxon)
+				# Range scan on the taxon interval copied to the sequences, without joining occurrences and taxa
+				filters &= Q(taxonomy_tree_id=taxon.tree_id, taxonomy_lft__gte=taxon.lft, taxonomy_lft__lte=taxon.rght)
 			except TaxonomicLevel.DoesNotExist:
 				raise CBBAPIException("Taxonomic level does not exist.", 404)
 
@@ -383,9 +491,15 @@ class SequenceFilter(APIView):
 
 		in_geography_scope = seq_form.cleaned_data.get("in_geography_scope", None)
 		if in_geography_scope is not None:
-			filters &= Q(occurrence__in_geography_scope=in_geography_scope)
+			filters &= Q(in_geography_scope=in_geography_scope)
+
+		if not filters:
+			return Sequence.objects.none()
 
-		return Sequence.objects.filter(filters).order_by("id").distinct("id") if filters else Sequence.objects.none()
+		queryset = Sequence.objects.filter(filters).order_by("id")
+
+		# Only the marker joins can repeat a sequence
+		return queryset.distinct("id") if marker else queryset
 
 
 class SequenceListView(SequenceFilter):
@@ -444,11 +558,12 @@ class SequenceCountView(SequenceFilter):
 				description="Taxon ID",
 				type=openapi.TYPE_INTEGER,
 				required=True,
-			)
+			),
+			APPROX_PARAMETER,
 		],
 	)
 	def get(self, request):
-		return Response(super().get(request).count())
+		return Response(get_count(request, super().get(request), SequenceListForm))
 
 
 class SequenceListCSVView(SequenceFilter):
@@ -467,12 +582,7 @@ class SequenceListCSVView(SequenceFilter):
 		],
 	)
 	def get(self, request):
-		query = (
-			super()
-			.get(request)
-			.prefetch_related("sources", "markers")
-			.select_related("occurrence", "occurrence__taxonomy")
-		)
+		query = plan_queryset(super().get(request), SequenceCSVSerializer)
 		return CSVDownloadMixin.generate_csv(
 			CSVDownloadMixin.flatten_json(SequenceCSVSerializer(query, many=True).data, ["markers"]),
 			filename="genetic_info.csv",
@@ -506,7 +616,7 @@ class SequenceSourceCountView(APIView):
 			raise CBBAPIException("Missing taxon id parameter", 400)
 
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
@@ -529,7 +639,7 @@ class SequenceSourceCountView(APIView):
 
 
 class SequenceSourceDownload(APIView):
-	def get(self, request):
+	def filter_sequences(self, request):
 		seq_form = SequenceForm(data=self.request.GET)
 		if not seq_form.is_valid():
 			raise CBBAPIException(seq_form.errors, 400)
@@ -539,15 +649,11 @@ class SequenceSourceDownload(APIView):
 			raise CBBAPIException("Missing taxon id parameter", 400)
 
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
-		queryset = (
-			Sequence.objects.prefetch_related("markers", "sources", "markers__synonyms")
-			.select_related("occurrence", "occurrence__taxonomy")
-			.filter(occurrence__taxonomy=taxon)
-		)
+		queryset = Sequence.objects.filter(occurrence__taxonomy=taxon)
 
 		marker_id = seq_form.cleaned_data.get("marker")
 		if marker_id:
@@ -567,10 +673,33 @@ class SequenceSourceDownload(APIView):
 
 			queryset = queryset.filter(sources__source__basis=src)
 
-		return Response(SequenceMinimalSerializer(queryset, many=True).data)
+		return taxon, queryset
+
+	def get(self, request):
+		_, queryset = self.filter_sequences(request)
+		return Response(get_serialized_data(request, SequenceMinimalSerializer, queryset, many=True))
 
 
 class SequenceSourceCSVDownloadView(SequenceSourceDownload):
+	COLUMNS = [
+		"id",
+		"taxon",
+		"taxonRank",
+		"isolate",
+		"definition",
+		"publishedDate",
+		"markers_name",
+		"basisOfRecord",
+		"coordinateUncertaintyInMeters",
+		"decimalLatitude",
+		"decimalLongitude",
+		"depth",
+		"elevation",
+		"voucher",
+		"source_flat",
+		"id_flat",
+	]
+
 	@custom_swag_schema(
 		tags="Genetic",
 		operation_id="Download genetic occurrences (CSV)",
@@ -594,50 +723,68 @@ class SequenceSourceCSVDownloadView(SequenceSourceDownload):
 		],
 	)
 	def get(self, request):
-		# Add the taxon name
-		column_list = [
-			"id",
-			"taxon",
-			"taxonRank",
-			"isolate",
-			"definition",
-			"publishedDate",
-			"markers_name",
-			"occurrence_basisOfRecord",
-			"occurrence_coordinateUncertaintyInMeters",
-			"occurrence_decimalLatitude",
-			"occurrence_decimalLongitude",
-			"occurrence_depth",
-			"occurrence_elevation",
-			"occurrence_voucher",
-			"source_flat",
-			"id_flat",
-		]
-
-		column_reorder = [i.replace("occurrence_", "") for i in column_list]
-
-		response = super().get(request)
-
-		a = flatten_row(response.data, ["markers"])
-		b = flatten_columns(a, ["occurrence"])
-
-		# Add a key with the list of the sources
-		for item in b:
-			source_flat = [
-				s.get("source", {}).get("name")
-				for s in item.get("sources", [])
-				if s.get("source", {}).get("name") is not None
-			]
-			item["source_flat"] = source_flat[0]
-
-			id_flat = item.get("sources", [])
-			item["id_flat"] = id_flat[0].get("externalId") if id_flat else None
-
-			item["taxon"] = item.get("occurrence_taxonomy").get("name") if id else None
-			item["taxonRank"] = item.get("occurrence_taxonomy").get("taxonRank") if id else None
-
-		# Clean the key names and reorder the final csv
-		b_clean = [{k: item[k] for k in column_list if k in item} for item in b]
-		b_clean = [remove_from_keys(item, "occurrence_") for item in b_clean]
-
-		return generate_csv(b_clean, filename="genetic_occurrences.csv", fieldnames=column_reorder)
+		taxon, queryset = self.filter_sequences(request)
+		csv_writer = csv.writer(EchoWriter())
+
+		return StreamingHttpResponse(
+			(csv_writer.writerow(row) for row in self.generate_rows(taxon, queryset)),
+			content_type="text/csv",
+			headers={"Content-Disposition": f'attachment; filename="genetic_occurrences.csv"'},
+		)
+
+	def generate_rows(self, taxon, queryset):
+		"""
+		Yield the CSV header and one row per sequence. Every column is selected from the database,
+		with the marker names, source names and external ids of each sequence aggregated in subqueries.
+		"""
+		markers = (
+			Sequence.markers.through.objects.filter(sequence_id=OuterRef("id"))
+			.order_by()
+			.values("sequence_id")
+			.annotate(names=StringAgg("marker__name", delimiter=SEPARATOR, ordering="marker__name"))
+			.values("names")
+		)
+		sources = Sequence.sources.through.objects.filter(sequence_id=OuterRef("id")).order_by().values("sequence_id")
+		source_names = sources.annotate(
+			names=StringAgg(
+				Coalesce("originid__source__basis__name", "originid__source__basis__internal_name"),
+				delimiter=SEPARATOR,
+				ordering="originid_id",
+			)
+		).values("names")
+		external_ids = sources.annotate(
+			ids=StringAgg(Coalesce("originid__external_id", Value("")), delimiter=SEPARATOR, ordering="originid_id")
+		).values("ids")
+
+		rows = (
+			queryset.prefetch_related(None)
+			.annotate(
+				markers_name=Subquery(markers),
+				latitude=Cast(coordinate("Y", "occurrence__location"), DecimalField(max_digits=8, decimal_places=5)),
+				longitude=Cast(coordinate("X", "occurrence__location"), DecimalField(max_digits=8, decimal_places=5)),
+				source_flat=Subquery(source_names),
+				id_flat=Subquery(external_ids),
+			)
+			.values_list(
+				"id",
+				"isolate",
+				"definition",
+				"published_date",
+				"markers_name",
+				"occurrence__basis_of_record",
+				"occurrence__coordinate_uncertainty_in_meters",
+				"latitude",
+				"longitude",
+				"occurrence__depth",
+				"occurrence__elevation",
+				"occurrence__voucher",
+				"source_flat",
+				"id_flat",
+			)
+		)
+
+		taxon_name, taxon_rank = str(taxon), taxon.readable_rank()
+
+		yield self.COLUMNS
+		for seq_id, *row in rows.iterator(chunk_size=2000):
+			yield [seq_id, taxon_name, taxon_rank, *row]
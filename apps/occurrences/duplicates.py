@@ -0,0 +1,104 @@
+import math
+
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Lower, Trim
+
+from apps.occurrences.models import Occurrence
+from apps.taxonomy.models import TaxonomicLevel
+from common.utils.models import grid_cell
+
+# Coordinates are snapped to a grid of 10^-4 degrees (~11 m)
+COORDINATE_PRECISION = 4
+CELL_SIZE = 10**-COORDINATE_PRECISION
+
+KEY_FIELDS = [
+	"accepted_taxon",
+	"x",
+	"y",
+	"collection_date_year",
+	"collection_date_month",
+	"collection_date_day",
+	"recorder",
+]
+
+
+def get_accepted_taxa():
+	"""
+	Map every synonym taxon id to the id of its accepted taxon.
+	"""
+	return dict(
+		TaxonomicLevel.synonyms.through.objects.filter(
+			from_taxonomiclevel__accepted=False, to_taxonomiclevel__accepted=True
+		).values_list("from_taxonomiclevel_id", "to_taxonomiclevel_id")
+	)
+
+
+def normalize_recorder(recorded_by):
+	return (recorded_by or "").strip(" ").lower()
+
+
+def annotate_keys(occurrences):
+	"""
+	Annotate the duplicate key fields of the occurrences computed in the database.
+	Occurrences without location or year have no key and are left out.
+	"""
+	accepted_taxon = TaxonomicLevel.synonyms.through.objects.filter(
+		from_taxonomiclevel_id=OuterRef("taxonomy_id"),
+		from_taxonomiclevel__accepted=False,
+		to_taxonomiclevel__accepted=True,
+	).values("to_taxonomiclevel_id")[:1]
+
+	return (
+		occurrences.order_by()
+		.prefetch_related(None)
+		.filter(location__isnull=False, collection_date_year__isnull=False)
+		.annotate(
+			accepted_taxon=Coalesce(Subquery(accepted_taxon), "taxonomy_id"),
+			x=grid_cell("X", CELL_SIZE),
+			y=grid_cell("Y", CELL_SIZE),
+			recorder=Lower(Trim(Coalesce("recorded_by", Value("")))),
+		)
+	)
+
+
+class DuplicateIndex:
+	"""
+	Hash index of occurrences by (accepted taxon, rounded coordinates, date, recordedBy).
+
+	Lookups and insertions are O(1), so records can be checked against the database
+	and against each other while a file streams in.
+	"""
+
+	def __init__(self, accepted_taxa=None):
+		self.accepted_taxa = get_accepted_taxa() if accepted_taxa is None else accepted_taxa
+		self.index = {}
+
+	@classmethod
+	def from_database(cls):
+		duplicate_index = cls()
+		occurrences = annotate_keys(Occurrence.objects.distinct_records())
+		for occurrence_id, *key in occurrences.values_list("id", *KEY_FIELDS).iterator(chunk_size=10_000):
+			duplicate_index.index.setdefault(tuple(key), occurrence_id)
+
+		return duplicate_index
+
+	def key(self, taxonomy_id, location, year, month, day, recorded_by):
+		if location is None or not year:
+			return None
+
+		return (
+			self.accepted_taxa.get(taxonomy_id, taxonomy_id),
+			math.floor(location.x / CELL_SIZE),
+			math.floor(location.y / CELL_SIZE),
+			year,
+			month,
+			day,
+			normalize_recorder(recorded_by),
+		)
+
+	def find(self, key):
+		return self.index.get(key) if key else None
+
+	def add(self, key, occurrence_id):
+		if key:
+			self.index.setdefault(key, occurrence_id)
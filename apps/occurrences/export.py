@@ -0,0 +1,353 @@
+import json
+import os
+import threading
+from datetime import timedelta
+from itertools import islice
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework.throttling import AnonRateThrottle
+
+from apps.occurrences.models import Occurrence, OccurrenceExport
+from apps.taxonomy.models import TaxonomicLevel
+from common.utils.cache import get_batch_version, get_result_cache, single_flight
+from common.utils.models import coordinate
+
+CHUNK_SIZE = 20_000
+LAYER_NAME = "occurrences"
+GEOPARQUET_VERSION = "1.0.0"
+
+LINEAGE_RANKS = [
+	TaxonomicLevel.KINGDOM,
+	TaxonomicLevel.PHYLUM,
+	TaxonomicLevel.CLASS,
+	TaxonomicLevel.ORDER,
+	TaxonomicLevel.FAMILY,
+	TaxonomicLevel.GENUS,
+	TaxonomicLevel.SPECIES,
+]
+
+OCCURRENCE_FIELDS = [
+	"id",
+	"taxonomy_id",
+	"basis_of_record",
+	"voucher",
+	"recorded_by",
+	"collection_date_year",
+	"collection_date_month",
+	"collection_date_day",
+	"coordinate_uncertainty_in_meters",
+	"elevation",
+	"depth",
+	"in_geography_scope",
+	"latitude",
+	"longitude",
+]
+
+# Explicit dtypes keep the schema stable between chunks, even when a column is empty in one of them
+COLUMNS = {
+	"id": "int64",
+	"taxonomy": "int64",
+	"scientific_name": "string",
+	"accepted": "boolean",
+	**{TaxonomicLevel.TRANSLATE_RANK[rank]: "string" for rank in LINEAGE_RANKS},
+	"basis_of_record": "string",
+	"voucher": "string",
+	"recorded_by": "string",
+	"year": "Int64",
+	"month": "Int64",
+	"day": "Int64",
+	"coordinate_uncertainty_in_meters": "Int64",
+	"elevation": "Int64",
+	"depth": "Int64",
+	"in_geography_scope": "boolean",
+	"sources": "string",
+}
+
+
+def get_lineages():
+	"""
+	Map every taxon id to its scientific name, accepted flag and the names of its ancestors by rank.
+	The whole tree is read with a single query and resolved in memory.
+	"""
+	taxa = {
+		taxon_id: (parent_id, rank, name, accepted)
+		for taxon_id, parent_id, rank, name, accepted in TaxonomicLevel.objects.lean()
+		.order_by()
+		.values_list("id", "parent_id", "rank", "name", "accepted")
+	}
+	lineages = {}
+
+	def get_lineage(taxon_id):
+		if taxon_id not in lineages:
+			parent_id, rank, name, accepted = taxa[taxon_id]
+			parent = get_lineage(parent_id) if parent_id else {}
+			scientific_name = name
+			if rank in [TaxonomicLevel.SPECIES, TaxonomicLevel.SUBSPECIES, TaxonomicLevel.VARIETY] and parent:
+				scientific_name = f"{parent['scientific_name']} {name}"
+
+			lineages[taxon_id] = {**parent, "scientific_name": scientific_name, "accepted": accepted}
+			if rank in LINEAGE_RANKS:
+				lineages[taxon_id][TaxonomicLevel.TRANSLATE_RANK[rank]] = name
+
+		return lineages[taxon_id]
+
+	for taxon_id in taxa:
+		get_lineage(taxon_id)
+
+	return lineages
+
+
+def get_sources(occurrence_ids):
+	"""
+	Sources of each occurrence as `basis:external_id` entries separated by semicolons.
+	"""
+	sources = {}
+	through = Occurrence.sources.through.objects.filter(occurrence_id__in=occurrence_ids).values_list(
+		"occurrence_id", "originid__source__basis__internal_name", "originid__external_id"
+	)
+	for occurrence_id, basis, external_id in through:
+		sources.setdefault(occurrence_id, []).append(f"{basis}:{external_id}" if external_id else basis)
+
+	return {occurrence_id: ";".join(entries) for occurrence_id, entries in sources.items()}
+
+
+def build_frame(rows, lineages):
+	columns = dict(zip(OCCURRENCE_FIELDS, zip(*rows))) if rows else {field: () for field in OCCURRENCE_FIELDS}
+	ids = list(columns["id"])
+	sources = get_sources(ids) if ids else {}
+	taxa = [lineages.get(taxon_id, {}) for taxon_id in columns["taxonomy_id"]]
+
+	data = {
+		"id": ids,
+		"taxonomy": columns["taxonomy_id"],
+		"scientific_name": [taxon.get("scientific_name") for taxon in taxa],
+		"accepted": [taxon.get("accepted") for taxon in taxa],
+		**{
+			TaxonomicLevel.TRANSLATE_RANK[rank]: [taxon.get(TaxonomicLevel.TRANSLATE_RANK[rank]) for taxon in taxa]
+			for rank in LINEAGE_RANKS
+		},
+		"basis_of_record": [
+			Occurrence.TRANSLATE_BASIS_OF_RECORD[value] if value is not None else None
+			for value in columns["basis_of_record"]
+		],
+		"voucher": columns["voucher"],
+		"recorded_by": columns["recorded_by"],
+		"year": columns["collection_date_year"],
+		"month": columns["collection_date_month"],
+		"day": columns["collection_date_day"],
+		"coordinate_uncertainty_in_meters": columns["coordinate_uncertainty_in_meters"],
+		"elevation": columns["elevation"],
+		"depth": columns["depth"],
+		"in_geography_scope": columns["in_geography_scope"],
+		"sources": [sources.get(occurrence_id) for occurrence_id in ids],
+	}
+	frame = pd.DataFrame({key: pd.array(list(data[key]), dtype=dtype) for key, dtype in COLUMNS.items()})
+
+	longitude = np.array(columns["longitude"], dtype="float64")
+	latitude = np.array(columns["latitude"], dtype="float64")
+	geometry = shapely.points(longitude, latitude)
+	geometry[np.isnan(longitude) | np.isnan(latitude)] = None
+
+	return gpd.GeoDataFrame(frame, geometry=gpd.GeoSeries(geometry, crs="EPSG:4326"))
+
+
+class GeoPackageWriter:
+	def __init__(self, path):
+		self.path = path
+		self.mode = "w"
+
+	def write(self, frame):
+		frame.to_file(self.path, layer=LAYER_NAME, driver="GPKG", mode=self.mode)
+		self.mode = "a"
+
+	def close(self):
+		pass
+
+
+class GeoParquetWriter:
+	def __init__(self, path):
+		self.path = path
+		self.writer = None
+
+	def write(self, frame):
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+
+		table = pa.table(frame.to_arrow(index=False))
+
+		if self.writer is None:
+			# GeoParquet metadata of the whole file, without the bounding box that only the first chunk would describe
+			geo = {
+				"version": GEOPARQUET_VERSION,
+				"primary_column": "geometry",
+				"columns": {
+					"geometry": {"encoding": "WKB", "geometry_types": ["Point"], "crs": frame.crs.to_json_dict()}
+				},
+			}
+			schema = table.schema.with_metadata({**(table.schema.metadata or {}), b"geo": json.dumps(geo).encode()})
+			self.writer = pq.ParquetWriter(self.path, schema)
+
+		self.writer.write_table(table)
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+
+
+WRITERS = {
+	OccurrenceExport.GEOPACKAGE: GeoPackageWriter,
+	OccurrenceExport.GEOPARQUET: GeoParquetWriter,
+}
+
+
+def export_occurrences(occurrences, path, export_format, chunk_size=CHUNK_SIZE, callback=None):
+	"""
+	Write the occurrences of a queryset with their taxon lineage and sources to a GeoPackage or GeoParquet file.
+
+	Rows are read from a server-side cursor and written `chunk_size` at a time, so memory stays bounded
+	whatever the size of the export. The file is written next to `path` and moved into place once complete.
+	Returns the number of exported occurrences.
+	"""
+	lineages = get_lineages()
+	rows = (
+		occurrences.order_by()
+		.prefetch_related(None)
+		.annotate(latitude=coordinate("Y"), longitude=coordinate("X"))
+		.values_list(*OCCURRENCE_FIELDS)
+		.iterator(chunk_size=chunk_size)
+	)
+
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	partial_path = f"{path}.part"
+	if os.path.exists(partial_path):
+		os.remove(partial_path)
+
+	writer = WRITERS[export_format](partial_path)
+	total = 0
+	try:
+		while chunk := list(islice(rows, chunk_size)):
+			writer.write(build_frame(chunk, lineages))
+			total += len(chunk)
+			if callback:
+				callback(len(chunk))
+
+		if not total:
+			writer.write(build_frame([], lineages))
+	except BaseException:
+		writer.close()
+		remove_file(partial_path)
+		raise
+
+	writer.close()
+	os.replace(partial_path, path)
+
+	return total
+
+
+def remove_file(path):
+	if os.path.exists(path):
+		os.remove(path)
+
+
+def run_export(export, occurrences):
+	def progress(rows):
+		export.rows = (export.rows or 0) + rows
+		export.save(update_fields=["rows", "updated_at"])
+
+	try:
+		export.status = OccurrenceExport.RUNNING
+		export.save(update_fields=["status", "updated_at"])
+
+		export.rows = export_occurrences(occurrences, export.get_path(), export.export_format, callback=progress)
+		export.status = OccurrenceExport.FINISHED
+	except Exception as e:
+		export.status = OccurrenceExport.FAILED
+		export.error = str(e)
+	finally:
+		export.finished_at = timezone.now()
+		export.save()
+		connections.close_all()
+
+
+def start_export(export, occurrences):
+	"""
+	Run an export in a background thread. The queryset is evaluated by the thread with its own connection.
+	"""
+	thread = threading.Thread(target=run_export, args=(export, occurrences), daemon=True)
+	thread.start()
+
+	return thread
+
+
+def expire_exports():
+	"""
+	Fail the exports whose worker stopped making progress, e.g. because it was restarted, and delete the exports
+	older than EXPORT_RETENTION together with their files.
+	"""
+	now = timezone.now()
+	OccurrenceExport.objects.filter(
+		status__in=[OccurrenceExport.PENDING, OccurrenceExport.RUNNING],
+		updated_at__lt=now - timedelta(seconds=settings.EXPORT_STALE_AFTER),
+	).update(status=OccurrenceExport.FAILED, error="Export stopped making progress", finished_at=now)
+
+	for export in OccurrenceExport.objects.filter(created_at__lt=now - timedelta(seconds=settings.EXPORT_RETENTION)):
+		remove_file(export.get_path())
+		remove_file(f"{export.get_path()}.part")
+		export.delete()
+
+
+def request_export(occurrences, export_format, query):
+	"""
+	Get the export of the occurrences of a query in the current data version, starting it if there is none.
+	Requests are serialized across workers, so identical requests share a single export.
+
+	:param occurrences: Queryset of the occurrences to export
+	:param export_format: File format of the export
+	:param query: Normalized query string the occurrences were filtered with
+	:return: The pending, running or finished export, or None if EXPORT_MAX_RUNNING exports are already running
+	"""
+	active = [OccurrenceExport.PENDING, OccurrenceExport.RUNNING]
+
+	with single_flight("occurrence_export"):
+		expire_exports()
+		version = get_batch_version()
+
+		export = (
+			OccurrenceExport.objects.filter(
+				export_format=export_format,
+				query=query,
+				version=version,
+				status__in=active + [OccurrenceExport.FINISHED],
+			)
+			.order_by("-id")
+			.first()
+		)
+		if export:
+			return export
+
+		if OccurrenceExport.objects.filter(status__in=active).count() >= settings.EXPORT_MAX_RUNNING:
+			return None
+
+		export = OccurrenceExport.objects.create(export_format=export_format, query=query, version=version)
+
+	start_export(export, occurrences)
+
+	return export
+
+
+class ExportRateThrottle(AnonRateThrottle):
+	"""
+	Exports started per client address, counted in the result cache so that every worker sees the same history.
+	"""
+
+	scope = "occurrence_export"
+
+	@property
+	def cache(self):
+		return get_result_cache()
@@ -1,6 +1,7 @@
 from django import forms
 from common.utils.fields import SRIDPolygonField
 from common.utils.forms import IdFieldForm, TranslateForm, CamelCaseForm
+from .models import OccurrenceExport
 
 
 class LatLonForm(IdFieldForm, TranslateForm):
@@ -80,3 +81,19 @@ class OccurrenceForm(LatLonForm, DateOccurrenceForm):
 		"month": "collection_date_month",
 		"day": "collection_date_day",
 	}
+
+
+class OccurrenceDensityForm(CamelCaseForm):
+	cell_size = forms.FloatField(
+		required=False, min_value=0.001, max_value=1, initial=0.01, label="Cell size (degrees)"
+	)
+
+	def clean_cell_size(self):
+		value = self.cleaned_data.get("cell_size")
+
+		return self.fields["cell_size"].initial if value is None else value
+
+
+class OccurrenceExportForm(CamelCaseForm):
+	id = forms.IntegerField(required=False)
+	export_format = forms.ChoiceField(required=False, choices=OccurrenceExport.FORMAT_CHOICES)
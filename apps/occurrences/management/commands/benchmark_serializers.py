@@ -0,0 +1,65 @@
+import timeit
+from contextlib import contextmanager
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from humps import camelize
+
+from apps.occurrences.models import Occurrence
+from apps.occurrences.serializers import BaseOccurrenceWithTaxonSerializer
+from apps.taxonomy.models import TaxonomicLevel
+from common.utils.serializers import CaseModelSerializer
+
+
+@contextmanager
+def camelize_per_row():
+	"""
+	Serialize as before the per-class key cache: camelize every serialized dict recursively.
+	"""
+	to_representation = CaseModelSerializer.to_representation
+	CaseModelSerializer.to_representation = lambda self, instance: camelize(
+		super(CaseModelSerializer, self).to_representation(instance)
+	)
+	try:
+		yield
+	finally:
+		CaseModelSerializer.to_representation = to_representation
+
+
+class Command(BaseCommand):
+	help = "Times the serialization of an in-memory occurrence list with and without the cached camelCase keys"
+
+	def add_arguments(self, parser):
+		parser.add_argument("--rows", type=int, default=10_000)
+		parser.add_argument("--repeat", type=int, default=5)
+
+	def handle(self, *args, **options):
+		# Genus rank, so the name is built without reading the parents
+		taxon = TaxonomicLevel(id=1, name="Alytes", rank=TaxonomicLevel.GENUS)
+		occurrences = [
+			Occurrence(
+				id=i,
+				taxonomy=taxon,
+				location=Point(2.65, 39.57, srid=4326),
+				coordinate_uncertainty_in_meters=100,
+				basis_of_record=Occurrence.HUMAN_OBSERVATION,
+			)
+			for i in range(options["rows"])
+		]
+
+		def serialize():
+			return BaseOccurrenceWithTaxonSerializer(occurrences, many=True).data
+
+		with camelize_per_row():
+			expected = serialize()
+			legacy = min(timeit.repeat(serialize, number=1, repeat=options["repeat"]))
+
+		if serialize() != expected:
+			self.stderr.write(self.style.ERROR("Cached keys do not produce the same output"))
+			return
+
+		cached = min(timeit.repeat(serialize, number=1, repeat=options["repeat"]))
+
+		self.stdout.write(f"camelize per row: {legacy * 1000:.1f} ms")
+		self.stdout.write(f"cached keys:      {cached * 1000:.1f} ms")
+		self.stdout.write(self.style.SUCCESS(f"{legacy / cached:.2f}x faster on {options['rows']} rows"))
@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from tqdm import tqdm
+
+from apps.API.exceptions import CBBAPIException
+from apps.occurrences.export import CHUNK_SIZE, WRITERS, export_occurrences
+from apps.occurrences.views import OccurrenceFilter
+
+
+class Command(BaseCommand):
+	help = "Exports filtered occurrences with taxon lineage and sources to a GeoPackage or GeoParquet file"
+
+	def add_arguments(self, parser):
+		parser.add_argument("file", type=str, help="Path of the output file (.gpkg or .parquet)")
+		parser.add_argument(
+			"--format", type=str, choices=list(WRITERS), default=None, help="Defaults to the file extension"
+		)
+		parser.add_argument(
+			"--query", type=str, default="", help="Filters as in the API query string, e.g. 'taxonomy=14&yearMin=2000'"
+		)
+		parser.add_argument("--all", action="store_true", help="Include occurrences out of the geography scope")
+		parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+	def handle(self, *args, **options):
+		file_name = options["file"]
+		export_format = options["format"] or os.path.splitext(file_name)[1].lstrip(".").lower()
+		if export_format not in WRITERS:
+			raise CommandError(f"Unknown export format '{export_format}', use one of: {', '.join(WRITERS)}")
+
+		try:
+			occurrences = OccurrenceFilter().filter_occurrences(
+				QueryDict(options["query"]), in_geography_scope=not options["all"]
+			)
+		except CBBAPIException as e:
+			raise CommandError(e.detail)
+
+		with tqdm(ncols=50, colour="yellow", smoothing=0, unit=" occ") as progress:
+			total = export_occurrences(
+				occurrences, file_name, export_format, chunk_size=options["chunk_size"], callback=progress.update
+			)
+
+		self.stdout.write(self.style.SUCCESS(f"Exported {total} occurrences to {file_name}"))
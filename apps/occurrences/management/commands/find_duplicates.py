@@ -0,0 +1,122 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from apps.genetics.models import Sequence
+from apps.occurrences.duplicates import KEY_FIELDS, annotate_keys
+from apps.occurrences.models import Occurrence
+from common.utils.cache import bump_data_version
+from common.utils.utils import chunked
+
+CHUNK_SIZE = 10_000
+
+
+class Command(BaseCommand):
+	help = "Finds occurrences of the same accepted taxon, rounded coordinates, date and recorder"
+
+	def add_arguments(self, parser):
+		action = parser.add_mutually_exclusive_group()
+		action.add_argument("--flag", action="store_true", help="Point each duplicate to the occurrence it duplicates")
+		action.add_argument(
+			"--merge",
+			action="store_true",
+			help="Move the sources and sequences of each duplicate to the occurrence it duplicates and delete it",
+		)
+
+	@transaction.atomic
+	def handle(self, *args, **options):
+		duplicates = self.find_duplicates()
+		self.stdout.write(f"Found {len(duplicates)} duplicates of {len(set(duplicates.values()))} occurrences")
+
+		if not (options["flag"] or options["merge"]):
+			return
+
+		if options["merge"]:
+			merged = self.merge(duplicates)
+			self.stdout.write(f"Merged {len(merged)} duplicates")
+			duplicates = {
+				duplicate_id: kept_id for duplicate_id, kept_id in duplicates.items() if duplicate_id not in merged
+			}
+
+		self.flag(duplicates)
+		bump_data_version("find_duplicates")
+		self.stdout.write(self.style.SUCCESS(f"Flagged {len(duplicates)} duplicates"))
+
+	@staticmethod
+	def find_duplicates():
+		"""
+		Sort all the occurrences by their duplicate key in the database and stream them, so that duplicates
+		are consecutive. The oldest occurrence of every group is kept and the rest are mapped to it.
+		"""
+		rows = (
+			annotate_keys(Occurrence.objects.all())
+			.order_by(*KEY_FIELDS, "id")
+			.values_list("id", *KEY_FIELDS)
+			.iterator(chunk_size=CHUNK_SIZE)
+		)
+
+		duplicates = {}
+		for _, group in groupby(rows, key=lambda row: row[1:]):
+			kept_id, *duplicate_ids = [row[0] for row in group]
+			for duplicate_id in duplicate_ids:
+				duplicates[duplicate_id] = kept_id
+
+		return duplicates
+
+	@staticmethod
+	def flag(duplicates):
+		Occurrence.objects.filter(duplicate_of__isnull=False).update(duplicate_of=None)
+		Occurrence.objects.bulk_update(
+			[Occurrence(id=duplicate_id, duplicate_of_id=kept_id) for duplicate_id, kept_id in duplicates.items()],
+			["duplicate_of"],
+			batch_size=CHUNK_SIZE,
+		)
+
+	@staticmethod
+	def merge(duplicates):
+		"""
+		Merge the duplicates whose sources do not clash with the ones of the kept occurrence,
+		since an occurrence can only have one origin id per source. Returns the merged duplicates.
+		"""
+		through = Occurrence.sources.through
+		sources = {}
+		for ids in chunked(set(duplicates) | set(duplicates.values()), CHUNK_SIZE):
+			origin_ids = through.objects.filter(occurrence_id__in=ids).values_list(
+				"occurrence_id", "originid_id", "originid__source_id"
+			)
+			for occurrence_id, origin_id, source_id in origin_ids:
+				sources.setdefault(occurrence_id, {})[source_id] = origin_id
+
+		merged = {}
+		for duplicate_id, kept_id in duplicates.items():
+			kept_sources = sources.setdefault(kept_id, {})
+			duplicate_sources = sources.get(duplicate_id, {})
+			if kept_sources.keys() & duplicate_sources.keys():
+				continue
+
+			kept_sources.update(duplicate_sources)
+			merged[duplicate_id] = kept_id
+
+		through.objects.bulk_create(
+			[
+				through(occurrence_id=kept_id, originid_id=origin_id)
+				for duplicate_id, kept_id in merged.items()
+				for origin_id in sources.get(duplicate_id, {}).values()
+			],
+			batch_size=CHUNK_SIZE,
+			ignore_conflicts=True,
+		)
+
+		for chunk in chunked(merged.items(), 1_000):
+			chunk = dict(chunk)
+			Sequence.objects.filter(occurrence_id__in=chunk).update(
+				occurrence_id=Case(
+					*[When(occurrence_id=duplicate_id, then=Value(kept_id)) for duplicate_id, kept_id in chunk.items()]
+				)
+			)
+			Occurrence.objects.filter(id__in=chunk).delete()
+			Sequence.update_taxonomy_intervals(set(chunk.values()))
+
+		return merged
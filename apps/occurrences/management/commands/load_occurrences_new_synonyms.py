@@ -6,16 +6,23 @@ from dateutil import parser
 from django.contrib.gis.geos import Point, GEOSGeometry
 
 from apps.genetics.models import Sequence, Marker
+from apps.occurrences.duplicates import DuplicateIndex
 from apps.occurrences.models import Occurrence
 from apps.taxonomy.models import TaxonomicLevel
 from apps.versioning.models import Batch, OriginId, Source, Basis
-from common.utils.utils import get_or_create_source, is_batch_referenced, REMOVE_PUNCTUATION
+from common.utils.utils import get_or_create_source, is_batch_referenced, refresh_source_counters, REMOVE_PUNCTUATION
 from tqdm import tqdm
 
 EXTERNAL_ID = "sample_id"
 INTERNAL_NAME = "occurrenceSource"
 SOURCE_TYPE = "occurrenceOrigin"
 
+FLAG = "flag"
+MERGE = "merge"
+KEEP = "keep"
+
+SEQUENCE_BATCH_SIZE = 1000
+
 TAXON_KEYS = [
 	("kingdom", "kingdomKey", TaxonomicLevel.KINGDOM),
 	("phylum", "phylumKey", TaxonomicLevel.PHYLUM),
@@ -86,7 +93,94 @@ def parse_line(line: dict):
 	return line
 
 
-def genetic_sources(line: dict, batch, occ):
+class MarkerRegistry:
+	"""
+	Markers seen by the loader. Gene names are tested against every BIO_MARKERS entry with a single compiled regex
+	and resolved to their Marker through an in-memory cache filled with one query, new markers are created once.
+	"""
+
+	def __init__(self, batch):
+		self.batch = batch
+		self.pattern = re.compile("|".join(re.escape(marker) for marker in sorted(BIO_MARKERS, key=len, reverse=True)))
+		self.matches = {}
+		self.markers = {}
+		for marker in Marker.objects.lean().exclude(name=None).order_by("-id"):
+			self.markers[marker.name.lower()] = marker
+
+	def is_marker(self, gene):
+		if gene not in self.matches:
+			normalized_gene_name = re.sub(r"[-\s_]", "", gene.lower().translate(REMOVE_PUNCTUATION))
+			self.matches[gene] = self.pattern.search(normalized_gene_name) is not None
+
+		return self.matches[gene]
+
+	def get(self, gene, product):
+		"""
+		Marker of a gene name, case insensitive, or None if the gene is not a relevant marker.
+		"""
+		if not self.is_marker(gene):
+			return None
+
+		marker = self.markers.get(gene.lower())
+		if not marker:
+			marker = Marker.objects.create(name=gene, batch=self.batch, accepted=True, product=product)
+			self.markers[gene.lower()] = marker
+
+		if not marker.is_relevant:
+			return None
+
+		if product and marker.product is None:
+			marker.product = product
+			marker.save(update_fields=["product"])
+
+		return marker
+
+
+class SequenceBuffer:
+	"""
+	Sequences waiting to be inserted with their source and markers. They are written with `bulk_create` in batches
+	of `batch_size`, links included.
+	"""
+
+	def __init__(self, batch_size=SEQUENCE_BATCH_SIZE):
+		self.batch_size = batch_size
+		self.sequences = []
+		self.external_ids = set()
+
+	def __contains__(self, external_id):
+		return str(external_id).lower() in self.external_ids
+
+	def add(self, sequence, origin_id, markers):
+		self.sequences.append((sequence, origin_id, markers))
+		self.external_ids.add(str(origin_id.external_id).lower())
+
+		if len(self.sequences) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if not self.sequences:
+			return
+
+		Sequence.objects.bulk_create([sequence for sequence, _, _ in self.sequences])
+		Sequence.sources.through.objects.bulk_create(
+			[
+				Sequence.sources.through(sequence_id=sequence.id, originid_id=origin_id.id)
+				for sequence, origin_id, _ in self.sequences
+			]
+		)
+		Sequence.markers.through.objects.bulk_create(
+			[
+				Sequence.markers.through(sequence_id=sequence.id, marker_id=marker_id)
+				for sequence, _, markers in self.sequences
+				for marker_id in dict.fromkeys(marker.id for marker in markers)
+			]
+		)
+
+		self.sequences = []
+		self.external_ids = set()
+
+
+def genetic_sources(line: dict, batch, occ, markers: MarkerRegistry, sequences: SequenceBuffer):
 	source = get_or_create_source(
 		source_type=line[SOURCE_TYPE],
 		extraction_method=Source.API,
@@ -103,51 +197,27 @@ def genetic_sources(line: dict, batch, occ):
 			"attribution": line["attribution"],
 		},
 	)
-	if Sequence.objects.filter(sources=os, occurrence=occ).exists():
+	if not new and Sequence.objects.filter(sources=os, occurrence=occ).exists():
 		raise Exception(f"OriginId already exists\n{line}")
 
-	has_seq_markers = False
 	markers_to_add = []
 	for production in line["genetic_features"]:
 		if production["gene"]:
-			normalized_gene_name = re.sub(r"[-\s_]", "", production["gene"].lower().translate(REMOVE_PUNCTUATION))
-			# if normalized_gene_name in BIO_MARKERS:
-			if any(m in normalized_gene_name for m in BIO_MARKERS):
-				marker, is_new = Marker.objects.get_or_create(
-					name__iexact=production["gene"],
-					defaults={
-						"name": production["gene"],
-						"batch": batch,
-						"accepted": True,
-						"product": production["product"],
-					},
-				)
-
-				if not marker.is_relevant:
-					continue
-
-				has_seq_markers = True
-
-				if production["product"] and marker.product is None:
-					marker.product = production["product"]
-					marker.save()
-
+			marker = markers.get(production["gene"], production["product"])
+			if marker:
 				markers_to_add.append(marker)
 
 	# Create seq only if markers were found
-	if has_seq_markers:
-		seq = Sequence.objects.create(
+	if markers_to_add:
+		sequence = Sequence(
 			occurrence=occ,
 			batch=batch,
 			isolate=line["isolate"],
 			definition=line["definition"],
 			published_date=parser.parse(line["date"]) if line["date"] else None,
 		)
-		seq.sources.add(os)
-
-		# Add all markers in a single operation
-		seq.markers.add(*markers_to_add)
-		seq.save()
+		sequence.set_taxonomy_interval(occ)
+		sequences.add(sequence, os, markers_to_add)
 
 
 def create_origin_id(ref_model_elem, external_id, source):
@@ -167,6 +237,16 @@ class Command(BaseCommand):
 	def add_arguments(self, parser):
 		parser.add_argument("file", type=str)
 		parser.add_argument("-d", nargs="?", type=str, default=",")
+		parser.add_argument(
+			"--duplicates",
+			type=str,
+			choices=[FLAG, MERGE, KEEP],
+			default=FLAG,
+			help=(
+				"What to do with occurrences of the same accepted taxon, place, date and recorder as an existing one: "
+				"flag them as duplicates, merge their sources into the existing occurrence or keep them as they are"
+			),
+		)
 
 	@transaction.atomic
 	def handle(self, *args, **options):
@@ -182,11 +262,17 @@ class Command(BaseCommand):
 			)
 			cbb_scope_geometry = GEOSGeometry(cbb_scope_geometry.wkt)
 			batch = Batch.objects.create()
+			duplicates = DuplicateIndex.from_database() if options["duplicates"] != KEEP else None
+			markers = MarkerRegistry(batch)
+			sequences = SequenceBuffer()
+
+			internal_names = set()
 
 			line: dict
 
 			for line in tqdm(data, ncols=50, colour="yellow", smoothing=0, miniters=100, delay=20):
 				line = parse_line(line)
+				internal_names.add(line[INTERNAL_NAME])
 				source = get_or_create_source(
 					source_type=line[SOURCE_TYPE],
 					extraction_method=Source.API,
@@ -275,7 +361,7 @@ class Command(BaseCommand):
 					location = (
 						(Point(list(reversed(line["lat_lon"])), srid=4326)) if line.get("lat_lon", None) else None
 					)
-					occ = Occurrence.objects.create(
+					fields = dict(
 						taxonomy=taxonomy.first(),
 						batch=batch,
 						voucher=line["voucher"] if line["voucher"] else None,
@@ -300,18 +386,45 @@ class Command(BaseCommand):
 						recorded_by=line["recordedBy"],
 						in_geography_scope=cbb_scope_geometry.intersects(location) if location else False,
 					)
+
+					duplicate_key, duplicate_id = None, None
+					if duplicates:
+						duplicate_key = duplicates.key(
+							fields["taxonomy"].id,
+							location,
+							fields["collection_date_year"],
+							fields["collection_date_month"],
+							fields["collection_date_day"],
+							fields["recorded_by"],
+						)
+						duplicate_id = duplicates.find(duplicate_key)
+
+					# Sources are unique per occurrence, so a duplicate coming from the same source can only be flagged
+					new_sources = [os.source_id] + ([os_dk.source_id] if os_dk else [])
+					if (
+						duplicate_id
+						and options["duplicates"] == MERGE
+						and not OriginId.objects.filter(occurrence=duplicate_id, source__in=new_sources).exists()
+					):
+						occ = Occurrence.objects.lean().get(id=duplicate_id)
+					else:
+						occ = Occurrence.objects.create(**fields, duplicate_of_id=duplicate_id)
+						if duplicates and not duplicate_id:
+							duplicates.add(duplicate_key, occ.id)
 				else:
-					occ = Occurrence.objects.get(sources=os)
+					occ = Occurrence.objects.lean().get(sources=os)
 
 				occ.sources.add(os)
 				if os_dk:
 					occ.sources.add(os_dk)
-				occ.save()
 
 				if (
 					"genetic_features" in line
+					and line[EXTERNAL_ID] not in sequences
 					and not OriginId.objects.filter(sequence__sources__external_id__iexact=line[EXTERNAL_ID]).exists()
 				):
-					genetic_sources(line, batch, occ)
+					genetic_sources(line, batch, occ, markers, sequences)
 
+			sequences.flush()
+			refresh_source_counters(internal_names)
 			is_batch_referenced(batch)
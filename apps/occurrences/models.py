@@ -1,11 +1,21 @@
 import datetime
+import os
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
 from apps.taxonomy.models import TaxonomicLevel
 from common.utils.models import LatLonModel, ReferencedModel
 
 
+class OccurrenceQuerySet(models.QuerySet):
+	def distinct_records(self):
+		"""
+		Leave out the occurrences flagged as duplicates of another one, which every count and listing skips.
+		"""
+		return self.filter(duplicate_of__isnull=True)
+
+
 class Occurrence(ReferencedModel, LatLonModel):
 	LIVING = 0
 	PRESERVED = 1
@@ -66,6 +76,11 @@ class Occurrence(ReferencedModel, LatLonModel):
 	collection_date_day = models.PositiveSmallIntegerField(null=True, blank=True)
 	basis_of_record = models.PositiveSmallIntegerField(choices=BASIS_OF_RECORD, null=True, blank=True)
 	in_geography_scope = models.BooleanField()
+	duplicate_of = models.ForeignKey(
+		"self", on_delete=models.SET_NULL, null=True, blank=True, default=None, related_name="duplicates"
+	)
+
+	objects = ReferencedModel.ReferencedManager.from_queryset(OccurrenceQuerySet)()
 
 	def clean(self):
 		super().clean()
@@ -93,3 +108,55 @@ class Occurrence(ReferencedModel, LatLonModel):
 			models.Index(fields=["taxonomy", "in_geography_scope"]),
 			models.Index(fields=["location"]),
 		]
+
+
+class OccurrenceExport(models.Model):
+	PENDING = 0
+	RUNNING = 1
+	FINISHED = 2
+	FAILED = 3
+
+	STATUS_CHOICES = (
+		(PENDING, "Pending"),
+		(RUNNING, "Running"),
+		(FINISHED, "Finished"),
+		(FAILED, "Failed"),
+	)
+	TRANSLATE_STATUS = {
+		PENDING: "pending",
+		RUNNING: "running",
+		FINISHED: "finished",
+		FAILED: "failed",
+	}
+
+	GEOPACKAGE = "gpkg"
+	GEOPARQUET = "parquet"
+
+	FORMAT_CHOICES = (
+		(GEOPACKAGE, "GeoPackage"),
+		(GEOPARQUET, "GeoParquet"),
+	)
+
+	export_format = models.CharField(max_length=16, choices=FORMAT_CHOICES)
+	query = models.TextField(blank=True, default="")
+	# Data version the export was made from, it is reused by identical requests until the data changes
+	version = models.CharField(max_length=64, blank=True, default="")
+	status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=PENDING)
+	rows = models.PositiveIntegerField(null=True, blank=True, default=None)
+	error = models.TextField(null=True, blank=True, default=None)
+	created_at = models.DateTimeField(auto_now_add=True, editable=False)
+	finished_at = models.DateTimeField(null=True, blank=True, default=None)
+	# Touched by the worker after every chunk, exports that stop being touched are failed
+	updated_at = models.DateTimeField(auto_now=True)
+
+	def translate_status(self):
+		return self.TRANSLATE_STATUS[self.status]
+
+	def get_filename(self):
+		return f"occurrences_{self.id}.{self.export_format}"
+
+	def get_path(self):
+		return os.path.join(settings.EXPORT_ROOT, self.get_filename())
+
+	def __str__(self):
+		return f"{self.get_filename()} ({self.translate_status()})"
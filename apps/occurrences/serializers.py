@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from common.utils.serializers import CaseModelSerializer
-from .models import Occurrence
+from .models import Occurrence, OccurrenceExport
 from ..geography.models import GeographicLevel
 from ..geography.serializers import GeographicLevelSerializer, MinimalGeographicLevelSerializer
 from ..taxonomy.serializers import BaseTaxonomicLevelSerializer, MinimalTaxonomicLevelSerializer
@@ -159,3 +159,14 @@ class DynamicSourceSerializer(serializers.Serializer):
 
 	def to_representation(self, instance):
 		return {"source": instance["sources__source__basis__internal_name"], "count": instance["count"]}
+
+
+class OccurrenceExportSerializer(CaseModelSerializer):
+	status = serializers.SerializerMethodField()
+
+	class Meta:
+		model = OccurrenceExport
+		fields = ["id", "export_format", "query", "status", "rows", "error", "created_at", "finished_at"]
+
+	def get_status(self, obj):
+		return obj.translate_status()
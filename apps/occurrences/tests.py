@@ -1,7 +1,22 @@
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
 from rest_framework import status
 
+from apps.occurrences.models import Occurrence
+from apps.occurrences.serializers import OccurrenceSerializer
+from common.utils.cache import batch_cached, bump_data_version, get_cache_stats
+from common.utils.serializers import get_query_plan, plan_queryset
 from common.utils.tests import TestResultHandler
 
+LOCAL_RESULT_CACHE = {
+	**settings.CACHES,
+	"results": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "occurrences_tests"},
+}
+
 EXPECTED_OCURRENCE = [
 	{"id": 26},
 	{"id": 95},
@@ -83,6 +98,54 @@ class OccurrencesTest(TestResultHandler):
 		response = self.client.get(url)
 		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_404_NOT_FOUND)
 
+	def test_occurrence_map_columnar_200(self):
+		taxonomy_id = 14
+		url = self._generate_url("occurrences:occurrence_map", taxonomy=taxonomy_id, format="columnar")
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assert_and_log(self.assertEqual, response["Content-Type"], "application/octet-stream")
+		self.assert_and_log(
+			self.assertEqual,
+			response["X-Columns"],
+			"id:<i4,decimalLatitude:<f4,decimalLongitude:<f4,coordinateUncertaintyInMeters:<i4",
+		)
+		n_points = int.from_bytes(response.content[:4], "little")
+		self.assert_and_log(self.assertEqual, len(response.content), 4 + 16 * n_points)
+
+	def test_occurrence_density_200(self):
+		taxonomy_id = 14
+		url = self._generate_url("occurrences:occurrence_density", taxonomy=taxonomy_id, cellSize=0.1)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assert_and_log(self.assertEqual, response.data["cellSize"], 0.1)
+		self.assert_and_log(self.assertEqual, len(response.data["x"]), len(response.data["occurrences"]))
+		self.assert_and_log(self.assertLessEqual, sum(response.data["occurrences"]), 104)
+		self.assert_and_log(self.assertEqual, set(response.data["taxa"]), {1})
+
+	def test_occurrence_density_400(self):
+		url = self._generate_url("occurrences:occurrence_density", taxonomy=14, cellSize=0)
+		response = self.client.get(url)
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_occurrence_export_400(self):
+		url = self._generate_url("occurrences:occurrence_export", taxonomy=14)
+		response = self.client.post(url)
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		expected_data = {"detail": "Missing exportFormat parameter"}
+		self.assert_and_log(self.assertJSONEqual, response.content, expected_data)
+
+	def test_occurrence_export_404(self):
+		url = self._generate_url("occurrences:occurrence_export", id=99999)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+		expected_data = {"detail": "Export does not exist"}
+		self.assert_and_log(self.assertJSONEqual, response.content, expected_data)
+
+	def test_occurrence_export_download_400(self):
+		url = self._generate_url("occurrences:occurrence_export_download")
+		response = self.client.get(url)
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_400_BAD_REQUEST)
+
 	def test_occurrence_count_200(self):
 		taxon_id = 14
 		url = self._generate_url("occurrences:occurrence_list_count", taxonomy=taxon_id)
@@ -91,6 +154,24 @@ class OccurrencesTest(TestResultHandler):
 		expected_data = 104
 		self.assert_and_log(self.assertEqual, response.data, expected_data)
 
+	def test_occurrence_count_approx_200(self):
+		taxon_id = 14
+		url = self._generate_url("occurrences:occurrence_list_count", taxonomy=taxon_id, approx="true")
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		expected_data = {"count": 104, "approximate": False, "method": "exact", "error": 0, "confidence": 1}
+		self.assert_and_log(self.assertJSONEqual, response.content, expected_data)
+
+	def test_occurrence_count_approx_filters(self):
+		lightly_filtered = []
+		for params in [{"taxonomy": 14, "page": 2, "exclude": "id"}, {"taxonomy": 14, "yearMin": 2000, "page": 2}]:
+			url = self._generate_url("occurrences:occurrence_list_count", approx="true", **params)
+			with mock.patch("common.utils.counts.approximate_count", return_value={}) as approximate_count:
+				self.client.get(url)
+			lightly_filtered.append(approximate_count.call_args.kwargs["lightly_filtered"])
+
+		self.assert_and_log(self.assertEqual, lightly_filtered, [True, False])
+
 	def test_occurrence_count_400(self):
 		url = self._generate_url("occurrences:occurrence_list_count", taxonomy=None)
 		response = self.client.get(url)
@@ -153,6 +234,19 @@ class OccurrencesTest(TestResultHandler):
 		self.assertEqual(response.status_code, status.HTTP_200_OK)
 		self.assert_and_log(self.assertJSONEqual, response.content, expected_data)
 
+	def test_occurrence_month_stats_skip_duplicates(self):
+		kept, duplicate = Occurrence.objects.filter(
+			taxonomy_id=14, in_geography_scope=True, collection_date_month=4
+		).order_by("id")[:2]
+		Occurrence.objects.filter(id=duplicate.id).update(duplicate_of=kept)
+		# As find_duplicates does after flagging
+		bump_data_version("test")
+
+		url = self._generate_url("occurrences:occurrence_month_stats", taxonomy=14)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assert_and_log(self.assertIn, {"count": 15, "month": 4}, response.json())
+
 	def test_occurrence_month_stats_400(self):
 		taxonomy = None
 		url = self._generate_url("occurrences:occurrence_month_stats", taxonomy=taxonomy)
@@ -203,3 +297,90 @@ class OccurrencesTest(TestResultHandler):
 		url = self._generate_url("occurrences:occurrence_year_stats", taxonomy=9999)
 		response = self.client.get(url)
 		self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_occurrence_query_plan(self):
+		select_related, prefetch_related = get_query_plan(OccurrenceSerializer)
+		self.assert_and_log(
+			self.assertEqual, select_related, ("taxonomy", "taxonomy__parent", "taxonomy__parent__parent")
+		)
+		self.assert_and_log(
+			self.assertEqual,
+			prefetch_related,
+			(
+				"taxonomy__images",
+				"taxonomy__images__source",
+				"taxonomy__images__source__basis",
+				"sources",
+				"sources__source",
+				"sources__source__basis",
+			),
+		)
+
+	def test_occurrence_query_plan_sparse(self):
+		select_related, prefetch_related = get_query_plan(OccurrenceSerializer, choice=frozenset(["id"]))
+		self.assert_and_log(self.assertEqual, (select_related, prefetch_related), ((), ()))
+
+		select_related, prefetch_related = get_query_plan(
+			OccurrenceSerializer, exclude=frozenset(["images", "sources"])
+		)
+		self.assert_and_log(
+			self.assertEqual, select_related, ("taxonomy", "taxonomy__parent", "taxonomy__parent__parent")
+		)
+		self.assert_and_log(self.assertEqual, prefetch_related, ())
+
+	def test_occurrence_query_plan_unknown_fields(self):
+		plan_queryset(Occurrence.objects.all(), OccurrenceSerializer, exclude=frozenset(["unknown"]))
+		cached_plans = get_query_plan.cache_info().currsize
+		plan_queryset(Occurrence.objects.all(), OccurrenceSerializer, exclude=frozenset(["unknown", "other"]))
+		self.assert_and_log(self.assertEqual, get_query_plan.cache_info().currsize, cached_plans)
+
+	@override_settings(CACHES=LOCAL_RESULT_CACHE)
+	def test_occurrence_stats_cache(self):
+		url = self._generate_url("occurrences:occurrence_source_stats", taxonomy=14)
+		first = self.client.get(url)
+		second = self.client.get(url)
+		self.assertEqual(second.status_code, status.HTTP_200_OK)
+		self.assert_and_log(self.assertEqual, second.data, first.data)
+		self.assert_and_log(
+			self.assertEqual, get_cache_stats()["occurrence_source_stats"], {"hit": 1, "miss": 1, "wait": 0}
+		)
+
+	@override_settings(CACHES=LOCAL_RESULT_CACHE)
+	def test_occurrence_stats_cache_data_change(self):
+		url = self._generate_url("occurrences:occurrence_source_stats", taxonomy=14)
+		self.client.get(url)
+		bump_data_version("test")
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assert_and_log(
+			self.assertEqual, get_cache_stats()["occurrence_source_stats"], {"hit": 0, "miss": 2, "wait": 0}
+		)
+
+	@override_settings(CACHES=LOCAL_RESULT_CACHE)
+	def test_occurrence_stats_cache_wait(self):
+		started = threading.Event()
+		release = threading.Event()
+		computed = []
+		results = []
+
+		def compute():
+			computed.append(1)
+			started.set()
+			release.wait(5)
+			return 1
+
+		def get_result():
+			results.append(batch_cached("test_wait", {}, compute))
+
+		with mock.patch("common.utils.cache.get_batch_version", return_value="test"):
+			threads = [threading.Thread(target=get_result) for _ in range(2)]
+			threads[0].start()
+			started.wait(5)
+			threads[1].start()
+			time.sleep(0.1)
+			release.set()
+			for thread in threads:
+				thread.join(5)
+
+		self.assert_and_log(self.assertEqual, (computed, results), ([1], [1, 1]))
+		self.assert_and_log(self.assertEqual, get_cache_stats()["test_wait"], {"hit": 0, "miss": 1, "wait": 1})
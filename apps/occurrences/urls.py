@@ -10,16 +10,22 @@ from apps.occurrences.views import (
 	OccurrenceCountByTaxonAndChildrenView,
 	OccurrenceListDownloadView,
 	OccurrenceMapView,
+	OccurrenceDensityView,
+	OccurrenceExportView,
+	OccurrenceExportDownloadView,
 	# OccurrenceMapCountView,
 )
 
 app_name = "occurrences"
 urlpatterns = [
 	path("", OccurrenceCRUDView.as_view(), name="occurrence_crud"),
-	path("/map", OccurrenceMapView.as_view(), name="occurrence_list"),
+	path("/map", OccurrenceMapView.as_view(), name="occurrence_map"),
+	path("/density", OccurrenceDensityView.as_view(), name="occurrence_density"),
 	# path("/map/count", OccurrenceMapCountView.as_view(), name="occurrence_list_count"),
 	path("/list", OccurrenceListView.as_view(), name="occurrence_list"),
 	path("/list/download", OccurrenceListDownloadView.as_view(), name="occurrence_list_download"),
+	path("/export", OccurrenceExportView.as_view(), name="occurrence_export"),
+	path("/export/download", OccurrenceExportDownloadView.as_view(), name="occurrence_export_download"),
 	path("/list/count", OccurrenceCountView.as_view(), name="occurrence_list_count"),
 	path("/stats/month", OccurrenceCountByTaxonMonthView.as_view(), name="occurrence_month_stats"),
 	path("/stats/year", OccurrenceCountByTaxonYearView.as_view(), name="occurrence_year_stats"),
@@ -1,13 +1,18 @@
-from django.db.models import Q, Count, Case, F, When, Value
+from django.db.models import Q, Count, Case, F, When, Value, IntegerField
+from django.db.models.functions import Coalesce
 from django.contrib.gis.geos import Polygon
-from django.http import JsonResponse
+from django.http import FileResponse, JsonResponse
+from urllib.parse import urlencode
 from drf_yasg import openapi
+import numpy as np
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from apps.taxonomy.models import TaxonomicLevel
 from apps.API.exceptions import CBBAPIException
-from apps.occurrences.forms import OccurrenceForm
-from apps.occurrences.models import Occurrence
+from apps.occurrences.export import ExportRateThrottle, request_export
+from apps.occurrences.forms import OccurrenceForm, OccurrenceDensityForm, OccurrenceExportForm
+from apps.occurrences.models import Occurrence, OccurrenceExport
 from apps.occurrences.serializers import (
 	OccurrenceSerializer,
 	BaseOccurrenceSerializer,
@@ -15,10 +20,16 @@ from apps.occurrences.serializers import (
 	OccurrenceCountByDateSerializer,
 	DynamicSourceSerializer,
 	OccurrenceWithLocationsSerializer,
+	OccurrenceExportSerializer,
 )
 from apps.geography.models import GeographicLevel
-from apps.tags.forms import IUCNDataForm, DirectiveForm, SystemForm, TaxonTagForm
+from apps.tags.forms import TRAIT_FORMS, get_trait_filters
 from common.utils.views import CSVDownloadMixin
+from common.utils.serializers import get_field_selection, get_serialized_data, plan_queryset
+from common.utils.cache import batch_cached
+from common.utils.renderers import ColumnarRenderer
+from common.utils.counts import APPROX_PARAMETER, get_count
+from common.utils.models import coordinate, grid_cell
 from common.utils.custom_swag_schema import custom_swag_schema
 
 
@@ -170,7 +181,10 @@ class OccurrenceFilter(APIView):
 			raise CBBAPIException(f"Bad coordinates format.", 400)
 
 	def calculate(self, request, in_geography_scope=True):
-		occur_form = OccurrenceForm(data=request.GET)
+		return self.filter_occurrences(request.GET, in_geography_scope)
+
+	def filter_occurrences(self, data, in_geography_scope=True):
+		occur_form = OccurrenceForm(data=data)
 
 		if not occur_form.is_valid():
 			raise CBBAPIException(occur_form.errors, 400)
@@ -192,38 +206,8 @@ class OccurrenceFilter(APIView):
 			for taxon in taxa:
 				filters |= Q(taxonomy__id=taxon.id) | Q(taxonomy__lft__gte=taxon.lft, taxonomy__rght__lte=taxon.rght)
 
-		filtered_data = {}
-
-		iucn_form = IUCNDataForm(data=request.GET)
-		if not iucn_form.is_valid():
-			raise CBBAPIException(iucn_form.errors, 400)
-		for key, value in iucn_form.cleaned_data.items():
-			if value != "":
-				filtered_data[f"taxonomy__iucndata__{key}"] = value and int(value)
-
-		directive_form = DirectiveForm(data=request.GET)
-		if not directive_form.is_valid():
-			raise CBBAPIException(directive_form.errors, 400)
-		for key, value in directive_form.cleaned_data.items():
-			if value:
-				filtered_data[f"taxonomy__directive__{key}"] = value
-
-		system_form = SystemForm(data=request.GET)
-		if not system_form.is_valid():
-			raise CBBAPIException(system_form.errors, 400)
-		for key, value in system_form.cleaned_data.items():
-			if value:
-				filtered_data[f"taxonomy__system__{key}"] = value
-
-		tag_form = TaxonTagForm(data=request.GET)
-		if not tag_form.is_valid():
-			raise CBBAPIException(tag_form.errors, 400)
-		if tag_form.cleaned_data.get("tag"):
-			filtered_data["taxonomy__taxontag__tag__name__iexact"] = tag_form.cleaned_data.get("tag")
-
-		for field, value in filtered_data.items():
-			if value is not None:
-				filters &= Q(**{field: value})
+		# IUCN, directive, system and tag filters are columns of a single traits row per taxon
+		filters &= get_trait_filters(data, prefix="taxonomy__")
 
 		source = occur_form.cleaned_data.get("source", None)
 		if source:
@@ -253,7 +237,7 @@ class OccurrenceFilter(APIView):
 				occur_form.cleaned_data.get(f"{param}_max"),
 			)
 
-		occurrences = Occurrence.objects.filter(filters)
+		occurrences = Occurrence.objects.distinct_records().filter(filters)
 
 		geometry = occur_form.cleaned_data.get("geometry")
 		if geometry is not None:
@@ -298,15 +282,27 @@ class OccurrenceCRUDView(APIView):
 		if not occur_id:
 			raise CBBAPIException("Missing id parameter", 400)
 
+		selection = get_field_selection(request)
 		try:
-			occurrence = Occurrence.objects.get(id=occur_id)
+			occurrence = plan_queryset(Occurrence.objects.all(), OccurrenceWithLocationsSerializer, **selection).get(
+				id=occur_id
+			)
 		except Occurrence.DoesNotExist:
 			raise CBBAPIException("Occurrence does not exist", 404)
 
-		return Response(OccurrenceWithLocationsSerializer(occurrence).data)
+		return Response(OccurrenceWithLocationsSerializer(occurrence, context=selection).data)
 
 
 class OccurrenceMapView(OccurrenceFilter):
+	renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
+
+	COLUMNS_DTYPE = [
+		("id", "<i4"),
+		("decimalLatitude", "<f4"),
+		("decimalLongitude", "<f4"),
+		("coordinateUncertaintyInMeters", "<i4"),
+	]
+
 	@custom_swag_schema(
 		tags="Occurrences",
 		operation_id="Get occurrence summary",
@@ -314,12 +310,101 @@ class OccurrenceMapView(OccurrenceFilter):
 			"Filter occurrences based on query parameters."
 			"The API returns a summarized list of unique occurrences that match the filters. "
 			"Each occurrence includes the following fields: id, coordinateUncertaintyInMeters, decimalLatitude, and decimalLongitude. \n\n"
+			"With `format=columnar` the response is a binary body with the number of points as a little-endian uint32 "
+			"followed by the packed little-endian columns `id` (int32), `decimalLatitude` (float32), `decimalLongitude` (float32) "
+			"and `coordinateUncertaintyInMeters` (int32, -1 when unknown), as described by the `X-Columns` header. "
+			"Occurrences without location are left out of the columnar format.\n\n"
 			"Range parameters such as `year`, `month`, `uncertainty`, `elevation`, and `depth` are inclusive of their boundary values."
 		),
-		manual_parameters=MANUAL_PARAMETERS,
+		manual_parameters=MANUAL_PARAMETERS
+		+ [
+			openapi.Parameter(
+				"format",
+				openapi.IN_QUERY,
+				description="Response format",
+				type=openapi.TYPE_STRING,
+				enum=["json", ColumnarRenderer.format],
+				required=False,
+			)
+		],
 	)
 	def get(self, request):
-		return Response(BaseOccurrenceSerializer(self.calculate(request).distinct("location"), many=True).data)
+		occurrences = self.calculate(request).distinct("location")
+
+		if request.accepted_renderer.format == ColumnarRenderer.format:
+			return Response(self.get_columns(occurrences))
+
+		return Response(BaseOccurrenceSerializer(occurrences, many=True).data)
+
+	def get_columns(self, occurrences):
+		rows = (
+			occurrences.filter(location__isnull=False)
+			.annotate(
+				latitude=coordinate("Y"),
+				longitude=coordinate("X"),
+				uncertainty=Coalesce("coordinate_uncertainty_in_meters", -1, output_field=IntegerField()),
+			)
+			.values_list("id", "latitude", "longitude", "uncertainty")
+		)
+		points = np.array(list(rows), dtype=self.COLUMNS_DTYPE)
+
+		return {name: points[name] for name, _ in self.COLUMNS_DTYPE}
+
+
+class OccurrenceDensityView(OccurrenceFilter):
+	@custom_swag_schema(
+		tags="Occurrences",
+		operation_id="Get occurrence density grid",
+		operation_description=(
+			"Filter occurrences based on query parameters and aggregate them in a regular grid. "
+			"The API returns parallel arrays with the `x` and `y` indexes of every non empty cell, "
+			"the number of occurrences and the number of distinct taxa inside it. "
+			"Cell (`x`, `y`) covers longitudes [`x` * `cellSize`, (`x` + 1) * `cellSize`) "
+			"and latitudes [`y` * `cellSize`, (`y` + 1) * `cellSize`).\n\n"
+			"Range parameters such as `year`, `month`, `uncertainty`, `elevation`, and `depth` are inclusive of their boundary values."
+		),
+		manual_parameters=MANUAL_PARAMETERS
+		+ [
+			openapi.Parameter(
+				"cellSize",
+				openapi.IN_QUERY,
+				default=0.01,
+				description="Side of the grid cells in degrees (between 0.001 and 1)",
+				type=openapi.TYPE_NUMBER,
+				format=openapi.FORMAT_DECIMAL,
+				required=False,
+			)
+		],
+	)
+	def get(self, request):
+		density_form = OccurrenceDensityForm(data=request.GET)
+
+		if not density_form.is_valid():
+			raise CBBAPIException(density_form.errors, 400)
+
+		cell_size = density_form.cleaned_data.get("cell_size")
+
+		cells = (
+			self.calculate(request)
+			.filter(location__isnull=False)
+			.annotate(x=grid_cell("X", cell_size), y=grid_cell("Y", cell_size))
+			.values("x", "y")
+			.annotate(occurrences=Count("id", distinct=True), taxa=Count("taxonomy", distinct=True))
+			.order_by("x", "y")
+			.values_list("x", "y", "occurrences", "taxa")
+		)
+
+		columns = list(zip(*cells)) or [(), (), (), ()]
+
+		return Response(
+			{
+				"cellSize": cell_size,
+				"x": list(columns[0]),
+				"y": list(columns[1]),
+				"occurrences": list(columns[2]),
+				"taxa": list(columns[3]),
+			}
+		)
 
 
 # class OccurrenceMapCountView(OccurrenceFilter):
@@ -433,7 +518,7 @@ class OccurrenceListView(OccurrenceFilter):
 		manual_parameters=MANUAL_PARAMETERS,
 	)
 	def get(self, request):
-		return Response(OccurrenceSerializer(self.calculate(request), many=True).data)
+		return Response(get_serialized_data(request, OccurrenceSerializer, self.calculate(request), many=True))
 
 
 class OccurrenceListDownloadView(OccurrenceFilter):
@@ -447,7 +532,7 @@ class OccurrenceListDownloadView(OccurrenceFilter):
 		manual_parameters=MANUAL_PARAMETERS,
 	)
 	def get(self, request):
-		response = self.calculate(request)
+		response = plan_queryset(self.calculate(request), DownloadOccurrenceSerializer)
 
 		# flattened_data = CSVDownloadMixin.flatten_json(DownloadOccurrenceSerializer(response, many=True).data, ["sources"])
 		flattened_data = DownloadOccurrenceSerializer(response, many=True).data
@@ -455,6 +540,106 @@ class OccurrenceListDownloadView(OccurrenceFilter):
 		return CSVDownloadMixin.generate_csv(flattened_data, "occurrences.csv")
 
 
+class OccurrenceExportView(OccurrenceFilter):
+	def get_throttles(self):
+		# Starting exports is throttled, polling their status is not
+		return [ExportRateThrottle()] if self.request.method == "POST" else []
+
+	@custom_swag_schema(
+		tags="Occurrences",
+		operation_id="Start export of filtered occurrences",
+		operation_description=(
+			"Start an export of the filtered occurrences, with their taxon lineage and sources, to GeoPackage (`gpkg`) "
+			"or GeoParquet (`parquet`). The export runs in the background; poll it with a GET request using the "
+			"returned `id` and download the file from `/occurrences/export/download` once its status is `finished`. "
+			"An identical request returns the existing export until the data changes, and exports are deleted after "
+			"a week.\n\n"
+			"Range parameters such as `year`, `month`, `uncertainty`, `elevation`, and `depth` are inclusive of their boundary values."
+		),
+		manual_parameters=MANUAL_PARAMETERS
+		+ [
+			openapi.Parameter(
+				"exportFormat",
+				openapi.IN_QUERY,
+				description="File format of the export",
+				type=openapi.TYPE_STRING,
+				enum=[OccurrenceExport.GEOPACKAGE, OccurrenceExport.GEOPARQUET],
+				required=True,
+			)
+		],
+		responses={200: "Success", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"},
+	)
+	def post(self, request):
+		export_form = OccurrenceExportForm(data=request.GET)
+		if not export_form.is_valid():
+			raise CBBAPIException(export_form.errors, 400)
+
+		export_format = export_form.cleaned_data.get("export_format")
+		if not export_format:
+			raise CBBAPIException("Missing exportFormat parameter", 400)
+
+		occurrences = self.calculate(request)
+		query = request.GET.copy()
+		query.pop("exportFormat", None)
+		query = urlencode(sorted(query.lists()), doseq=True)
+
+		export = request_export(occurrences, export_format, query)
+		if not export:
+			raise CBBAPIException("Too many exports are running, try again later", 429)
+
+		return Response(
+			OccurrenceExportSerializer(export).data, status=200 if export.status == OccurrenceExport.FINISHED else 202
+		)
+
+	@custom_swag_schema(
+		tags="Occurrences",
+		operation_id="Get occurrence export status",
+		operation_description="Get the status of an occurrence export by its ID.",
+		manual_parameters=[
+			openapi.Parameter("id", openapi.IN_QUERY, description="Export ID", type=openapi.TYPE_INTEGER, required=True)
+		],
+	)
+	def get(self, request):
+		return Response(OccurrenceExportSerializer(get_export(request)).data)
+
+
+class OccurrenceExportDownloadView(APIView):
+	@custom_swag_schema(
+		tags="Occurrences",
+		operation_id="Download occurrence export",
+		operation_description="Download the file of a finished occurrence export by its ID.",
+		manual_parameters=[
+			openapi.Parameter("id", openapi.IN_QUERY, description="Export ID", type=openapi.TYPE_INTEGER, required=True)
+		],
+		responses={200: "Success", 400: "Bad Request", 404: "Not Found", 409: "Conflict"},
+	)
+	def get(self, request):
+		export = get_export(request)
+
+		if export.status != OccurrenceExport.FINISHED:
+			raise CBBAPIException(f"Export is {export.translate_status()}", 409)
+
+		try:
+			return FileResponse(open(export.get_path(), "rb"), as_attachment=True, filename=export.get_filename())
+		except FileNotFoundError:
+			raise CBBAPIException("Export file does not exist", 404)
+
+
+def get_export(request):
+	export_form = OccurrenceExportForm(data=request.GET)
+	if not export_form.is_valid():
+		raise CBBAPIException(export_form.errors, 400)
+
+	export_id = export_form.cleaned_data.get("id")
+	if not export_id:
+		raise CBBAPIException("Missing id parameter", 400)
+
+	try:
+		return OccurrenceExport.objects.get(id=export_id)
+	except OccurrenceExport.DoesNotExist:
+		raise CBBAPIException("Export does not exist", 404)
+
+
 class OccurrenceCountView(OccurrenceFilter):
 	@custom_swag_schema(
 		tags="Occurrences",
@@ -463,10 +648,10 @@ class OccurrenceCountView(OccurrenceFilter):
 			"Count filtered occurrences based on query parameters. \n\n"
 			"Range parameters such as `year`, `month`, `uncertainty`, `elevation`, and `depth` are inclusive of their boundary values."
 		),
-		manual_parameters=MANUAL_PARAMETERS,
+		manual_parameters=MANUAL_PARAMETERS + [APPROX_PARAMETER],
 	)
 	def get(self, request):
-		return Response(self.calculate(request).count())
+		return Response(get_count(request, self.calculate(request), OccurrenceForm, *TRAIT_FORMS))
 
 
 class OccurrenceCountBySourceView(APIView):
@@ -491,17 +676,19 @@ class OccurrenceCountBySourceView(APIView):
 			raise CBBAPIException("Missing taxonomy id parameter", 400)
 
 		try:
-			taxonomy = TaxonomicLevel.objects.get(id=taxonomy).get_descendants(include_self=True)
+			descendants = TaxonomicLevel.objects.lean().get(id=taxonomy).get_descendants(include_self=True)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
 		occurrences = (
-			Occurrence.objects.filter(taxonomy__in=taxonomy, in_geography_scope=True)
+			Occurrence.objects.distinct_records()
+			.filter(taxonomy__in=descendants, in_geography_scope=True)
 			.prefetch_related("sources")
 			.values("sources__source__basis__internal_name")
 			.annotate(count=Count("id"))
 			.order_by("sources__source__basis__internal_name")
 		)
+		occurrences = batch_cached("occurrence_source_stats", {"taxonomy": taxonomy}, lambda: list(occurrences))
 
 		return Response(DynamicSourceSerializer(occurrences, many=True).data)
 
@@ -529,7 +716,7 @@ class OccurrenceCountByTaxonAndChildrenView(APIView):
 			raise CBBAPIException("Missing taxonomy id parameter", 400)
 
 		try:
-			taxon_parent = TaxonomicLevel.objects.get(id=taxonomy)
+			taxon_parent = TaxonomicLevel.objects.lean().get(id=taxonomy)
 			if taxon_parent.rank >= 6:
 				raise CBBAPIException(
 					f"{TaxonomicLevel.TRANSLATE_RANK[taxon_parent.rank].upper()} is not valid for children stats, try genus or greater taxonomic levels",
@@ -538,10 +725,21 @@ class OccurrenceCountByTaxonAndChildrenView(APIView):
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
+		return JsonResponse(
+			batch_cached(
+				"occurrence_children_stats",
+				{"taxonomy": taxonomy, "in_geography_scope": in_geography_scope},
+				lambda: self.get_children_counts(taxon_parent, in_geography_scope),
+			),
+			safe=False,
+		)
+
+	@staticmethod
+	def get_children_counts(taxon_parent, in_geography_scope):
 		childrens = taxon_parent.get_children()
 		descendants = taxon_parent.get_descendants(include_self=False)
 
-		filtered_occurrences_for_annotation = Occurrence.objects.filter(taxonomy__in=descendants)
+		filtered_occurrences_for_annotation = Occurrence.objects.distinct_records().filter(taxonomy__in=descendants)
 
 		if in_geography_scope:
 			filtered_occurrences_for_annotation = filtered_occurrences_for_annotation.filter(
@@ -564,7 +762,7 @@ class OccurrenceCountByTaxonAndChildrenView(APIView):
 			)
 			response.append(ancestor)
 
-		return JsonResponse(response, safe=False)
+		return response
 
 	@staticmethod
 	def check_ancestors(children_id, parents_list, count):
@@ -642,11 +840,11 @@ class OccurrenceCountByTaxonAndChildrenView(APIView):
 class OccurrenceCountByTaxonDateBaseView:
 	def get_occurrences_by_taxonomy(self, taxonomy):
 		try:
-			taxonomy = TaxonomicLevel.objects.get(id=taxonomy).get_descendants(include_self=True)
+			taxonomy = TaxonomicLevel.objects.lean().get(id=taxonomy).get_descendants(include_self=True)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
-		return Occurrence.objects.filter(taxonomy__in=taxonomy, in_geography_scope=True)
+		return Occurrence.objects.distinct_records().filter(taxonomy__in=taxonomy, in_geography_scope=True)
 
 	def get_occurrence_counts_by_month(self, occurrences):
 		annotated_counts = (
@@ -702,15 +900,19 @@ class OccurrenceCountByTaxonDateBaseView:
 		if not taxonomy:
 			raise CBBAPIException("Missing taxonomy id parameter", 400)
 
-		occurrences = self.get_occurrences_by_taxonomy(taxonomy)
-
 		if date_key == "collection_date_month":
-			result = self.get_occurrence_counts_by_month(occurrences)
+			get_counts = self.get_occurrence_counts_by_month
 		elif date_key == "collection_date_year":
-			result = self.get_occurrence_counts_by_year(occurrences)
+			get_counts = self.get_occurrence_counts_by_year
 		else:
 			raise CBBAPIException("Invalid date_key", 400)
 
+		result = batch_cached(
+			f"occurrence_{date_key}_stats",
+			{"taxonomy": taxonomy},
+			lambda: get_counts(self.get_occurrences_by_taxonomy(taxonomy)),
+		)
+
 		return Response(OccurrenceCountByDateSerializer(result, many=True, view_class=view_class).data)
 
 
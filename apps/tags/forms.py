@@ -1,8 +1,10 @@
 import re
 
 from django import forms
+from django.db.models import Q
+
 from common.utils.forms import TranslateForm, CamelCaseForm
-from .models import IUCNData
+from .models import IUCNData, Tag, TaxonTraits
 from ..API.exceptions import CBBAPIException
 
 
@@ -44,3 +46,69 @@ class SystemForm(CamelCaseForm):
 	freshwater = forms.BooleanField(required=False)
 	marine = forms.BooleanField(required=False)
 	terrestrial = forms.BooleanField(required=False)
+
+
+class TaxonProfileForm(CamelCaseForm):
+	MAX_TAXA = 50
+
+	taxonomy = forms.CharField(required=False)
+
+	def clean_taxonomy(self):
+		value = self.cleaned_data.get("taxonomy")
+		if not value:
+			return []
+
+		try:
+			taxa = list(dict.fromkeys(int(taxon) for taxon in value.split(",") if taxon.strip()))
+		except ValueError:
+			raise forms.ValidationError("Enter a comma separated list of taxon ids.")
+
+		if len(taxa) > self.MAX_TAXA:
+			raise forms.ValidationError(f"Ensure at most {self.MAX_TAXA} taxa are requested.")
+
+		return taxa
+
+
+# Forms of the query parameters applied by get_trait_filters
+TRAIT_FORMS = [IUCNDataForm, DirectiveForm, SystemForm, TaxonTagForm]
+
+
+def get_trait_filters(data, prefix=""):
+	"""
+	Build the IUCN, directive, system and tag filters of a request as a predicate on the taxon traits table.
+
+	:param data: Query parameters of the request
+	:param prefix: Lookup path from the filtered model to its taxon, e.g. `taxonomy__` for occurrences
+	:return: A Q object, empty if no trait filter is given
+	"""
+	filters = {}
+
+	iucn_form = IUCNDataForm(data=data)
+	if not iucn_form.is_valid():
+		raise CBBAPIException(iucn_form.errors, 400)
+	region = iucn_form.cleaned_data.get("region")
+	if region != "":
+		filters[f"{prefix}traits__{TaxonTraits.IUCN_FIELDS[int(region)]}"] = int(iucn_form.cleaned_data["assessment"])
+
+	directive_form = DirectiveForm(data=data)
+	if not directive_form.is_valid():
+		raise CBBAPIException(directive_form.errors, 400)
+	for key, value in directive_form.cleaned_data.items():
+		if value:
+			filters[f"{prefix}traits__{key}"] = value
+
+	system_form = SystemForm(data=data)
+	if not system_form.is_valid():
+		raise CBBAPIException(system_form.errors, 400)
+	for key, value in system_form.cleaned_data.items():
+		if value:
+			filters[f"{prefix}traits__{key}"] = value
+
+	tag_form = TaxonTagForm(data=data)
+	if not tag_form.is_valid():
+		raise CBBAPIException(tag_form.errors, 400)
+	tag = tag_form.cleaned_data.get("tag")
+	if tag:
+		filters[f"{prefix}traits__doe_tag__in"] = Tag.objects.filter(name__iexact=tag).values("id")
+
+	return Q(**filters)
@@ -6,9 +6,17 @@ import re
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from apps.taxonomy.models import TaxonomicLevel
-from apps.tags.models import Habitat, IUCNData, System, HabitatTaxonomy
-from apps.versioning.models import Batch, OriginId, Source, Basis
-from common.utils.utils import get_or_create_source, is_batch_referenced
+from apps.taxonomy.utils import TaxonResolver
+from apps.tags.models import Habitat, HabitatRollup, IUCNData, System, HabitatTaxonomy, TaxonTraits
+from apps.versioning.models import Batch, Source, Basis
+from common.utils.utils import (
+	delete_orphan_origin_ids,
+	get_or_create_origin_ids,
+	get_or_create_source,
+	is_batch_referenced,
+	refresh_source_counters,
+	upsert_with_sources,
+)
 from tqdm import tqdm
 
 
@@ -19,17 +27,15 @@ IUCN_FIELDS = ["iucn_global", "iucn_europe", "iucn_mediterranean"]
 iucn_regex = re.compile(r"^[A-Z]{2}/[a-z]{2}$")
 
 
-def check_taxon(line):
-	taxonomy = TaxonomicLevel.objects.find(taxon=line["origin_taxon"]).filter(
-		rank=TaxonomicLevel.TRANSLATE_RANK[line["taxon_rank"]]
-	)
+def check_taxon(line, resolver):
+	taxonomy = resolver.find(line["origin_taxon"], TaxonomicLevel.TRANSLATE_RANK[line["taxon_rank"]])
 
-	if taxonomy.count() == 0:
+	if len(taxonomy) == 0:
 		raise Exception(f"Taxonomy not found.\n{line}")
-	elif taxonomy.count() > 1:
+	elif len(taxonomy) > 1:
 		raise Exception(f"Multiple taxonomy found.\n{line}\n{taxonomy}")
 
-	return taxonomy.first()
+	return taxonomy[0]
 
 
 def transform_iucn_status(iucn_scope):
@@ -44,19 +50,12 @@ def transform_iucn_status(iucn_scope):
 
 
 # Important: This is valid only for IUCN json files.
-def load_taxon_data_from_json(line, taxonomy, batch):
-	taxon_id = line.get(EXTERNAL_ID)
-
-	if taxon_id is None:
-		return
-
-	source = get_or_create_source(
-		source_type=Basis.DATABASE,
-		extraction_method=Source.API,
-		data_type=Source.TAXON_DATA,
-		batch=batch,
-		internal_name=INTERNAL_NAME,
-	)
+def read_taxon_data(line, taxonomy_id, habitats, data):
+	"""
+	Add the assessments, system and habitats of a line to `data`, keyed as in the tables they are upserted to.
+	"""
+	# External ids are stored as strings, while the JSON may hold numbers
+	taxon_id = str(line[EXTERNAL_ID])
 
 	# Assessment
 	for field in IUCN_FIELDS:
@@ -82,64 +81,22 @@ def load_taxon_data_from_json(line, taxonomy, batch):
 
 		assessment = IUCNData.TRANSLATE_CS.get(status.lower(), IUCNData.NE)
 
-		iucn_data, is_iucn_new = IUCNData.objects.update_or_create(
-			taxonomy=taxonomy,
-			region=region,
-			defaults={
-				"assessment": assessment,
-				"batch": batch,
-			},
-		)
-
-		origin, _ = OriginId.objects.get_or_create(external_id=f"{taxon_id}/{url_id}", source=source)
-		if not is_iucn_new:
-			sources = list(iucn_data.sources.all())
-			for s in sources:
-				if s.iucndata_set.count() == 0:
-					s.delete()
-			iucn_data.sources.clear()
-		iucn_data.sources.add(origin)
+		data[IUCNData][taxonomy_id, region] = ({"assessment": assessment}, f"{taxon_id}/{url_id}")
 
 	# System
-	system, is_system_new = System.objects.update_or_create(
-		taxonomy=taxonomy,
-		defaults={
-			"freshwater": line["freshwater"],
-			"marine": line["marine"],
-			"terrestrial": line["terrestrial"],
-			"batch": batch,
-		},
+	data[System][(taxonomy_id,)] = (
+		{"freshwater": line["freshwater"], "marine": line["marine"], "terrestrial": line["terrestrial"]},
+		taxon_id,
 	)
 
-	origin, _ = OriginId.objects.get_or_create(source=source, external_id=taxon_id)
-	if not is_system_new:
-		sources = list(system.sources.all())
-		for s in sources:
-			if s.system_set.count() == 0:
-				s.delete()
-		system.sources.clear()
-	system.sources.add(origin)
-
 	# Habitats
-	habitat_ids = set(line["habitat"] or [])
-	valid_habitats = Habitat.objects.filter(sources__external_id__in=habitat_ids)
-
-	if len(valid_habitats) != len(habitat_ids):
-		invalid_ids = habitat_ids - set(valid_habitats.values_list("sources__external_id", flat=True))
+	habitat_ids = set(str(habitat_id) for habitat_id in line["habitat"] or [])
+	invalid_ids = habitat_ids - habitats.keys()
+	if invalid_ids:
 		raise Exception(f"Invalid habitat IDs: {invalid_ids}")
 
-	for single_habitat_object in valid_habitats:
-		habitat_taxonomy, is_ht_new = HabitatTaxonomy.objects.update_or_create(
-			taxonomy=taxonomy, habitat=single_habitat_object, defaults={"batch": batch}
-		)
-
-		if not is_ht_new:
-			sources = list(habitat_taxonomy.sources.all())
-			for s in sources:
-				if s.system_set.count() == 0:
-					s.delete()
-			habitat_taxonomy.sources.clear()
-		habitat_taxonomy.sources.add(origin)
+	for habitat_id in habitat_ids:
+		data[HabitatTaxonomy][taxonomy_id, habitats[habitat_id]] = ({}, taxon_id)
 
 
 class Command(BaseCommand):
@@ -153,14 +110,33 @@ class Command(BaseCommand):
 
 		exception = False
 		batch = Batch.objects.create()
+		source = get_or_create_source(
+			source_type=Basis.DATABASE,
+			extraction_method=Source.API,
+			data_type=Source.TAXON_DATA,
+			batch=batch,
+			internal_name=INTERNAL_NAME,
+		)
+
+		# Taxa and habitats are resolved up front, the lines only fill the rows to upsert
+		resolver = TaxonResolver()
+		habitats = {
+			str(external_id): habitat_id
+			for external_id, habitat_id in Habitat.objects.lean().values_list("sources__external_id", "id")
+			if external_id is not None
+		}
+		data = {IUCNData: {}, System: {}, HabitatTaxonomy: {}}
 
 		with open(file_name, "r") as json_file:
 			json_data = json.load(json_file)
 
 			for line in tqdm(json_data, ncols=50, colour="yellow", smoothing=0, miniters=100, delay=20):
+				if line.get(EXTERNAL_ID) is None:
+					continue
+
 				try:
-					taxonomy = check_taxon(line)
-					load_taxon_data_from_json(line, taxonomy, batch)
+					taxonomy_id = check_taxon(line, resolver)
+					read_taxon_data(line, taxonomy_id, habitats, data)
 				except:
 					exception = True
 					print(traceback.format_exc(), line)
@@ -168,4 +144,22 @@ class Command(BaseCommand):
 		if exception:
 			raise Exception(f"Errors found: Rollback control")
 
+		origin_ids = get_or_create_origin_ids(
+			source, [external_id for rows in data.values() for _, external_id in rows.values()]
+		)
+
+		unlinked = set()
+		for model, unique_fields in [
+			(IUCNData, ["taxonomy", "region"]),
+			(System, ["taxonomy"]),
+			(HabitatTaxonomy, ["taxonomy", "habitat"]),
+		]:
+			rows = {key: (fields, origin_ids[external_id]) for key, (fields, external_id) in data[model].items()}
+			unlinked |= upsert_with_sources(model, rows, unique_fields, batch)
+
+		delete_orphan_origin_ids(unlinked)
+
+		TaxonTraits.refresh()
+		HabitatRollup.refresh()
+		refresh_source_counters([INTERNAL_NAME])
 		is_batch_referenced(batch)
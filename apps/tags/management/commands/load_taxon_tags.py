@@ -4,9 +4,16 @@ from openpyxl import load_workbook
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from apps.taxonomy.models import TaxonomicLevel
-from apps.tags.models import Tag, TaxonTag, System, Directive
+from apps.tags.models import Tag, TaxonTag, System, Directive, TaxonTraits
 from apps.versioning.models import Batch, OriginId, Source
-from common.utils.utils import get_or_create_source, is_batch_referenced
+from apps.taxonomy.utils import TaxonResolver
+from common.utils.utils import (
+	delete_orphan_origin_ids,
+	get_or_create_source,
+	is_batch_referenced,
+	refresh_source_counters,
+	upsert_with_sources,
+)
 from tqdm import tqdm
 
 EXTERNAL_ID = "origin_id"
@@ -15,17 +22,15 @@ SOURCE_TYPE = "origin"
 SOURCE_METHOD = "extraction_method"
 
 
-def check_taxon(line):
-	taxonomy = TaxonomicLevel.objects.find(taxon=line["origin_taxon"]).filter(
-		rank=TaxonomicLevel.TRANSLATE_RANK[line["taxon_rank"]]
-	)
+def check_taxon(line, resolver):
+	taxonomy = resolver.find(line["origin_taxon"], TaxonomicLevel.TRANSLATE_RANK[line["taxon_rank"]])
 
-	if taxonomy.count() == 0:
+	if len(taxonomy) == 0:
 		raise Exception(f"Taxonomy not found.")
-	elif taxonomy.count() > 1:
+	elif len(taxonomy) > 1:
 		raise Exception(f"Multiple taxonomy found.")
 
-	return taxonomy.first()
+	return taxonomy[0]
 
 
 def parse_bool(value, return_none=False):
@@ -45,64 +50,95 @@ def parse_bool(value, return_none=False):
 			raise Exception(f"Invalid boolean value: {value}")
 
 
-def load_taxon_tags(line, taxonomy, batch):
-	if line["taxon_rank"] not in ["species", "subspecies", "variety"]:
-		raise Exception(f"Taxon rank not allowed.")
-
-	source = get_or_create_source(
-		source_type=line[SOURCE_TYPE].lower(),
-		extraction_method=Source.EXPERT,
-		data_type=Source.TAXON_DATA,
-		batch=batch,
-		internal_name=line[INTERNAL_NAME],
-	)
-
-	# try:
-	system, _ = System.objects.get_or_create(taxonomy=taxonomy, defaults={"batch": batch})
-	# except System.DoesNotExist:
-	# 	raise Exception(f"Priority check: Taxon systems not found. Taxon data (iucn) not loaded yet? Otherwise iucn will overwrite expert data")
-
-	os, _ = OriginId.objects.get_or_create(source=source, defaults={"attribution": line.get("attribution")})
-
-	# if the 3 systems are None, it means IUCN has no available data
-	if system.freshwater is None and system.marine is None and system.terrestrial is None:
-		system.freshwater = parse_bool(line["freshwater"])
-		system.marine = parse_bool(line["marine"])
-		system.terrestrial = parse_bool(line["terrestrial"])
-		system.sources.clear()
-		system.sources.add(os)
-		system.save()
-
-	doe_value = line.get("degreeOfEstablishment")
-	try:
-		doe_tag = Tag.objects.get(name__iexact=doe_value, tag_type=Tag.DOE)
-		taxon_tag, _ = TaxonTag.objects.update_or_create(
-			taxonomy=taxonomy,
-			defaults={
-				"batch": batch,
-				"tag": doe_tag,
+class TaxonTagsLoader:
+	"""
+	Collects the tags, directives and systems of the rows of the sheet, then writes them and their source links in
+	bulk. Sources, origin ids and tags are looked up once each.
+	"""
+
+	def __init__(self, batch):
+		self.batch = batch
+		self.origin_ids = {}
+		self.tags = {tag.name.lower(): tag for tag in Tag.objects.filter(tag_type=Tag.DOE)}
+		self.taxon_tags = {}
+		self.directives = {}
+		self.systems = {}
+
+	def get_origin_id(self, line):
+		key = (line[SOURCE_TYPE].lower(), line[INTERNAL_NAME])
+		if key not in self.origin_ids:
+			source = get_or_create_source(
+				source_type=line[SOURCE_TYPE].lower(),
+				extraction_method=Source.EXPERT,
+				data_type=Source.TAXON_DATA,
+				batch=self.batch,
+				internal_name=line[INTERNAL_NAME],
+			)
+			os, _ = OriginId.objects.get_or_create(source=source, defaults={"attribution": line.get("attribution")})
+			self.origin_ids[key] = os.id
+
+		return self.origin_ids[key]
+
+	def read(self, line, taxonomy_id):
+		if line["taxon_rank"] not in ["species", "subspecies", "variety"]:
+			raise Exception(f"Taxon rank not allowed.")
+
+		origin_id = self.get_origin_id(line)
+
+		doe_value = line.get("degreeOfEstablishment")
+		doe_tag = self.tags.get(str(doe_value).lower()) if doe_value is not None else None
+		if doe_tag is None:
+			raise Exception(f"No Tag.DOE was found with the value '{doe_value}'")
+
+		self.taxon_tags[(taxonomy_id,)] = ({"tag": doe_tag}, origin_id)
+		self.directives[(taxonomy_id,)] = (
+			{
+				"cites": parse_bool(line["cites"], True),
+				"ceea": parse_bool(line["ceea"], True),
+				"lespre": parse_bool(line["lespre"], True),
+				"directiva_aves": parse_bool(line["directiva_aves"], True),
+				"directiva_habitats": parse_bool(line["directiva_habitats"], True),
 			},
+			origin_id,
 		)
-		taxon_tag.sources.clear()
-		taxon_tag.sources.add(os)
-		taxon_tag.save()
-	except Tag.DoesNotExist:
-		raise Exception(f"No Tag.DOE was found with the value '{doe_value}'")
-
-	directive, _ = Directive.objects.update_or_create(
-		taxonomy=taxonomy,
-		defaults={
-			"cites": parse_bool(line["cites"], True),
-			"ceea": parse_bool(line["ceea"], True),
-			"lespre": parse_bool(line["lespre"], True),
-			"directiva_aves": parse_bool(line["directiva_aves"], True),
-			"directiva_habitats": parse_bool(line["directiva_habitats"], True),
-			"batch": batch,
-		},
-	)
-	directive.sources.clear()
-	directive.sources.add(os)
-	directive.save()
+		# The first row of a taxon sets its system, its values are only parsed if the system has to be written
+		self.systems.setdefault(
+			taxonomy_id, ((line["freshwater"], line["marine"], line["terrestrial"]), origin_id, line)
+		)
+
+	def get_system_rows(self):
+		# Systems with any value come from IUCN data, which has priority over the expert data
+		filled = set(
+			System.objects.lean()
+			.filter(taxonomy_id__in=self.systems)
+			.exclude(freshwater=None, marine=None, terrestrial=None)
+			.values_list("taxonomy_id", flat=True)
+		)
+
+		rows = {}
+		for taxonomy_id, ((freshwater, marine, terrestrial), origin_id, line) in self.systems.items():
+			if taxonomy_id in filled:
+				continue
+
+			try:
+				fields = {
+					"freshwater": parse_bool(freshwater),
+					"marine": parse_bool(marine),
+					"terrestrial": parse_bool(terrestrial),
+				}
+			except Exception as e:
+				raise Exception(f"{e}\n{line}")
+
+			rows[(taxonomy_id,)] = (fields, origin_id)
+
+		return rows
+
+	def write(self):
+		unlinked = upsert_with_sources(System, self.get_system_rows(), ["taxonomy"], self.batch)
+		unlinked |= upsert_with_sources(TaxonTag, self.taxon_tags, ["taxonomy"], self.batch)
+		unlinked |= upsert_with_sources(Directive, self.directives, ["taxonomy"], self.batch)
+
+		delete_orphan_origin_ids(unlinked - set(self.origin_ids.values()))
 
 
 class Command(BaseCommand):
@@ -115,28 +151,26 @@ class Command(BaseCommand):
 		file_name = options["file"]
 		exception = False
 		batch = Batch.objects.create()
+		resolver = TaxonResolver()
+		loader = TaxonTagsLoader(batch)
 
 		try:
-			reader = load_workbook(file_name)
-			sheet = reader.active
-			headers = [cell.value for cell in next(sheet.iter_rows(min_row=1, max_row=1))]
-			for row in tqdm(
-				list(sheet.iter_rows(min_row=2, values_only=True)),
-				ncols=50,
-				colour="yellow",
-				smoothing=0,
-				miniters=100,
-				delay=20,
-			):
-				line = dict(zip(headers, row))
-				if line["origin_taxon"] is None:
-					continue
-				try:
-					taxonomy = check_taxon(line)
-					load_taxon_tags(line, taxonomy, batch)
-				except:
-					exception = True
-					print(traceback.format_exc(), line)
+			# Rows are streamed from the sheet, only the values to write are kept in memory
+			reader = load_workbook(file_name, read_only=True)
+			try:
+				rows = reader.active.iter_rows(values_only=True)
+				headers = next(rows)
+				for row in tqdm(rows, ncols=50, colour="yellow", smoothing=0, miniters=100, delay=20):
+					line = dict(zip(headers, row))
+					if line["origin_taxon"] is None:
+						continue
+					try:
+						loader.read(line, check_taxon(line, resolver))
+					except:
+						exception = True
+						print(traceback.format_exc(), line)
+			finally:
+				reader.close()
 		except FileNotFoundError:
 			exception = True
 			print("No such file or directory")
@@ -144,4 +178,8 @@ class Command(BaseCommand):
 		if exception:
 			raise Exception(f"Errors found: Rollback control")
 
+		loader.write()
+
+		TaxonTraits.refresh()
+		refresh_source_counters(internal_name for _, internal_name in loader.origin_ids)
 		is_batch_referenced(batch)
@@ -1,11 +1,11 @@
 import csv
 
 from apps.taxonomy.models import TaxonomicLevel
-from apps.tags.models import Directive
+from apps.tags.models import Directive, TaxonTraits
 from apps.versioning.models import Batch, OriginId, Source, Basis
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from common.utils.utils import get_or_create_source, is_batch_referenced
+from common.utils.utils import get_or_create_source, is_batch_referenced, refresh_source_counters
 
 BOOL_DICT = {"verdadero": True, "falso": False}
 
@@ -22,11 +22,14 @@ class Command(BaseCommand):
 		csv_file_name = options["csv_file"]
 		batch = Batch.objects.create()
 
+		internal_names = set()
+
 		with open(csv_file_name, "r") as csv_file:
 			reader = csv.DictReader(csv_file)
 
 			for line in reader:
 				taxonomy = TaxonomicLevel.objects.find(taxon=line["origin_taxon"]).first()
+				internal_names.add(line["source"])
 
 				source = get_or_create_source(
 					source_type=Basis.DATABASE,
@@ -51,6 +54,8 @@ class Command(BaseCommand):
 				)
 				directive.sources.add(os)
 
+		TaxonTraits.refresh()
+		refresh_source_counters(internal_names)
 		is_batch_referenced(batch)
 
 		self.stdout.write(self.style.SUCCESS("Successfully created directives"))
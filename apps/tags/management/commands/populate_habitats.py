@@ -3,7 +3,7 @@ from django.db import transaction
 
 from apps.tags.models import Habitat
 from apps.versioning.models import Batch, OriginId, Source, Basis
-from common.utils.utils import get_or_create_source, is_batch_referenced
+from common.utils.utils import get_or_create_source, is_batch_referenced, refresh_source_counters
 
 HABITATS = [
 	("forest", 1),
@@ -58,4 +58,5 @@ class Command(BaseCommand):
 	def handle(self, *args, **kwargs):
 		batch = Batch.objects.create()
 		self.populate_habitat(batch)
+		refresh_source_counters(["IUCN"])
 		is_batch_referenced(batch)
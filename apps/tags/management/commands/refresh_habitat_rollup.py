@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.tags.models import HabitatRollup
+from common.utils.cache import bump_data_version
+
+
+class Command(BaseCommand):
+	help = "Rebuilds the habitats of every taxon including the ones of its descendants"
+
+	def handle(self, *args, **options):
+		total = HabitatRollup.refresh()
+		bump_data_version("refresh_habitat_rollup")
+		self.stdout.write(self.style.SUCCESS(f"{total} taxon habitats refreshed"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.tags.models import TaxonTraits
+from common.utils.cache import bump_data_version
+
+
+class Command(BaseCommand):
+	help = "Rebuilds the taxon traits table from the IUCN, directive, system and tag tables"
+
+	def handle(self, *args, **options):
+		total = TaxonTraits.refresh()
+		bump_data_version("refresh_taxon_traits")
+		self.stdout.write(self.style.SUCCESS(f"Traits of {total} taxa refreshed"))
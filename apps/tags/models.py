@@ -1,4 +1,6 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, transaction
 from apps.taxonomy.models import TaxonomicLevel
 from common.utils.models import ReferencedModel
 
@@ -148,6 +150,48 @@ class HabitatTaxonomy(ReferencedModel):
 		unique_together = ["taxonomy", "habitat"]
 
 
+class HabitatRollup(models.Model):
+	"""
+	Habitats of every taxon including the ones of its descendants, with the number of taxa of the subtree found in
+	each habitat. Rebuilt from HabitatTaxonomy by the taxon data loader with `refresh()`.
+	"""
+
+	taxonomy = models.ForeignKey(TaxonomicLevel, on_delete=models.CASCADE, db_index=True)
+	habitat = models.ForeignKey(Habitat, on_delete=models.CASCADE)
+	count = models.PositiveIntegerField(default=0)
+
+	def __str__(self):
+		return f"{self.taxonomy} - habitat: {self.habitat} ({self.count})"
+
+	class Meta:
+		unique_together = ["taxonomy", "habitat"]
+
+	@staticmethod
+	@transaction.atomic
+	def refresh():
+		"""
+		Rebuild every row with two queries, the habitats of each taxon are added to all its ancestors in memory.
+		"""
+		parents = dict(TaxonomicLevel.objects.lean().order_by().values_list("id", "parent_id"))
+		counts = Counter()
+
+		for taxonomy_id, habitat_id in HabitatTaxonomy.objects.lean().values_list("taxonomy_id", "habitat_id"):
+			while taxonomy_id:
+				counts[taxonomy_id, habitat_id] += 1
+				taxonomy_id = parents.get(taxonomy_id)
+
+		HabitatRollup.objects.all().delete()
+		HabitatRollup.objects.bulk_create(
+			[
+				HabitatRollup(taxonomy_id=taxonomy_id, habitat_id=habitat_id, count=count)
+				for (taxonomy_id, habitat_id), count in counts.items()
+			],
+			batch_size=5000,
+		)
+
+		return len(counts)
+
+
 class Directive(ReferencedModel):
 	taxonomy = models.ForeignKey(TaxonomicLevel, on_delete=models.CASCADE, db_index=True)
 	cites = models.BooleanField(default=None, null=True)
@@ -161,3 +205,77 @@ class Directive(ReferencedModel):
 
 	class Meta:
 		unique_together = ["taxonomy"]
+
+
+class TaxonTraits(models.Model):
+	"""
+	IUCN assessments, directives, system and degree of establishment of a taxon flattened into a single row, so any
+	combination of these filters is a predicate on one table. Refreshed by the tag loaders with `refresh()`.
+	"""
+
+	IUCN_FIELDS = {
+		IUCNData.GLOBAL: "iucn_global",
+		IUCNData.EUROPE: "iucn_europe",
+		IUCNData.MEDITERRANEAN: "iucn_mediterranean",
+	}
+	DIRECTIVE_FIELDS = ["cites", "ceea", "lespre", "directiva_aves", "directiva_habitats"]
+	SYSTEM_FIELDS = ["freshwater", "marine", "terrestrial"]
+
+	taxonomy = models.OneToOneField(TaxonomicLevel, on_delete=models.CASCADE, primary_key=True, related_name="traits")
+	iucn_global = models.PositiveSmallIntegerField(choices=IUCNData.CS_CHOICES, null=True, default=None)
+	iucn_europe = models.PositiveSmallIntegerField(choices=IUCNData.CS_CHOICES, null=True, default=None)
+	iucn_mediterranean = models.PositiveSmallIntegerField(choices=IUCNData.CS_CHOICES, null=True, default=None)
+	cites = models.BooleanField(default=None, null=True)
+	ceea = models.BooleanField(default=None, null=True)
+	lespre = models.BooleanField(default=None, null=True)
+	directiva_aves = models.BooleanField(default=None, null=True)
+	directiva_habitats = models.BooleanField(default=None, null=True)
+	freshwater = models.BooleanField(default=None, null=True)
+	marine = models.BooleanField(default=None, null=True)
+	terrestrial = models.BooleanField(default=None, null=True)
+	doe_tag = models.ForeignKey(Tag, on_delete=models.SET_NULL, null=True, default=None)
+
+	def __str__(self):
+		return f"{self.taxonomy} traits"
+
+	class Meta:
+		verbose_name_plural = "Taxon traits"
+
+	@staticmethod
+	@transaction.atomic
+	def refresh():
+		"""
+		Rebuild every row from the IUCN, directive, system and tag tables, with one query per table.
+		"""
+		traits = {}
+
+		def get_traits(taxonomy_id):
+			if taxonomy_id not in traits:
+				traits[taxonomy_id] = TaxonTraits(taxonomy_id=taxonomy_id)
+
+			return traits[taxonomy_id]
+
+		for taxonomy_id, region, assessment in IUCNData.objects.lean().values_list(
+			"taxonomy_id", "region", "assessment"
+		):
+			setattr(get_traits(taxonomy_id), TaxonTraits.IUCN_FIELDS[region], assessment)
+
+		for directive in Directive.objects.lean().values("taxonomy_id", *TaxonTraits.DIRECTIVE_FIELDS):
+			trait = get_traits(directive.pop("taxonomy_id"))
+			for field, value in directive.items():
+				setattr(trait, field, value)
+
+		for system in System.objects.lean().values("taxonomy_id", *TaxonTraits.SYSTEM_FIELDS):
+			trait = get_traits(system.pop("taxonomy_id"))
+			for field, value in system.items():
+				setattr(trait, field, value)
+
+		for taxonomy_id, tag_id in (
+			TaxonTag.objects.lean().filter(tag__tag_type=Tag.DOE).values_list("taxonomy_id", "tag_id")
+		):
+			get_traits(taxonomy_id).doe_tag_id = tag_id
+
+		TaxonTraits.objects.all().delete()
+		TaxonTraits.objects.bulk_create(traits.values(), batch_size=5000)
+
+		return len(traits)
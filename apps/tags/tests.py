@@ -0,0 +1,89 @@
+import json
+import tempfile
+
+from django.core.management import call_command
+from openpyxl import Workbook
+
+from apps.tags.models import Directive, Habitat, HabitatRollup, HabitatTaxonomy, IUCNData, System, TaxonTag, TaxonTraits
+from apps.taxonomy.models import TaxonomicLevel
+from common.utils.tests import TestResultHandler
+
+
+class TagsTest(TestResultHandler):
+	def get_species_name(self, taxon_id):
+		taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
+		genus = TaxonomicLevel.objects.lean().get(id=taxon.parent_id)
+
+		return taxon, f"{genus.name} {taxon.name}"
+
+	def test_load_taxon_data(self):
+		taxon, name = self.get_species_name(14)
+		line = {
+			"origin_id": 900001,
+			"origin_taxon": name,
+			"taxon_rank": "species",
+			"iucn_global": {"status": "EN", "url": "https://www.iucnredlist.org/species/900001/1"},
+			"iucn_europe": None,
+			"iucn_mediterranean": None,
+			"habitat": [5],
+			"freshwater": True,
+			"marine": False,
+			"terrestrial": True,
+		}
+		with tempfile.NamedTemporaryFile("w", suffix=".json") as data_file:
+			json.dump([line], data_file)
+			data_file.flush()
+			call_command("load_taxon_data", data_file.name)
+
+		iucn = IUCNData.objects.get(taxonomy=taxon, region=IUCNData.GLOBAL)
+		self.assert_and_log(self.assertEqual, iucn.assessment, IUCNData.EN)
+		self.assert_and_log(self.assertEqual, list(iucn.sources.values_list("external_id", flat=True)), ["900001/1"])
+
+		system = System.objects.get(taxonomy=taxon)
+		self.assert_and_log(
+			self.assertEqual, (system.freshwater, system.marine, system.terrestrial), (True, False, True)
+		)
+		self.assert_and_log(self.assertEqual, list(system.sources.values_list("external_id", flat=True)), ["900001"])
+
+		habitat = Habitat.objects.get(name="wetlands (inland)")
+		self.assert_and_log(self.assertTrue, HabitatTaxonomy.objects.filter(taxonomy=taxon, habitat=habitat).exists())
+		self.assert_and_log(
+			self.assertTrue, HabitatRollup.objects.filter(taxonomy_id=taxon.parent_id, habitat=habitat).exists()
+		)
+
+		traits = TaxonTraits.objects.get(taxonomy=taxon)
+		self.assert_and_log(self.assertEqual, (traits.iucn_global, traits.freshwater), (IUCNData.EN, True))
+
+	def test_load_taxon_tags(self):
+		taxon, name = self.get_species_name(14)
+		workbook = Workbook()
+		workbook.active.append(
+			["origin_taxon", "taxon_rank", "origin", "source", "degreeOfEstablishment"]
+			+ ["cites", "ceea", "lespre", "directiva_aves", "directiva_habitats", "freshwater", "marine", "terrestrial"]
+		)
+		workbook.active.append([name, "species", "expert", "Tags test", "endemic"] + ["true", "false"] * 4)
+
+		with tempfile.NamedTemporaryFile(suffix=".xlsx") as data_file:
+			workbook.save(data_file.name)
+			call_command("load_taxon_tags", data_file.name)
+
+		taxon_tag = TaxonTag.objects.get(taxonomy=taxon)
+		self.assert_and_log(self.assertEqual, taxon_tag.tag.name, "endemic")
+		self.assert_and_log(
+			self.assertEqual,
+			list(taxon_tag.sources.values_list("source__basis__internal_name", flat=True)),
+			["Tags test"],
+		)
+
+		directive = Directive.objects.get(taxonomy=taxon)
+		self.assert_and_log(
+			self.assertEqual,
+			[getattr(directive, field) for field in TaxonTraits.DIRECTIVE_FIELDS],
+			[True, False, True, False, True],
+		)
+		self.assert_and_log(
+			self.assertEqual,
+			list(directive.sources.values_list("source__basis__internal_name", flat=True)),
+			["Tags test"],
+		)
+		self.assert_and_log(self.assertEqual, TaxonTraits.objects.get(taxonomy=taxon).doe_tag_id, taxon_tag.tag_id)
@@ -9,6 +9,8 @@ from apps.tags.views import (
 	# TagListView,
 	# TaxonDataInvasiveView
 	SystemListView,
+	TaxonProfileView,
+	TaxonTagStatsView,
 	TaxonTagListView,
 )
 
@@ -19,6 +21,8 @@ urlpatterns = [
 	path("/habitats", HabitatsListView.as_view(), name="habitats_List"),
 	path("/iucn", IUCNDataListView.as_view(), name="iucn_list"),
 	path("/system", SystemListView.as_view(), name="system_list"),
+	path("/profile", TaxonProfileView.as_view(), name="taxon_profile"),
+	path("/stats", TaxonTagStatsView.as_view(), name="taxon_tag_stats"),
 	# path("/taxon/tags/list", IUCNDataListView.as_view(), name="data_list"),
 	# path("/taxon/data/list/count", IUCNDataCountView.as_view(), name="data_count"),
 	# path("/data/list", IUCNDataListView.as_view(), name="data_list"),
@@ -1,10 +1,24 @@
+from django.db.models import Count, Prefetch, Q
 from apps.tags.serializers import SystemSerializer
 from drf_yasg import openapi
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from apps.API.exceptions import CBBAPIException
-from apps.tags.models import Directive, Habitat, IUCNData, System, TaxonomicLevel, TaxonTag
+from apps.tags.forms import TaxonProfileForm
+from apps.tags.models import (
+	Directive,
+	Habitat,
+	HabitatRollup,
+	IUCNData,
+	System,
+	Tag,
+	TaxonomicLevel,
+	TaxonTag,
+	TaxonTraits,
+)
 from apps.tags.serializers import HabitatSerializer, IUCNDataSerializer, TaxonTagSerializer, DirectiveSerializer
+from apps.versioning.models import OriginId
+from common.utils.cache import batch_cached
 from common.utils.forms import TaxonomyForm
 
 from common.utils.custom_swag_schema import custom_swag_schema
@@ -79,14 +93,15 @@ class HabitatsListView(APIView):
 		if taxonomy is None:
 			raise CBBAPIException("Missing taxonomy id parameter", 400)
 
-		try:
-			taxon_parent = TaxonomicLevel.objects.get(id=taxonomy)
-		except TaxonomicLevel.DoesNotExist:
+		if not TaxonomicLevel.objects.filter(id=taxonomy).exists():
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
-		descendants = taxon_parent.get_descendants(include_self=True)
-
-		filtered_habitats_queryset = Habitat.objects.filter(habitattaxonomy__taxonomy_id__in=descendants).distinct()
+		# The rollup already holds the habitats of the descendants of every taxon
+		filtered_habitats_queryset = (
+			Habitat.objects.lean()
+			.prefetch_related(Prefetch("sources", queryset=OriginId.objects.select_related("source__basis")))
+			.filter(habitatrollup__taxonomy_id=taxonomy)
+		)
 
 		return Response(HabitatSerializer(filtered_habitats_queryset, many=True).data)
 
@@ -108,7 +123,7 @@ class IUCNDataListView(APIView):
 		if not taxon_id:
 			raise CBBAPIException("Missing taxonomy id parameter", code=400)
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except IUCNData.DoesNotExist:
 			raise CBBAPIException("Conservation status does not exist", code=404)
 
@@ -135,7 +150,7 @@ class SystemListView(APIView):
 			raise CBBAPIException("Missing taxonomy id parameter", 400)
 
 		try:
-			taxonomy = TaxonomicLevel.objects.get(id=taxonomy)
+			taxonomy = TaxonomicLevel.objects.lean().get(id=taxonomy)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
@@ -149,6 +164,169 @@ class SystemListView(APIView):
 		return Response(SystemSerializer(system).data)
 
 
+class TaxonProfileView(APIView):
+	@custom_swag_schema(
+		tags="Tags",
+		operation_id="Get the tags profile of taxa by ID",
+		operation_description=(
+			"Retrieve the tags, directives, habitats, IUCN assessments and system of several taxa at once, "
+			f"up to {TaxonProfileForm.MAX_TAXA}. The blocks of each taxon are the same as the ones of the "
+			"individual endpoints and are read with a fixed number of queries whatever the number of taxa."
+		),
+		manual_parameters=[
+			openapi.Parameter(
+				"taxonomy",
+				openapi.IN_QUERY,
+				description="Comma separated taxon IDs",
+				type=openapi.TYPE_STRING,
+				required=True,
+			)
+		],
+	)
+	def get(self, request):
+		profile_form = TaxonProfileForm(data=request.GET)
+
+		if not profile_form.is_valid():
+			raise CBBAPIException(profile_form.errors, 400)
+
+		taxon_ids = profile_form.cleaned_data.get("taxonomy")
+		if not taxon_ids:
+			raise CBBAPIException("Missing taxonomy id parameter", 400)
+
+		taxa = {
+			taxon["id"]: taxon
+			for taxon in TaxonomicLevel.objects.lean().filter(id__in=taxon_ids).values("id", "tree_id", "lft", "rght")
+		}
+		if len(taxa) != len(taxon_ids):
+			raise CBBAPIException("Taxonomic level does not exist", 404)
+
+		# Profiles are returned in the requested order
+		taxa = {taxon_id: taxa[taxon_id] for taxon_id in taxon_ids}
+
+		return Response(self.get_profiles(taxa))
+
+	@staticmethod
+	def get_queryset(model):
+		# The sources of all the rows are read with one query, their source and basis joined
+		return model.objects.lean().prefetch_related(
+			Prefetch("sources", queryset=OriginId.objects.select_related("source__basis"))
+		)
+
+	@staticmethod
+	def get_habitat_ids(taxa):
+		"""
+		Habitats of each taxon and its descendants, read from the habitat rollup with a single query.
+		"""
+		habitat_ids = {taxon_id: set() for taxon_id in taxa}
+		for taxonomy_id, habitat_id in HabitatRollup.objects.filter(taxonomy_id__in=taxa).values_list(
+			"taxonomy_id", "habitat_id"
+		):
+			habitat_ids[taxonomy_id].add(habitat_id)
+
+		return habitat_ids
+
+	def get_profiles(self, taxa):
+		tags = {taxon_id: [] for taxon_id in taxa}
+		for taxon_tag in self.get_queryset(TaxonTag).filter(taxonomy_id__in=taxa).select_related("tag"):
+			tags[taxon_tag.taxonomy_id].append(taxon_tag)
+
+		iucn = {taxon_id: [] for taxon_id in taxa}
+		for iucn_data in self.get_queryset(IUCNData).filter(taxonomy_id__in=taxa):
+			iucn[iucn_data.taxonomy_id].append(iucn_data)
+
+		directives = {
+			directive.taxonomy_id: directive for directive in self.get_queryset(Directive).filter(taxonomy_id__in=taxa)
+		}
+		systems = {system.taxonomy_id: system for system in self.get_queryset(System).filter(taxonomy_id__in=taxa)}
+
+		habitat_ids = self.get_habitat_ids(taxa)
+		habitats = {
+			habitat.id: habitat
+			for habitat in self.get_queryset(Habitat).filter(id__in=set().union(*habitat_ids.values()))
+		}
+
+		return [
+			{
+				"taxonomy": taxon_id,
+				"tags": TaxonTagSerializer(tags[taxon_id], many=True).data,
+				"directives": DirectiveSerializer(directives.get(taxon_id)).data,
+				"habitats": HabitatSerializer(
+					[habitats[habitat_id] for habitat_id in sorted(habitat_ids[taxon_id])], many=True
+				).data,
+				"iucn": IUCNDataSerializer(iucn[taxon_id], many=True).data,
+				"system": SystemSerializer(systems.get(taxon_id)).data,
+			}
+			for taxon_id in taxa
+		]
+
+
+class TaxonTagStatsView(APIView):
+	@custom_swag_schema(
+		tags="Tags",
+		operation_id="Get the tags distribution of a taxon subtree",
+		operation_description=(
+			"Count the accepted species of the subtree of a taxon per IUCN category of each region, "
+			"per degree of establishment and per system. `total` is the number of accepted species of the subtree."
+		),
+		manual_parameters=MANUAL_PARAMETERS,
+	)
+	def get(self, request):
+		taxon_form = TaxonomyForm(data=request.GET)
+
+		if not taxon_form.is_valid():
+			raise CBBAPIException(taxon_form.errors, 400)
+
+		taxonomy = taxon_form.cleaned_data.get("taxonomy", None)
+		if not taxonomy:
+			raise CBBAPIException("Missing taxonomy id parameter", 400)
+
+		taxon = TaxonomicLevel.objects.lean().filter(id=taxonomy).values("tree_id", "lft", "rght").first()
+		if not taxon:
+			raise CBBAPIException("Taxonomic level does not exist", 404)
+
+		return Response(batch_cached("tags_stats", {"taxonomy": taxonomy}, lambda: self.get_stats(taxon)))
+
+	@staticmethod
+	def get_stats(taxon):
+		assessments = [assessment for assessment, _ in IUCNData.CS_CHOICES]
+		systems = TaxonTraits.SYSTEM_FIELDS
+		tags = list(Tag.objects.filter(tag_type=Tag.DOE).order_by("name").values_list("id", "name"))
+
+		# A single aggregate over the traits row of every accepted species of the subtree
+		aggregates = {"total": Count("id")}
+		for region, field in TaxonTraits.IUCN_FIELDS.items():
+			for assessment in assessments:
+				aggregates[f"{field}_{assessment}"] = Count("id", filter=Q(**{f"traits__{field}": assessment}))
+		for system in systems:
+			aggregates[system] = Count("id", filter=Q(**{f"traits__{system}": True}))
+		for tag_id, _ in tags:
+			aggregates[f"tag_{tag_id}"] = Count("id", filter=Q(traits__doe_tag=tag_id))
+
+		counts = (
+			TaxonomicLevel.objects.lean()
+			.filter(
+				tree_id=taxon["tree_id"],
+				lft__gte=taxon["lft"],
+				lft__lte=taxon["rght"],
+				rank=TaxonomicLevel.SPECIES,
+				accepted=True,
+			)
+			.aggregate(**aggregates)
+		)
+
+		return {
+			"total": counts["total"],
+			"iucn": {
+				IUCNData.TRANSLATE_RG[region]: {
+					IUCNData.TRANSLATE_CS[assessment]: counts[f"{field}_{assessment}"] for assessment in assessments
+				}
+				for region, field in TaxonTraits.IUCN_FIELDS.items()
+			},
+			"degreeOfEstablishment": {name: counts[f"tag_{tag_id}"] for tag_id, name in tags},
+			"system": {system: counts[system] for system in systems},
+		}
+
+
 # class TaxonTagFilter:
 # 	def get(self, request):
 # 		taxon_data_form = TaxonTagForm(data=request.GET)
@@ -4,7 +4,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from apps.taxonomy.models import TaxonomicLevel
 from apps.versioning.models import OriginId, Batch, Source, Basis
-from common.utils.utils import get_or_create_source, is_batch_referenced
+from common.utils.utils import get_or_create_source, is_batch_referenced, refresh_source_counters
 from tqdm import tqdm
 
 EXTERNAL_ID = "image_id"
@@ -68,4 +68,5 @@ class Command(BaseCommand):
 			if exception:
 				raise Exception("Errors found: Rollback control")
 
+			refresh_source_counters([INATURALIST])
 			is_batch_referenced(batch)
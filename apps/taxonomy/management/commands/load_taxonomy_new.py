@@ -6,9 +6,10 @@ import traceback
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from apps.genetics.models import Sequence
 from apps.taxonomy.models import Authorship, TaxonomicLevel
 from apps.versioning.models import Batch, OriginId, Source, Basis
-from common.utils.utils import str_clean_up, get_or_create_source, is_batch_referenced
+from common.utils.utils import str_clean_up, get_or_create_source, is_batch_referenced, refresh_source_counters
 from tqdm import tqdm
 
 KINGDOM = "kingdom"
@@ -242,10 +243,12 @@ class Command(BaseCommand):
 				},
 			)
 
+			internal_names = set()
 			with TaxonomicLevel.objects.delay_mptt_updates():
 				for line in tqdm(list(csv_file), ncols=50, colour="yellow", smoothing=0, miniters=100, delay=20):
 					parent = biota
 					clean_up_input_line(line)
+					internal_names.add(line[SOURCE])
 					try:
 						for level in LEVELS:
 							parent = create_taxonomic_level(line, parent, batch, level, LEVELS_PARAMS[level])
@@ -256,4 +259,7 @@ class Command(BaseCommand):
 			if exception:
 				raise Exception("Errors found: Rollback control")
 
+			# The tree was rebuilt, so the taxon intervals copied to the sequences may have shifted
+			Sequence.update_taxonomy_intervals()
+			refresh_source_counters(internal_names)
 			is_batch_referenced(batch)
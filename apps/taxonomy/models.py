@@ -7,7 +7,7 @@ from django.db.models.functions import Substr, Lower, Upper
 from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel, TreeManager
 from apps.versioning.models import Batch, OriginId
-from common.utils.models import ReferencedModel, SynonymManager, SynonymModel
+from common.utils.models import LeanManagerMixin, ReferencedModel, SynonymManager, SynonymModel
 from common.utils.utils import str_clean_up
 
 
@@ -15,7 +15,7 @@ class Authorship(SynonymModel):
 	batch = models.ForeignKey(Batch, on_delete=models.CASCADE, null=True, blank=True, default=None)
 
 
-class TaxonomicLevelManager(SynonymManager, TreeManager):
+class TaxonomicLevelManager(LeanManagerMixin, SynonymManager, TreeManager):
 	def get_queryset(self):
 		qs = super().get_queryset()
 
@@ -18,6 +18,8 @@ class MinimalTaxonomicLevelSerializer(CaseModelSerializer):
 	class Meta:
 		model = TaxonomicLevel
 		fields = ["id", "name", "taxon_rank"]
+		# Species names are built from the parent genus
+		related_lookups = ["parent__parent"]
 
 
 class BaseTaxonomicLevelSerializer(CaseModelSerializer):
@@ -55,6 +57,7 @@ class BaseTaxonomicLevelSerializer(CaseModelSerializer):
 			"images",
 			"parent",
 		]
+		related_lookups = ["parent__parent"]
 
 
 class AncestorsTaxonomicLevelSerializer(BaseTaxonomicLevelSerializer):
@@ -86,6 +89,7 @@ class SearchTaxonomicLevelSerializer(CaseModelSerializer):
 	class Meta:
 		model = TaxonomicLevel
 		fields = ["id", "name", "taxon_rank", "scientific_name_authorship", "accepted", "accepted_modifier"]
+		related_lookups = ["parent__parent"]
 
 
 class TaxonomicFilterSerializer(AncestorsTaxonomicLevelSerializer):
@@ -108,6 +112,7 @@ class TaxonCompositionSerializer(BaseTaxonomicLevelSerializer):
 	class Meta:
 		model = TaxonomicLevel
 		fields = ["id", "name", "rank", "total_species"]
+		related_lookups = ["parent__parent"]
 
 
 class AuthorshipSerializer(serializers.ModelSerializer):
@@ -1,5 +1,8 @@
 from rest_framework import status
 
+from apps.tags.management.commands.load_taxon_tags import check_taxon
+from apps.taxonomy.models import TaxonomicLevel
+from apps.taxonomy.utils import TaxonResolver
 from common.utils.tests import TestResultHandler
 
 
@@ -512,3 +515,47 @@ class TaxonomyTest(TestResultHandler):
 		url = self._generate_url("taxonomy:authorship_crud", id=taxon_id)
 		response = self.client.get(url)
 		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_taxon_lean_lookup(self):
+		with self.assertNumQueries(1):
+			taxon = TaxonomicLevel.objects.lean().get(id=14)
+		self.assert_and_log(self.assertEqual, taxon.rank, TaxonomicLevel.SPECIES)
+
+	def test_taxon_resolver_normalized_names(self):
+		taxon = TaxonomicLevel.objects.lean().get(id=14)
+		genus = TaxonomicLevel.objects.lean().get(id=taxon.parent_id)
+		hybrid = TaxonomicLevel(
+			name="x  hybrida", rank=TaxonomicLevel.SPECIES, accepted=True, parent=genus, batch_id=taxon.batch_id
+		)
+		hybrid.save()
+		resolver = TaxonResolver()
+
+		# Accents and whitespace are ignored as by TaxonomicLevel.objects.find
+		for name, expected in [
+			(f"{genus.name.translate(str.maketrans('aeiou', 'áéíóú'))}\u00a0 {taxon.name}", taxon.id),
+			(f"{genus.name} x  Hybrida", hybrid.id),
+		]:
+			found = list(
+				TaxonomicLevel.objects.find(name).filter(rank=TaxonomicLevel.SPECIES).values_list("id", flat=True)
+			)
+			self.assert_and_log(self.assertEqual, found, [expected])
+			self.assert_and_log(self.assertEqual, resolver.find(name, TaxonomicLevel.SPECIES), [expected])
+
+	def test_taxon_tags_resolve_normalized_names(self):
+		taxon = TaxonomicLevel.objects.lean().get(id=14)
+		genus = TaxonomicLevel.objects.lean().get(id=taxon.parent_id)
+		line = {
+			"origin_taxon": f" {genus.name.translate(str.maketrans('aeiou', 'áéíóú'))}  {taxon.name.upper()} ",
+			"taxon_rank": "species",
+		}
+		self.assert_and_log(self.assertEqual, check_taxon(line, TaxonResolver()), taxon.id)
+
+	def test_taxon_crud_not_modified(self):
+		url = self._generate_url("taxonomy:taxon_crud", id=14)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		etag = response["ETag"]
+
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assert_and_log(self.assertEqual, response.status_code, status.HTTP_304_NOT_MODIFIED)
+		self.assert_and_log(self.assertEqual, response["ETag"], etag)
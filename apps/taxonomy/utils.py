@@ -1,7 +1,12 @@
+import re
+from collections import defaultdict
+
 from django.db.models import Subquery, OuterRef
 from django.db.models.functions import Coalesce
+from unidecode import unidecode
 
 from apps.taxonomy.models import TaxonomicLevel
+from common.utils.utils import str_clean_up
 
 
 def map_taxa_to_rank(ranks, taxa, authors=True):
@@ -32,6 +37,40 @@ def map_taxa_to_rank(ranks, taxa, authors=True):
 	return mapped_taxa
 
 
+class TaxonResolver:
+	"""
+	Resolves taxon names as `TaxonomicLevel.objects.find` does, against the whole tree read with a single query.
+	Names are compared as the SynonymManager does: cleaned up, transliterated to ASCII and case insensitive.
+	"""
+
+	def __init__(self):
+		self.by_name = defaultdict(list)
+		self.children = defaultdict(list)
+		self.ranks = {}
+
+		for taxon_id, parent_id, name, rank in (
+			TaxonomicLevel.objects.lean().order_by().values_list("id", "parent_id", "unidecode_name", "rank")
+		):
+			self.by_name[self.normalize(name)].append(taxon_id)
+			self.children[parent_id, self.normalize(name)].append(taxon_id)
+			self.ranks[taxon_id] = rank
+
+	@staticmethod
+	def normalize(name):
+		return unidecode(str_clean_up(name)).lower()
+
+	def find(self, taxon, rank):
+		levels = re.findall(r"\bx\s+[\w|-]+|[\w|-]+", taxon)
+		if len(levels) < 1:
+			return []
+
+		found = self.by_name.get(self.normalize(levels[0]), [])
+		for level in levels[1:]:
+			found = [child for parent in found for child in self.children.get((parent, self.normalize(level)), [])]
+
+		return [taxon_id for taxon_id in dict.fromkeys(found) if self.ranks[taxon_id] == rank]
+
+
 class ObjectTaxon(object):
 	pass
 
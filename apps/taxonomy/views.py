@@ -10,18 +10,19 @@ from drf_yasg import openapi
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_tracking.mixins import LoggingMixin
 from apps.API.exceptions import CBBAPIException
+from apps.API.mixins import BufferedLoggingMixin
 from apps.taxonomy.models import Authorship, TaxonomicLevel
 from apps.taxonomy.serializers import AuthorshipSerializer, BaseTaxonomicLevelSerializer, TaxonCompositionSerializer
 
 from apps.versioning.serializers import OriginIdSerializer
-from common.utils.serializers import get_paginated_response
+from common.utils.serializers import get_field_selection, get_paginated_response, get_serialized_data, plan_queryset
+from common.utils.counts import APPROX_PARAMETER, get_count
 from .forms import IdFieldForm, TaxonomicLevelChildrenForm, TaxonomicLevelForm
 from .utils import taxon_checklist_to_csv, generate_csv_taxon_list2
 from common.utils.utils import EchoWriter, PUNCTUATION_TRANSLATE, str_clean_up
 from common.utils.forms import TaxonomyForm
-from apps.tags.forms import IUCNDataForm, DirectiveForm, SystemForm, TaxonTagForm
+from apps.tags.forms import TRAIT_FORMS, get_trait_filters
 
 from common.utils.custom_swag_schema import custom_swag_schema
 
@@ -137,7 +138,7 @@ class TaxonFilter(TaxonSearch):
 		ancestor_id = taxon_form.cleaned_data.get("ancestor_id", False)
 		if ancestor_id:
 			try:
-				query = TaxonomicLevel.objects.get(id=ancestor_id).get_descendants()
+				query = TaxonomicLevel.objects.lean().get(id=ancestor_id).get_descendants()
 			except TaxonomicLevel.DoesNotExist:
 				raise CBBAPIException("Ancestor id not found", code=404)
 
@@ -153,42 +154,12 @@ class TaxonFilter(TaxonSearch):
 		if has_image is not None:
 			query = query.exclude(images__isnull=has_image)
 
-		filters = Q()
-		filtered_data = {}
-
 		name = taxon_form.cleaned_data.get("name", None)
 		if name:
 			query = self.search(request).exclude(~Q(id__in=query))
 
-		iucn_form = IUCNDataForm(data=request.GET)
-		if not iucn_form.is_valid():
-			raise CBBAPIException(iucn_form.errors, 400)
-		for key, value in iucn_form.cleaned_data.items():
-			if value != "":
-				filtered_data[f"iucndata__{key}"] = value
-
-		directive_form = DirectiveForm(data=request.GET)
-		if not directive_form.is_valid():
-			raise CBBAPIException(directive_form.errors, 400)
-		for key, value in directive_form.cleaned_data.items():
-			if value:
-				filtered_data[f"directive__{key}"] = value
-
-		system_form = SystemForm(data=request.GET)
-		if not system_form.is_valid():
-			raise CBBAPIException(system_form.errors, 400)
-		for key, value in system_form.cleaned_data.items():
-			if value:
-				filtered_data[f"system__{key}"] = value
-
-		tag_form = TaxonTagForm(data=request.GET)
-		if not tag_form.is_valid():
-			raise CBBAPIException(tag_form.errors, 400)
-		if tag_form.cleaned_data.get("tag", None):
-			filtered_data["taxontag__tag__name__iexact"] = tag_form.cleaned_data.get("tag")
-		for field, value in filtered_data.items():
-			if value is not None:
-				filters &= Q(**{field: value})
+		# IUCN, directive, system and tag filters are columns of a single traits row per taxon
+		filters = get_trait_filters(request.GET)
 
 		source = taxon_form.cleaned_data.get("source", None)
 		if source:
@@ -236,15 +207,15 @@ class TaxonListView(APIView, TaxonFilter):
 		return Response(get_paginated_response(request, self.get_taxon_list(request), TaxonomicFilterSerializer))
 
 
-class TaxonCountView(LoggingMixin, APIView, TaxonFilter):
+class TaxonCountView(BufferedLoggingMixin, APIView, TaxonFilter):
 	@custom_swag_schema(
 		tags="Taxonomy",
 		operation_id="Count filtered taxa",
 		operation_description="Get a count of taxa based on filters filters.",
-		manual_parameters=MANUAL_PARAMETERS,
+		manual_parameters=MANUAL_PARAMETERS + [APPROX_PARAMETER],
 	)
 	def get(self, request):
-		return Response(self.get_taxon_list(request).count())
+		return Response(get_count(request, self.get_taxon_list(request), TaxonomicLevelForm, *TRAIT_FORMS))
 
 
 # class TaxonSearchView(APIView, TaxonSearch):
@@ -364,12 +335,15 @@ class TaxonCRUDView(APIView):
 		if not taxon_id:
 			raise CBBAPIException("Missing id parameter", code=400)
 
+		selection = get_field_selection(request)
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = plan_queryset(TaxonomicLevel.objects.all(), BaseTaxonomicLevelSerializer, **selection).get(
+				id=taxon_id
+			)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", code=404)
 
-		return Response(BaseTaxonomicLevelSerializer(taxon).data)
+		return Response(BaseTaxonomicLevelSerializer(taxon, context=selection).data)
 
 
 class TaxonParentView(APIView):
@@ -393,13 +367,13 @@ class TaxonParentView(APIView):
 			raise CBBAPIException("Missing id parameter", 400)
 
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", 404)
 
 		ancestors = taxon.get_ancestors()
 
-		return Response(BaseTaxonomicLevelSerializer(ancestors, many=True).data)
+		return Response(get_serialized_data(request, BaseTaxonomicLevelSerializer, ancestors, many=True))
 
 
 class TaxonChildrenBaseView(APIView):
@@ -415,7 +389,7 @@ class TaxonChildrenBaseView(APIView):
 			raise CBBAPIException("Missing id parameter", code=400)
 
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist.", code=404)
 
@@ -460,10 +434,10 @@ class TaxonChildrenView(TaxonChildrenBaseView):
 		],
 	)
 	def get(self, request):
-		return Response(BaseTaxonomicLevelSerializer(super().get(request), many=True).data)
+		return Response(get_serialized_data(request, BaseTaxonomicLevelSerializer, super().get(request), many=True))
 
 
-class TaxonChildrenCountView(LoggingMixin, TaxonChildrenBaseView):
+class TaxonChildrenCountView(BufferedLoggingMixin, TaxonChildrenBaseView):
 	@custom_swag_schema(
 		tags="Taxonomy",
 		operation_id="Count taxon children",
@@ -514,13 +488,13 @@ class TaxonSistersView(APIView):
 
 		taxon_id = taxon_form.cleaned_data["taxonomy"]
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist.", code=404)
 
 		siblings = taxon.get_siblings(include_self=False)
 
-		return Response(BaseTaxonomicLevelSerializer(siblings, many=True).data)
+		return Response(get_serialized_data(request, BaseTaxonomicLevelSerializer, siblings, many=True))
 
 
 class TaxonomicLevelDescendantsCountView(APIView):
@@ -546,7 +520,7 @@ class TaxonomicLevelDescendantsCountView(APIView):
 
 		taxonomy = taxon_data_form.cleaned_data.get("id", None)
 		try:
-			taxon = TaxonomicLevel.objects.get(id=taxonomy)
+			taxon = TaxonomicLevel.objects.lean().get(id=taxonomy)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("TaxonomicLevel not found", code=404)
 
@@ -619,7 +593,7 @@ class TaxonCompositionView(ListAPIView):
 			raise CBBAPIException("Missing id parameter", code=400)
 
 		try:
-			children = TaxonomicLevel.objects.get(id=taxon_id).get_children().filter(accepted=True)
+			children = TaxonomicLevel.objects.lean().get(id=taxon_id).get_children().filter(accepted=True)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist.", code=404)
 
@@ -703,7 +677,7 @@ class TaxonChecklistView(APIView):
 			raise CBBAPIException("Missing id parameter", code=400)
 
 		try:
-			head_taxon = TaxonomicLevel.objects.get(id=taxon_id)
+			head_taxon = TaxonomicLevel.objects.lean().get(id=taxon_id)
 		except TaxonomicLevel.DoesNotExist:
 			raise CBBAPIException("Taxonomic level does not exist", code=404)
 
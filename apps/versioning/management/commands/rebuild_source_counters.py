@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.versioning.models import SourceCounter
+from common.utils.cache import bump_data_version
+
+
+class Command(BaseCommand):
+	help = "Recomputes the entity counters of every source"
+
+	def handle(self, *args, **options):
+		total = SourceCounter.refresh()
+		bump_data_version("rebuild_source_counters")
+		self.stdout.write(self.style.SUCCESS(f"Counters of {total} sources rebuilt"))
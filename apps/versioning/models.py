@@ -1,5 +1,9 @@
+from collections import Counter
+
+from django.apps import apps
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count
 from django.db.models.functions import Upper
 
 
@@ -23,6 +27,19 @@ class Batch(models.Model):
 		verbose_name_plural = "batches"
 
 
+class DataChange(models.Model):
+	"""
+	Change of the loaded data made outside a batch, e.g. by a maintenance command. Recording one invalidates the
+	cached API responses and results, see `common.utils.cache.bump_data_version`.
+	"""
+
+	reason = models.CharField(max_length=255)
+	created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+	def __str__(self):
+		return f"{self.created_at:%Y-%m-%d %H:%M}: {self.reason}"
+
+
 class Basis(models.Model):
 	DATABASE = 0
 	JOURNAL_ARTICLE = 1
@@ -217,3 +234,71 @@ class OriginId(models.Model):
 			models.Index(Upper("external_id"), name="originid_external_id_upper_idx"),
 		]
 		unique_together = ("external_id", "source")
+
+
+class SourceCounter(models.Model):
+	"""
+	Number of entities of a source, split by geography scope for occurrence sources. Entities are the origin ids of
+	the source, or the IUCN assessments and taxon tags linked to them for taxon data sources. Loaders refresh the
+	counters of the sources they load with `refresh()`.
+	"""
+
+	source = models.ForeignKey(Source, on_delete=models.CASCADE, related_name="counters")
+	in_geography_scope = models.BooleanField(null=True, default=None)
+	count = models.PositiveIntegerField(default=0)
+
+	class Meta:
+		unique_together = ["source", "in_geography_scope"]
+
+	def __str__(self):
+		return f"{self.source}: {self.count}"
+
+	@staticmethod
+	@transaction.atomic
+	def refresh(sources=None):
+		"""
+		Recompute the counters of a queryset of sources, or of all of them, with one grouped query per kind of source.
+		"""
+		sources = Source.objects.all() if sources is None else sources
+		source_ids = set(sources.values_list("id", flat=True))
+		counts = Counter()
+
+		origin_ids = OriginId.objects.filter(source_id__in=source_ids).order_by()
+		for source_id, count in (
+			origin_ids.exclude(source__data_type__in=[Source.OCCURRENCE, Source.TAXON_DATA])
+			.values("source_id")
+			.annotate(count=Count("id"))
+			.values_list("source_id", "count")
+		):
+			counts[source_id, None] += count
+
+		for source_id, in_geography_scope, count in (
+			origin_ids.filter(source__data_type=Source.OCCURRENCE)
+			.values("source_id", "occurrence__in_geography_scope")
+			.annotate(count=Count("id", distinct=True))
+			.values_list("source_id", "occurrence__in_geography_scope", "count")
+		):
+			counts[source_id, in_geography_scope] += count
+
+		for model_name in ["tags.IUCNData", "tags.TaxonTag"]:
+			through = apps.get_model(model_name).sources.through
+			for source_id, count in (
+				through.objects.filter(
+					originid__source_id__in=source_ids, originid__source__data_type=Source.TAXON_DATA
+				)
+				.order_by()
+				.values("originid__source_id")
+				.annotate(count=Count("id"))
+				.values_list("originid__source_id", "count")
+			):
+				counts[source_id, None] += count
+
+		SourceCounter.objects.filter(source_id__in=source_ids).delete()
+		SourceCounter.objects.bulk_create(
+			[
+				SourceCounter(source_id=source_id, in_geography_scope=in_geography_scope, count=count)
+				for (source_id, in_geography_scope), count in counts.items()
+			]
+		)
+
+		return len(source_ids)
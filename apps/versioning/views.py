@@ -1,4 +1,4 @@
-from django.db.models import OuterRef, Subquery, Count, IntegerField, Q, ManyToManyField, Sum
+from django.db.models import IntegerField, Q, ManyToManyField, Sum
 from django.db.models.functions import Coalesce
 from drf_yasg import openapi
 from rest_framework.response import Response
@@ -10,6 +10,7 @@ from apps.versioning.forms import BasisForm, OriginIdForm, SourceForm
 from apps.versioning.models import Basis, OriginId, Source
 from apps.versioning.serializers import BasisSerializer, OriginIdSerializer, SourceSerializer, SourceCountSerializer
 
+from common.utils.cache import batch_cached
 from common.utils.custom_swag_schema import custom_swag_schema
 
 
@@ -320,36 +321,17 @@ class SourceStatisticsFilter(APIView):
 		if not basis_id:
 			raise CBBAPIException("Missing id parameter", 400)
 
-		oq = (
-			OriginId.objects.filter(source=OuterRef("id"))
-			.exclude(source__data_type=Source.OCCURRENCE, occurrence__in_geography_scope=False)
-			.values("source")
-			.annotate(ent_count=Count("id"))
-			.values("ent_count")
-		)
-		sources = (
-			Source.objects.filter(basis_id=basis_id)
-			.exclude(data_type=Source.TAXON_DATA)
-			.annotate(count=Coalesce(Subquery(oq[:1]), 0))
-		)
-
-		oq_taxon_data = (
-			OriginId.objects.filter(
-				Q(iucndata__sources__source=OuterRef("id")) | Q(taxontag__sources__source=OuterRef("id"))
+		# Counters are maintained by the loaders, occurrences out of the geography scope are not counted
+		return Source.objects.filter(basis_id=basis_id).annotate(
+			count=Coalesce(
+				Sum(
+					"counters__count",
+					filter=Q(counters__in_geography_scope=True) | Q(counters__in_geography_scope__isnull=True),
+				),
+				0,
 			)
-			.values("source")
-			.annotate(ent_count=Count("id"))
-			.values("ent_count")
-		)
-		sources = sources.union(
-			Source.objects.filter(basis_id=basis_id, data_type=Source.TAXON_DATA).annotate(
-				count=Coalesce(Subquery(oq_taxon_data[:1]), 0)
-			),
-			all=True,
 		)
 
-		return sources.union(sources)
-
 
 class SourceStatisticsView(SourceStatisticsFilter):
 	@custom_swag_schema(
@@ -359,7 +341,13 @@ class SourceStatisticsView(SourceStatisticsFilter):
 		responses={200: "Success", 400: "Bad Request", 404: "Not Found"},
 	)
 	def get(self, request):
-		return Response(SourceCountSerializer(super().get(request).order_by("-count"), many=True).data)
+		queryset = super().get(request).order_by("-count")
+
+		return Response(
+			batch_cached(
+				"source_stats", request.GET.dict(), lambda: list(SourceCountSerializer(queryset, many=True).data)
+			)
+		)
 
 
 class SourceCountView(SourceFilter):
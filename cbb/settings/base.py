@@ -59,11 +59,15 @@ REST_FRAMEWORK = {
 	# 	"rest_framework_api_key.permissions.HasAPIKey",
 	# ]
 	"COERCE_DECIMAL_TO_STRING": False,
+	"DEFAULT_THROTTLE_RATES": {
+		"occurrence_export": "10/hour",
+	},
 }
 
 MPTT_ADMIN_LEVEL_INDENT = 0
 
 MIDDLEWARE = [
+	"API.middleware.RequestMetricsMiddleware",
 	"django.middleware.security.SecurityMiddleware",
 	"django.contrib.sessions.middleware.SessionMiddleware",
 	"corsheaders.middleware.CorsMiddleware",
@@ -72,9 +76,58 @@ MIDDLEWARE = [
 	"django.contrib.auth.middleware.AuthenticationMiddleware",
 	"django.contrib.messages.middleware.MessageMiddleware",
 	"django.middleware.clickjacking.XFrameOptionsMiddleware",
+	"API.middleware.BatchCacheMiddleware",
 	"API.middleware.DynamicSerializeMiddleware",
 ]
 
+# API responses are cached until a new batch is loaded or the data version is bumped, see
+# API.middleware.BatchCacheMiddleware.
+# API_CACHE selects the backend ("locmem", "file" or "redis", the latter needs the redis package) and
+# API_CACHE_LOCATION its directory or URL.
+API_CACHE_BACKENDS = {
+	"locmem": "django.core.cache.backends.locmem.LocMemCache",
+	"file": "django.core.cache.backends.filebased.FileBasedCache",
+	"redis": "django.core.cache.backends.redis.RedisCache",
+}
+CACHES = {
+	"default": {
+		"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+	},
+	"api": {
+		"BACKEND": API_CACHE_BACKENDS[os.environ.get("API_CACHE", "locmem")],
+		"LOCATION": os.environ.get("API_CACHE_LOCATION", root("cache", "api")),
+		"TIMEOUT": 60 * 60 * 24,
+	},
+	# Results of the expensive aggregates (common.utils.cache.batch_cached). Concurrent misses are coalesced
+	# across workers only when the backend is shared, so it defaults to files; RESULT_CACHE picks another backend.
+	"results": {
+		"BACKEND": API_CACHE_BACKENDS[os.environ.get("RESULT_CACHE", "file")],
+		"LOCATION": os.environ.get("RESULT_CACHE_LOCATION", root("cache", "results")),
+		"TIMEOUT": 60 * 60 * 24,
+	},
+}
+API_CACHE_ALIAS = "api"
+RESULT_CACHE_ALIAS = "results"
+API_CACHE_PREFIX = "/api/v1"
+# Exports change state without a new batch, the taxon counts log every request (API.mixins.BufferedLoggingMixin)
+API_CACHE_EXCLUDE = [
+	"/api/v1/occurrences/export",
+	"/api/v1/taxonomy/list/count",
+	"/api/v1/taxonomy/taxon/children/count",
+]
+API_CACHE_MAX_AGE = 0
+
+# Request logs of API.mixins.BufferedLoggingMixin, written in bulk by a background thread
+API_LOG_BATCH_SIZE = 100
+API_LOG_FLUSH_INTERVAL = 5
+API_LOG_MAX_QUEUE = 10_000
+API_LOG_SAMPLE_RATE = 1.0
+
+# Seconds between the additions of the metrics of a worker to the totals shared in the result cache
+API_METRICS_FLUSH_INTERVAL = 10
+# Bearer token of the /api/metrics scraper, without it only staff users can read the metrics
+API_METRICS_TOKEN = os.environ.get("API_METRICS_TOKEN")
+
 DATABASES = {
 	"default": {
 		"ENGINE": "django.contrib.gis.db.backends.postgis",
@@ -142,6 +195,12 @@ USE_TZ = True
 PUBLIC_DIR = root("public")
 STATIC_ROOT = join(PUBLIC_DIR, "static")
 STATIC_URL = "/static/"
+EXPORT_ROOT = join(PUBLIC_DIR, "exports")
+# Occurrence exports (apps.occurrences.export): how many run at once, seconds without progress before a running
+# export is failed, and seconds before an export and its file are deleted.
+EXPORT_MAX_RUNNING = 2
+EXPORT_STALE_AFTER = 60 * 30
+EXPORT_RETENTION = 60 * 60 * 24 * 7
 SILENCED_SYSTEM_CHECKS = ["urls.W002"]
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
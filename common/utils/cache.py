@@ -0,0 +1,179 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.db.models import Count, Max, Subquery
+
+from apps.versioning.models import Batch, DataChange
+
+# Cached results are invalidated by new batches and data changes, the timeout only bounds how long stale keys
+# are kept.
+BATCH_CACHE_TIMEOUT = 60 * 60 * 24
+STATS_PREFIX = "batch_cached_stats"
+STATS_EVENTS = ["hit", "miss", "wait"]
+
+_local_locks = [threading.RLock() for _ in range(64)]
+
+
+def get_batch_version():
+	"""
+	Version of the loaded data. It changes whenever a batch is created or deleted, or a change made outside
+	a batch is recorded with `bump_data_version`.
+
+	:return: A string identifying the current set of batches and data changes
+	"""
+	batches = Batch.objects.aggregate(
+		last=Max("id"),
+		total=Count("id"),
+		created_at=Max("created_at"),
+		# Aggregated so both tables are read in one query
+		change=Max(Subquery(DataChange.objects.order_by("-id").values("id")[:1])),
+	)
+	created_at = batches["created_at"].timestamp() if batches["created_at"] else 0
+
+	return f"{batches['last']}-{batches['total']}-{created_at:.0f}-{batches['change']}"
+
+
+def bump_data_version(reason):
+	"""
+	Record a change of the data made without a batch, so the cached API responses and results computed
+	before it are no longer used.
+
+	:param reason: What changed the data, e.g. the name of the management command
+	"""
+	DataChange.objects.create(reason=reason)
+
+
+def get_batch_cache_key(name, params):
+	"""
+	Build the cache key of a result for the given parameters and the current batch version.
+
+	:param name: Name of the cached result
+	:param params: Dict of the parameters the result depends on
+	:return: The cache key
+	"""
+	digest = hashlib.md5(repr(sorted(params.items())).encode()).hexdigest()
+
+	return f"{name}:{get_batch_version()}:{digest}"
+
+
+def get_result_cache():
+	return caches[settings.RESULT_CACHE_ALIAS]
+
+
+def is_shared_cache(cache):
+	"""
+	Whether the entries of a cache are seen by every worker. Local memory caches are private to each process.
+	"""
+	return not isinstance(cache, LocMemCache)
+
+
+@contextmanager
+def single_flight(key):
+	"""
+	Hold a lock shared by every worker for the given key: a Postgres advisory lock, or a file lock
+	in the temporary directory on other databases.
+
+	:param key: Key of the result being computed
+	"""
+	digest = hashlib.md5(key.encode()).digest()
+
+	if connection.vendor == "postgresql":
+		lock_id = int.from_bytes(digest[:8], "big", signed=True)
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id])
+			try:
+				yield
+			finally:
+				cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+	else:
+		with open(os.path.join(tempfile.gettempdir(), f"batch_cached_{digest.hex()}.lock"), "w") as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def local_flight(key):
+	"""
+	Hold a lock shared by the threads of this worker for the given key.
+
+	:param key: Key of the result being computed
+	"""
+	with _local_locks[int.from_bytes(hashlib.md5(key.encode()).digest()[:4], "big") % len(_local_locks)]:
+		yield
+
+
+def count_event(name, event):
+	result_cache = get_result_cache()
+	key = f"{STATS_PREFIX}:{name}:{event}"
+
+	# The name is registered along with its first counter in this cache
+	if result_cache.add(key, 0, None):
+		names = result_cache.get(f"{STATS_PREFIX}:names", set())
+		if name not in names:
+			result_cache.set(f"{STATS_PREFIX}:names", names | {name}, None)
+
+	try:
+		result_cache.incr(key)
+	except ValueError:
+		# Evicted between add and incr
+		result_cache.set(key, 1, None)
+
+
+def get_cache_stats():
+	"""
+	Hit, miss and wait counters of every cached result, shared by all the workers.
+	A wait is a miss answered by the worker that computed the result first.
+
+	:return: Dict of the counters by result name
+	"""
+	result_cache = get_result_cache()
+	names = sorted(result_cache.get(f"{STATS_PREFIX}:names", set()))
+	keys = [f"{STATS_PREFIX}:{name}:{event}" for name in names for event in STATS_EVENTS]
+	values = result_cache.get_many(keys)
+
+	return {name: {event: values.get(f"{STATS_PREFIX}:{name}:{event}", 0) for event in STATS_EVENTS} for name in names}
+
+
+def batch_cached(name, params, compute, timeout=BATCH_CACHE_TIMEOUT):
+	"""
+	Return the cached result for the parameters in the current batch version, computing and storing it on a miss.
+	Concurrent misses are coalesced: the first worker computes the result while the others wait for it.
+	When the result cache is private to each worker, only the threads of a worker are coalesced, since the
+	others could not read the result anyway.
+
+	:param name: Name of the cached result
+	:param params: Dict of the parameters the result depends on
+	:param compute: Callable without arguments returning the result, it must be picklable
+	:param timeout: Cache timeout in seconds
+	:return: The result
+	"""
+	result_cache = get_result_cache()
+	key = get_batch_cache_key(name, params)
+	result = result_cache.get(key)
+
+	if result is not None:
+		count_event(name, "hit")
+		return result
+
+	with single_flight(key) if is_shared_cache(result_cache) else local_flight(key):
+		result = result_cache.get(key)
+		if result is not None:
+			count_event(name, "wait")
+			return result
+
+		result = compute()
+		result_cache.set(key, result, timeout)
+		count_event(name, "miss")
+
+	return result
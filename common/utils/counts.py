@@ -0,0 +1,140 @@
+import math
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models.sql.datastructures import BaseTable
+from drf_yasg import openapi
+
+from common.utils.cache import batch_cached
+from common.utils.forms import ApproxCountForm
+
+# Tables with fewer live rows than this are always counted exactly.
+SAMPLE_TARGET_ROWS = 100_000
+# z-score of the reported confidence interval for sampled counts.
+CONFIDENCE = 0.95
+Z_SCORE = 1.96
+# Requests with at most this many filters are counted exactly once per data version and served from the result cache.
+LIGHT_FILTERS = 1
+# Form fields that only change how another filter is applied.
+FILTER_MODIFIERS = {"exact", "add_synonyms"}
+
+APPROX_PARAMETER = openapi.Parameter(
+	"approx",
+	openapi.IN_QUERY,
+	description="Return a fast approximate count together with its method and error bound",
+	type=openapi.TYPE_BOOLEAN,
+	required=False,
+	default=False,
+)
+
+
+def get_count(request, queryset, *form_classes):
+	"""
+	Count a queryset, exactly or approximately depending on the `approx` query parameter.
+
+	:param request: The HTTP request object
+	:param queryset: The queryset to be counted
+	:param form_classes: The forms the view filters the queryset with, only their fields count as filters
+	:return: The exact count as an integer, or a dict describing the approximate count
+	"""
+	if not ApproxCountForm.get_approx(request.GET):
+		return queryset.count()
+
+	# Forms translate the query parameters into field names, e.g. taxonRank into rank
+	filters = set()
+	for form_class in form_classes:
+		form = form_class(data=request.GET)
+		filters.update(name for name in form.fields if form.data.get(name) not in (None, ""))
+	filters -= FILTER_MODIFIERS
+
+	return approximate_count(queryset, lightly_filtered=len(filters) <= LIGHT_FILTERS)
+
+
+def approximate_count(queryset, lightly_filtered=False):
+	"""
+	Estimate the number of rows of a queryset without scanning the full filter joins.
+
+	- Small tables are counted exactly.
+	- Unfiltered or lightly filtered querysets are counted exactly, with a full COUNT, by the first request of
+	  each data version. The result is cached by query in the result cache and served to all the workers
+	  until the data changes.
+	- Other querysets run over a Bernoulli TABLESAMPLE of the base table and scale the result.
+	  The error bound is the half-width of the 95% confidence interval.
+
+	:param queryset: The queryset to be counted
+	:param lightly_filtered: Whether the queryset comes from a request with few filters
+	:return: Dict with the keys `count`, `approximate`, `method`, `error` and `confidence`
+	"""
+	try:
+		sql, params = queryset.order_by().query.sql_with_params()
+	except EmptyResultSet:
+		return _count_response(0, "exact")
+
+	live_rows = _get_live_rows(queryset.model._meta.db_table)
+
+	if live_rows is None or live_rows <= SAMPLE_TARGET_ROWS:
+		return _count_response(queryset.count(), "exact")
+
+	if lightly_filtered:
+		return _count_response(
+			batch_cached("approximate_count", {"sql": sql, "params": params}, queryset.count), "cached"
+		)
+
+	rate = SAMPLE_TARGET_ROWS / live_rows
+	sampled = _sampled_count(queryset, rate)
+
+	return _count_response(
+		round(sampled / rate),
+		"sample",
+		error=math.ceil(Z_SCORE * math.sqrt(max(sampled, 1) * (1 - rate)) / rate),
+		confidence=CONFIDENCE,
+	)
+
+
+def _count_response(count, method, error=0, confidence=1):
+	return {
+		"count": count,
+		"approximate": method == "sample",
+		"method": method,
+		"error": error,
+		"confidence": confidence,
+	}
+
+
+def _get_live_rows(table):
+	with connection.cursor() as cursor:
+		cursor.execute("SELECT n_live_tup FROM pg_stat_user_tables WHERE relid = %s::regclass", [table])
+		row = cursor.fetchone()
+
+	return row[0] if row else None
+
+
+class SampledTable(BaseTable):
+	"""
+	Base table of a query read through a repeatable Bernoulli sample of the given percentage of its rows.
+	"""
+
+	def __init__(self, table_name, alias, percentage):
+		super().__init__(table_name, alias)
+		self.percentage = percentage
+
+	def as_sql(self, compiler, connection):
+		sql, params = super().as_sql(compiler, connection)
+
+		return f"{sql} TABLESAMPLE BERNOULLI (%s) REPEATABLE (0)", [*params, self.percentage]
+
+	def relabeled_clone(self, change_map):
+		return self.__class__(self.table_name, change_map.get(self.table_alias, self.table_alias), self.percentage)
+
+	@property
+	def identity(self):
+		return self.__class__, self.table_name, self.table_alias, self.percentage
+
+
+def _sampled_count(queryset, rate):
+	sampled = queryset.order_by().values("pk")
+	alias = sampled.query.get_initial_alias()
+	base_table = sampled.query.alias_map[alias]
+	sampled.query.alias_map[alias] = SampledTable(base_table.table_name, base_table.table_alias, rate * 100)
+
+	return sampled.count()
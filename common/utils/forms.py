@@ -29,6 +29,18 @@ class PaginatorFieldForm(forms.Form):
 		return paginator_form.cleaned_data.get("page")
 
 
+class ApproxCountForm(forms.Form):
+	approx = forms.BooleanField(required=False)
+
+	@staticmethod
+	def get_approx(data):
+		approx_form = ApproxCountForm(data=data)
+		if not approx_form.is_valid():
+			raise CBBAPIException(approx_form.errors, code=400)
+
+		return approx_form.cleaned_data.get("approx")
+
+
 class CamelCaseForm(forms.Form):
 	TRANSLATE_FIELDS = {}
 
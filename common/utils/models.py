@@ -1,11 +1,28 @@
 from django.core.exceptions import ValidationError
 from django.contrib.gis.db import models
+from django.db.models import FloatField, Func, IntegerField, Value
+from django.db.models.functions import Cast, Floor
 from django.db.models.signals import m2m_changed, pre_delete
 from unidecode import unidecode
 
 from common.utils.utils import str_clean_up
 
 
+def coordinate(axis, field="location"):
+	"""
+	Longitude ("X") or latitude ("Y") of a location field computed in the database.
+	"""
+	return Func(Cast(field, models.GeometryField(srid=4326)), function=f"ST_{axis}", output_field=FloatField())
+
+
+def grid_cell(axis, cell_size, field="location"):
+	"""
+	Index of the square grid cell of side `cell_size` (degrees) that holds a location,
+	along the given axis ("X" for longitude, "Y" for latitude).
+	"""
+	return Cast(Floor(coordinate(axis, field) / Value(cell_size)), IntegerField())
+
+
 class LatLonModel(models.Model):
 	location = models.PointField(srid=4326, geography=True, null=True, blank=True)
 	coordinate_uncertainty_in_meters = models.PositiveIntegerField(null=True, blank=True, default=None)
@@ -16,8 +33,18 @@ class LatLonModel(models.Model):
 		abstract = True
 
 
+class LeanManagerMixin:
+	"""
+	Managers that prefetch relations by default for the serializers. `lean()` drops those prefetches
+	for lookups, counts, aggregates, value lists, loaders and exports, which never read them.
+	"""
+
+	def lean(self):
+		return self.get_queryset().prefetch_related(None)
+
+
 class ReferencedModel(models.Model):
-	class ReferencedManager(models.Manager):
+	class ReferencedManager(LeanManagerMixin, models.Manager):
 		def get_queryset(self):
 			qs = super().get_queryset()
 
@@ -0,0 +1,36 @@
+import numpy as np
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ColumnarRenderer(BaseRenderer):
+	"""
+	Render a dict of equally sized NumPy arrays as packed little-endian column buffers.
+
+	The body starts with the number of rows as a little-endian uint32, followed by the raw bytes of
+	every column in the order of the dict. The layout is described in the `X-Columns` header as
+	comma separated `name:dtype` pairs (e.g. `id:<i4,decimalLatitude:<f4`).
+
+	Error responses are rendered as JSON.
+	"""
+
+	media_type = "application/octet-stream"
+	format = "columnar"
+	charset = None
+	render_style = "binary"
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		response = (renderer_context or {}).get("response")
+
+		if response is not None and response.exception:
+			response["Content-Type"] = JSONRenderer.media_type
+			return JSONRenderer().render(data)
+
+		columns = {
+			name: np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<")) for name, values in data.items()
+		}
+		n_rows = len(next(iter(columns.values()))) if columns else 0
+
+		if response is not None:
+			response["X-Columns"] = ",".join(f"{name}:{values.dtype.str}" for name, values in columns.items())
+
+		return np.uint32(n_rows).astype("<u4").tobytes() + b"".join(values.tobytes() for values in columns.values())
@@ -1,4 +1,8 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
 from django.core.paginator import Paginator
+from django.db.models.query import ModelIterable, QuerySet
 from rest_framework import serializers
 from humps import camelize, decamelize
 
@@ -17,15 +21,195 @@ class CaseModelSerializer(BaseSerializer):
 	between camel case and snake case for responses and requests respectively.
 	"""
 
+	# Per class: field name -> (camelCase key, whether the value still has to be camelized)
+	_camel_keys = {}
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls._camel_keys = {}
+
+	def _get_camel_key(self, field_name):
+		camel_key = self._camel_keys.get(field_name)
+		if camel_key is None:
+			# Nested case serializers return camelized data already, anything else (method fields returning dicts,
+			# plain nested serializers) is camelized as before
+			field = self.fields[field_name]
+			nested = field.child if isinstance(field, serializers.ListSerializer) else field
+			camel_key = self._camel_keys[field_name] = (
+				camelize(field_name),
+				not isinstance(nested, CaseModelSerializer),
+			)
+
+		return camel_key
+
 	def to_representation(self, instance):
-		data = super().to_representation(instance)
-		data = camelize(data)
+		data = {}
+		for field_name, value in super().to_representation(instance).items():
+			key, convert = self._get_camel_key(field_name)
+			data[key] = camelize(value) if convert and isinstance(value, (list, dict)) else value
+
 		return data
 
 	def to_internal_value(self, data):
 		data = decamelize(data)
 		return super().to_internal_value(data)
 
+	def _is_response_root(self):
+		return self.parent is None or (
+			isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None
+		)
+
+	def get_fields(self):
+		"""
+		Sparse fieldsets: `choice` keeps only the given fields of the root serializer, `exclude` drops the given
+		fields at any nesting level. Both hold camelCase keys and are passed through the serializer context.
+		"""
+		fields = super().get_fields()
+		choice = self.context.get("choice")
+		exclude = self.context.get("exclude")
+
+		if choice and self._is_response_root():
+			fields = {name: field for name, field in fields.items() if camelize(name) in choice}
+		if exclude:
+			fields = {name: field for name, field in fields.items() if camelize(name) not in exclude}
+
+		return fields
+
+
+def get_field_selection(request):
+	"""
+	`choice` and `exclude` query parameters of a request, as the serializer context of a sparse fieldset.
+	"""
+	selection = {}
+	for param in ["choice", "exclude"]:
+		value = request.GET.get(param)
+		selection[param] = frozenset(value.split(",")) if value else None
+
+	return selection
+
+
+def _get_relation(model, name):
+	try:
+		field = model._meta.get_field(name)
+	except FieldDoesNotExist:
+		# Reverse relations are reached by their accessor, e.g. `iucndata_set`
+		field = next((rel for rel in model._meta.related_objects if rel.get_accessor_name() == name), None)
+
+	return field if field is not None and field.is_relation else None
+
+
+def _plan_lookup(model, prefix, names, many, select, prefetch):
+	for name in names:
+		field = _get_relation(model, name)
+		if field is None:
+			return None, many, prefix
+
+		prefix = f"{prefix}__{name}" if prefix else name
+		many = many or field.many_to_many or field.one_to_many
+		lookups = prefetch if many else select
+		if prefix not in lookups:
+			lookups.append(prefix)
+		model = field.related_model
+
+	return model, many, prefix
+
+
+def _plan_serializer(serializer, model, prefix, many, select, prefetch):
+	# Relations read by method fields or properties cannot be introspected and are declared in the Meta
+	if any(field.source == "*" for field in serializer.fields.values()):
+		for lookup in getattr(serializer.Meta, "related_lookups", ()):
+			_plan_lookup(model, prefix, lookup.split("__"), many, select, prefetch)
+
+	for field in serializer.fields.values():
+		if field.source == "*":
+			continue
+
+		if isinstance(field, serializers.ListSerializer):
+			nested = field.child
+		elif isinstance(field, serializers.ManyRelatedField):
+			nested = field.child_relation
+		else:
+			# A single primary key is read from the foreign key column
+			nested = None if isinstance(field, serializers.PrimaryKeyRelatedField) else field
+
+		if not isinstance(nested, (serializers.BaseSerializer, serializers.RelatedField)):
+			continue
+
+		related_model, related_many, path = _plan_lookup(model, prefix, field.source_attrs, many, select, prefetch)
+		if related_model is not None and isinstance(nested, serializers.ModelSerializer):
+			_plan_serializer(nested, related_model, path, related_many, select, prefetch)
+
+
+@lru_cache(maxsize=None)
+def get_field_names(serializer_class):
+	"""
+	camelCase names of the fields of a serializer class and of its nested serializers.
+	"""
+	names = set()
+
+	def add_fields(serializer):
+		for name, field in serializer.fields.items():
+			names.add(camelize(name))
+			nested = field.child if isinstance(field, serializers.ListSerializer) else field
+			if isinstance(nested, serializers.Serializer):
+				add_fields(nested)
+
+	add_fields(serializer_class(context={}))
+
+	return frozenset(names)
+
+
+@lru_cache(maxsize=1024)
+def get_query_plan(serializer_class, choice=None, exclude=None):
+	"""
+	Relations read by a serializer class and its nested serializers, as `(select_related, prefetch_related)`
+	lookups. Single relations reached through single relations are joined, anything behind a to-many
+	relation is prefetched. The serializer tree is walked once per class and field selection.
+	"""
+	model = getattr(getattr(serializer_class, "Meta", None), "model", None)
+	if model is None:
+		return (), ()
+
+	select, prefetch = [], []
+	serializer = serializer_class(context={"choice": choice, "exclude": exclude})
+	_plan_serializer(serializer, model, "", False, select, prefetch)
+
+	return tuple(select), tuple(prefetch)
+
+
+def plan_queryset(queryset, serializer_class, choice=None, exclude=None):
+	"""
+	Apply the query plan of a serializer class to a queryset, so the number of queries does not grow with
+	the number of serialized rows. Plain lookups already on the queryset, including the manager defaults,
+	are replaced by the plan; `Prefetch` objects set by the view are kept. Fields left out by `choice`
+	and `exclude` are left out of the plan too.
+	"""
+	if not isinstance(queryset, QuerySet) or queryset._iterable_class is not ModelIterable:
+		return queryset
+
+	# The selection comes from the query string, only actual field names are part of the cached plan's key
+	field_names = get_field_names(serializer_class)
+	choice = choice & field_names if choice is not None else None
+	exclude = exclude & field_names if exclude is not None else None
+
+	select, prefetch = get_query_plan(serializer_class, choice, exclude)
+	custom = [lookup for lookup in queryset._prefetch_related_lookups if not isinstance(lookup, str)]
+	queryset = queryset.prefetch_related(None).prefetch_related(*custom, *prefetch)
+
+	return queryset.select_related(*select) if select else queryset
+
+
+def get_serialized_data(request, serializer_class, instance, many=False):
+	"""
+	Serialize the root data of a response with the sparse fieldset of the request, planning the queries
+	of a queryset for the selected fields only.
+	"""
+	selection = get_field_selection(request)
+	if many:
+		instance = plan_queryset(instance, serializer_class, **selection)
+
+	return serializer_class(instance, many=many, context=selection).data
+
 
 def get_paginated_response(request, queryset, serializer_class, page_size=15):
 	"""
@@ -37,12 +221,14 @@ def get_paginated_response(request, queryset, serializer_class, page_size=15):
 	:param page_size: Number of items per page (default: 15)
 	:return: Response object with paginated data
 	"""
-	paginator = Paginator(queryset, page_size)
+	# `choice` selects keys of the page envelope, only `exclude` reaches the serialized items
+	exclude = get_field_selection(request)["exclude"]
+	paginator = Paginator(plan_queryset(queryset, serializer_class, exclude=exclude), page_size)
 	page = PaginatorFieldForm.get_page(request.GET)
 	try:
 		items = paginator.page(page)
 	except:
 		items = []
-	serialized_data = serializer_class(items, many=True).data
+	serialized_data = serializer_class(items, many=True, context={"exclude": exclude}).data
 
 	return {"total": paginator.count, "pages": paginator.num_pages, "data": serialized_data}
@@ -1,9 +1,11 @@
 import re
 import string
-from apps.versioning.models import Source, Basis, OriginId
+import time
+from itertools import islice
+from apps.versioning.models import Source, Basis, OriginId, SourceCounter
 
 from django.apps import apps
-from django.db.models import ForeignKey
+from django.db.models import Exists, ForeignKey, OuterRef, Q
 from django.http import HttpResponse
 import csv
 
@@ -105,6 +107,22 @@ def get_or_create_source(source_type, extraction_method, data_type, batch, inter
 	return source
 
 
+def refresh_source_counters(internal_names):
+	"""
+	Refresh the entity counters of the sources of the bases with the given internal names, matched as in
+	`get_or_create_source`. Loaders call it with the bases they loaded.
+
+	Args:
+		internal_names: The internal names of the bases.
+	"""
+	bases = Q()
+	for internal_name in set(filter(None, internal_names)):
+		bases |= Q(basis__internal_name__iexact=internal_name.strip())
+
+	if bases:
+		SourceCounter.refresh(Source.objects.filter(bases))
+
+
 def get_or_create_source_with_dataset_key(internal_name, dataset_key, batch):
 	try:
 		data_type = Source.TRANSLATE_DATA_TYPE["dataset_key"]
@@ -140,6 +158,120 @@ def is_batch_referenced(batch):
 	batch.delete()
 
 
+def chunked(iterable, size: int):
+	"""
+	Split an iterable into lists of at most `size` elements.
+
+	Args:
+		iterable: The iterable to split. It is consumed lazily.
+		size (int): The maximum number of elements of each chunk.
+
+	Yields:
+		list: The next chunk of elements.
+	"""
+	iterator = iter(iterable)
+	while chunk := list(islice(iterator, size)):
+		yield chunk
+
+
+def get_or_create_origin_ids(source, external_ids, chunk_size=5000):
+	"""
+	Get or create the OriginIds of a source for many external ids, with one query and one insert per chunk.
+
+	Args:
+		source (Source): The source of the OriginIds.
+		external_ids: The external ids to look up.
+		chunk_size (int): The maximum number of external ids per query.
+
+	Returns:
+		dict: The OriginId id of every external id, keyed by the external id as a string, as stored.
+	"""
+	origin_ids = {}
+	for chunk in chunked({str(external_id) for external_id in external_ids}, chunk_size):
+		origin_ids.update(
+			OriginId.objects.filter(source=source, external_id__in=chunk)
+			.values_list("external_id", "id")
+			.order_by("-id")
+		)
+		missing = [
+			OriginId(source=source, external_id=external_id) for external_id in chunk if external_id not in origin_ids
+		]
+		origin_ids.update((origin.external_id, origin.id) for origin in OriginId.objects.bulk_create(missing))
+
+	return origin_ids
+
+
+def upsert_with_sources(model, rows, unique_fields, batch, chunk_size=5000):
+	"""
+	Insert or update many rows of a ReferencedModel with INSERT ... ON CONFLICT and replace the sources of each
+	row by a single OriginId, with a fixed number of statements per chunk.
+
+	Args:
+		model: The ReferencedModel class, with a unique constraint on `unique_fields`.
+		rows (dict): Maps the tuple of `unique_fields` values of each row, ids for foreign keys, to a tuple of the
+			dict of the other field values and the OriginId id of its source.
+		unique_fields (list): The names of the fields identifying a row.
+		batch (Batch): The batch of the inserted and updated rows.
+		chunk_size (int): The maximum number of rows per statement.
+
+	Returns:
+		set: The ids of the OriginIds that were linked to the rows before and are not anymore.
+	"""
+	through = model.sources.through
+	object_field = f"{model.sources.field.m2m_field_name()}_id"
+	origin_field = f"{model.sources.field.m2m_reverse_field_name()}_id"
+	# Keys hold ids, which foreign keys only accept through their attname, e.g. taxonomy_id
+	unique_attnames = [model._meta.get_field(field).attname for field in unique_fields]
+	unlinked = set()
+
+	for chunk in chunked(rows.items(), chunk_size):
+		chunk = dict(chunk)
+		update_fields = ["batch", *next(iter(chunk.values()))[0]]
+		model.objects.bulk_create(
+			[model(**dict(zip(unique_attnames, key)), **fields, batch=batch) for key, (fields, _) in chunk.items()],
+			update_conflicts=True,
+			unique_fields=unique_fields,
+			update_fields=update_fields,
+		)
+
+		# The ids of the updated rows are not returned by the insert
+		ids = {}
+		existing = model.objects.lean().filter(**{f"{unique_fields[0]}__in": {key[0] for key in chunk}})
+		for values in existing.values_list("id", *unique_fields):
+			ids[tuple(values[1:])] = values[0]
+		links = {ids[key]: origin_id for key, (_, origin_id) in chunk.items()}
+
+		previous = through.objects.filter(**{f"{object_field}__in": links})
+		unlinked.update(previous.values_list(origin_field, flat=True))
+		previous.delete()
+		through.objects.bulk_create(
+			[through(**{object_field: object_id, origin_field: origin_id}) for object_id, origin_id in links.items()]
+		)
+
+	return unlinked - {origin_id for _, origin_id in rows.values()}
+
+
+def delete_orphan_origin_ids(origin_ids):
+	"""
+	Delete the given OriginIds that are not referenced by any model anymore.
+
+	Args:
+		origin_ids: The ids of the candidate OriginIds.
+
+	Returns:
+		int: The number of deleted OriginIds.
+	"""
+	orphans = OriginId.objects.filter(id__in=origin_ids)
+	for relation in OriginId._meta.related_objects:
+		if relation.many_to_many:
+			references = relation.through.objects.filter(**{relation.field.m2m_reverse_field_name(): OuterRef("id")})
+		else:
+			references = relation.related_model.objects.filter(**{relation.field.name: OuterRef("id")})
+		orphans = orphans.exclude(Exists(references))
+
+	return orphans.delete()[0]
+
+
 class EchoWriter:
 	"""
 	An object that implements just the write method of the file-like
@@ -150,6 +282,29 @@ class EchoWriter:
 		return value
 
 
+class QueryTimer:
+	"""
+	Database execute wrapper counting the queries run and the time spent in them.
+	Use with `connection.execute_wrapper(timer)`.
+	"""
+
+	def __init__(self):
+		self.queries = 0
+		self.seconds = 0.0
+
+	def __call__(self, execute, sql, params, many, context):
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.queries += 1
+			self.seconds += time.perf_counter() - start
+
+	@property
+	def ms(self):
+		return int(self.seconds * 1000)
+
+
 def flatten_row(data: list, keys_to_flatten: list):
 	"""
 	Flatten specified nested list fields in a list of dictionaries into a flat list of dictionaries.